@@ -0,0 +1,395 @@
+import io
+import os
+import mmap
+import struct
+import sys
+import time
+import zlib
+import zipfile
+from array import array
+
+# Сигнатуры и форматы записей ZIP (APPNOTE.TXT)
+EOCD_SIG = b'PK\x05\x06'
+EOCD64_SIG = b'PK\x06\x06'
+EOCD64_LOCATOR_SIG = b'PK\x06\x07'
+CENTRAL_SIG = b'PK\x01\x02'
+LOCAL_SIG = b'PK\x03\x04'
+
+EOCD = struct.Struct('<4s4H2LH')
+EOCD64 = struct.Struct('<4sQ2H2L4Q')
+EOCD64_LOCATOR = struct.Struct('<4sLQL')
+CENTRAL = struct.Struct('<4s6H3L5H2L')
+LOCAL = struct.Struct('<4s5H3L2H')
+
+# Формат файла-индекса рядом с архивом: заголовок, затем столбцы по count значений
+# (смещение заголовка, сжатый размер, размер, CRC, метод) и имена через '\0'.
+# Столбцы читаются целиком в array, без разбора по записям
+SIDECAR_MAGIC = b'ZIDX\x02\x00'
+SIDECAR_HEADER = struct.Struct('<6sQQL')
+SIDECAR_COLUMNS = ('Q', 'Q', 'Q', 'I', 'H')
+
+
+class MemberInfo:
+    __slots__ = ('filename', 'header_offset', 'compress_size', 'file_size', 'CRC', 'compress_type')
+
+    def __init__(self, filename, header_offset, compress_size, file_size, crc, compress_type):
+        self.filename = filename
+        self.header_offset = header_offset
+        self.compress_size = compress_size
+        self.file_size = file_size
+        self.CRC = crc
+        self.compress_type = compress_type
+
+    def is_dir(self):
+        return self.filename.endswith('/')
+
+
+class MemberReader(io.RawIOBase):
+    # Потоковое чтение записи прямо из mmap, без копирования всего содержимого
+    def __init__(self, view, info):
+        self.view = view
+        self.info = info
+        self.pos = 0
+        self.crc = 0
+        self.size = 0
+        self.tail = b''  # сжатые данные, которые распаковщик еще не принял (unconsumed_tail)
+        self.pending = b''  # остаток после flush(), не больше внутреннего буфера zlib
+        self.finished = False
+        if info.compress_type == zipfile.ZIP_DEFLATED:
+            self.decompressor = zlib.decompressobj(-15)
+        elif info.compress_type == zipfile.ZIP_STORED:
+            self.decompressor = None
+        else:
+            raise NotImplementedError(f"Unsupported compression method {info.compress_type}: {info.filename}")
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+    def _next(self, wanted):
+        # Не больше wanted байт следующей порции; b'' - запись прочитана до конца.
+        # Распаковка ограничена max_length, поэтому каждый вызов стоит O(wanted)
+        if self.pending:
+            data, self.pending = self.pending[:wanted], self.pending[wanted:]
+            return data
+        if self.decompressor is None:
+            if self.finished or self.pos >= len(self.view):
+                self.finished = True
+                return b''
+            data = bytes(self.view[self.pos:self.pos + wanted])
+            self.pos += len(data)
+            self.finished = self.pos >= len(self.view)
+            return data
+        while True:
+            if not self.tail:
+                if self.pos >= len(self.view):
+                    self.pending = self.decompressor.flush()
+                    self.decompressor = None
+                    self.finished = True
+                    return self._next(wanted)
+                self.tail = self.view[self.pos:self.pos + 64 * 1024]
+                self.pos += len(self.tail)
+            data = self.decompressor.decompress(self.tail, wanted)
+            self.tail = self.decompressor.unconsumed_tail
+            if data:
+                return data
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self.info.file_size - self.size
+        parts = []
+        wanted = size
+        while wanted > 0:
+            data = self._next(wanted)
+            if not data:
+                break
+            parts.append(data)
+            wanted -= len(data)
+        data = parts[0] if len(parts) == 1 else b''.join(parts)
+        if not self.finished and self.size + len(data) >= self.info.file_size:
+            # Прочитан заявленный размер: дочитываем поток до конца, чтобы проверить CRC
+            self.pending = self._next(1) + self.pending
+        self.size += len(data)
+        self.crc = zlib.crc32(data, self.crc)
+        if self.finished and not self.pending and self.crc != self.info.CRC:
+            raise zipfile.BadZipFile(f"Bad CRC-32 for file {self.info.filename!r}")
+        return data
+
+    def close(self):
+        self.view.release()
+        super().close()
+
+
+class MmapZipArchive:
+    # Альтернатива zipfile.ZipFile: архив отображается в память,
+    # центральный каталог разбирается только при первом обращении к записям,
+    # а готовый список записей сохраняется столбцами в файл <archive>.idx
+    def __init__(self, path, sidecar=True):
+        self.filename = path
+        self.sidecar_path = path + '.idx' if sidecar else None
+        with open(path, 'rb') as file:
+            stat = os.fstat(file.fileno())
+            self.stamp = (stat.st_mtime_ns, stat.st_size)
+            if stat.st_size == 0:
+                raise zipfile.BadZipFile(f"File is not a zip file: {path}")
+            self.map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._table = None
+        self._by_name = None
+        try:
+            self.cd_offset, self.cd_size, self.count = self._find_central_directory()
+        except Exception:
+            self.map.close()
+            raise
+
+    def _find_central_directory(self):
+        # EOCD находится в последних 64 КиБ + 22 байта (комментарий архива)
+        start = max(0, len(self.map) - EOCD.size - 0xFFFF)
+        pos = self.map.rfind(EOCD_SIG, start)
+        if pos < 0 or pos + EOCD.size > len(self.map):
+            raise zipfile.BadZipFile(f"File is not a zip file: {self.filename}")
+        _, _, _, _, count, cd_size, cd_offset, _ = EOCD.unpack_from(self.map, pos)
+
+        locator = pos - EOCD64_LOCATOR.size
+        if locator >= 0 and self.map[locator:locator + 4] == EOCD64_LOCATOR_SIG:
+            _, _, eocd64_offset, _ = EOCD64_LOCATOR.unpack_from(self.map, locator)
+            sig, _, _, _, _, _, _, count, cd_size, cd_offset = EOCD64.unpack_from(self.map, eocd64_offset)
+            if sig != EOCD64_SIG:
+                raise zipfile.BadZipFile("Corrupt zip64 end of central directory record")
+        return cd_offset, cd_size, count
+
+    def _load_sidecar(self):
+        if not self.sidecar_path:
+            return None
+        try:
+            with open(self.sidecar_path, 'rb') as file:
+                data = file.read()
+            magic, mtime_ns, size, count = SIDECAR_HEADER.unpack_from(data, 0)
+            if magic != SIDECAR_MAGIC or (mtime_ns, size) != self.stamp:
+                return None
+            pos = SIDECAR_HEADER.size
+            columns = []
+            for code in SIDECAR_COLUMNS:
+                column = array(code)
+                end = pos + column.itemsize * count
+                column.frombytes(data[pos:end])
+                if sys.byteorder != 'little':
+                    column.byteswap()
+                columns.append(column)
+                pos = end
+            names = data[pos:].decode('utf-8').split('\0') if count else []
+            if len(names) != count or len(columns[-1]) != count:
+                return None
+            return (names, *columns)
+        except (OSError, struct.error, UnicodeDecodeError, ValueError):
+            return None
+
+    def _save_sidecar(self, table):
+        if not self.sidecar_path:
+            return
+        names = table[0]
+        if any('\0' in name for name in names):
+            return
+        parts = [SIDECAR_HEADER.pack(SIDECAR_MAGIC, self.stamp[0], self.stamp[1], len(names))]
+        for column in table[1:]:
+            if sys.byteorder != 'little':
+                column = array(column.typecode, column)
+                column.byteswap()
+            parts.append(column.tobytes())
+        parts.append('\0'.join(names).encode('utf-8'))
+        tmp_path = self.sidecar_path + '.tmp'
+        try:
+            with open(tmp_path, 'wb') as file:
+                file.write(b''.join(parts))
+            os.replace(tmp_path, self.sidecar_path)
+        except OSError:
+            # Индекс - только ускорение, без него архив по-прежнему читается
+            pass
+
+    def _load_table(self):
+        # Записи хранятся столбцами (имена, смещения, размеры, CRC, методы);
+        # MemberInfo создается только для запрошенных записей
+        if self._table is None:
+            table = self._load_sidecar()
+            if table is None:
+                table = ([], *(array(code) for code in SIDECAR_COLUMNS))
+                for info in self.iter_central_directory():
+                    table[0].append(info.filename)
+                    table[1].append(info.header_offset)
+                    table[2].append(info.compress_size)
+                    table[3].append(info.file_size)
+                    table[4].append(info.CRC)
+                    table[5].append(info.compress_type)
+                self._save_sidecar(table)
+            self._table = table
+        return self._table
+
+    def _info(self, row):
+        names, offsets, compress_sizes, file_sizes, crcs, methods = self._table
+        return MemberInfo(names[row], offsets[row], compress_sizes[row], file_sizes[row], crcs[row], methods[row])
+
+    def iter_central_directory(self):
+        pos = self.cd_offset
+        end = self.cd_offset + self.cd_size
+        while pos < end:
+            (sig, _, _, flags, method, _, _, crc, compress_size, file_size,
+             name_len, extra_len, comment_len, _, _, _, header_offset) = CENTRAL.unpack_from(self.map, pos)
+            if sig != CENTRAL_SIG:
+                raise zipfile.BadZipFile("Bad magic number for central directory")
+            pos += CENTRAL.size
+            raw_name = self.map[pos:pos + name_len]
+            name = raw_name.decode('utf-8' if flags & 0x800 else 'cp437')
+            extra = self.map[pos + name_len:pos + name_len + extra_len]
+            if 0xFFFFFFFF in (compress_size, file_size, header_offset):
+                file_size, compress_size, header_offset = self._zip64_extra(extra, file_size, compress_size, header_offset)
+            pos += name_len + extra_len + comment_len
+            yield MemberInfo(name, header_offset, compress_size, file_size, crc, method)
+
+    @staticmethod
+    def _zip64_extra(extra, file_size, compress_size, header_offset):
+        pos = 0
+        while pos + 4 <= len(extra):
+            tag, size = struct.unpack_from('<2H', extra, pos)
+            if tag == 0x0001:
+                values = iter(struct.unpack_from(f'<{size // 8}Q', extra, pos + 4))
+                if file_size == 0xFFFFFFFF:
+                    file_size = next(values)
+                if compress_size == 0xFFFFFFFF:
+                    compress_size = next(values)
+                if header_offset == 0xFFFFFFFF:
+                    header_offset = next(values)
+                break
+            pos += 4 + size
+        return file_size, compress_size, header_offset
+
+    def infolist(self):
+        table = self._load_table()
+        return [self._info(row) for row in range(len(table[0]))]
+
+    def namelist(self):
+        return list(self._load_table()[0])
+
+    def getinfo(self, name):
+        if self._by_name is None:
+            # При повторяющихся именах побеждает последняя запись, как в zipfile
+            self._by_name = {name: row for row, name in enumerate(self._load_table()[0])}
+        return self._info(self._by_name[name])
+
+    def open(self, name, mode='r'):
+        if mode != 'r':
+            raise ValueError("MmapZipArchive is read-only")
+        info = name if isinstance(name, MemberInfo) else self.getinfo(name)
+        sig, _, flags, _, _, _, _, _, _, name_len, extra_len = LOCAL.unpack_from(self.map, info.header_offset)
+        if sig != LOCAL_SIG:
+            raise zipfile.BadZipFile(f"Bad magic number for file header: {info.filename}")
+        if flags & 0x1:
+            raise NotImplementedError(f"Encrypted members are not supported: {info.filename}")
+        start = info.header_offset + LOCAL.size + name_len + extra_len
+        view = memoryview(self.map)[start:start + info.compress_size]
+        return io.BufferedReader(MemberReader(view, info), buffer_size=64 * 1024)
+
+    def close(self):
+        try:
+            self.map.close()
+        except BufferError:
+            # Остались незакрытые потоки; отображение освободится вместе с ними
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class RawZipWriter:
+    # Запись нового архива: неизмененные записи копируются в сжатом виде,
+    # без распаковки и повторного сжатия
+    def __init__(self, path):
+        self.file = open(path, 'wb')
+        self.entries = []
+
+    @staticmethod
+    def dos_time(timestamp=None):
+        t = time.localtime(timestamp)
+        return ((t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2),
+                ((t.tm_year - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday)
+
+    def _write_header(self, name, flags, method, dos_time, dos_date, crc, compress_size, file_size, external_attr):
+        name_bytes = name.encode('utf-8')
+        if not name.isascii():
+            flags |= 0x800
+        # Бит 3 (дескриптор данных) снимается: размеры известны заранее
+        flags &= ~0x8
+        zip64 = compress_size >= 0xFFFFFFFF or file_size >= 0xFFFFFFFF
+        extra = struct.pack('<2H2Q', 0x0001, 16, file_size, compress_size) if zip64 else b''
+        offset = self.file.tell()
+        self.file.write(LOCAL.pack(LOCAL_SIG, 45 if zip64 else 20, flags, method, dos_time, dos_date, crc,
+                                   0xFFFFFFFF if zip64 else compress_size, 0xFFFFFFFF if zip64 else file_size,
+                                   len(name_bytes), len(extra)))
+        self.file.write(name_bytes)
+        self.file.write(extra)
+        self.entries.append((name_bytes, flags, method, dos_time, dos_date, crc,
+                             compress_size, file_size, offset, external_attr))
+
+    def add_dir(self, name):
+        self._write_header(name.rstrip('/') + '/', 0, zipfile.ZIP_STORED, *self.dos_time(), 0, 0, 0,
+                           (0o40755 << 16) | 0x10)
+
+    def add_bytes(self, name, data):
+        compressor = zlib.compressobj(6, zlib.DEFLATED, -15)
+        compressed = compressor.compress(data) + compressor.flush()
+        self._write_header(name, 0, zipfile.ZIP_DEFLATED, *self.dos_time(), zlib.crc32(data),
+                           len(compressed), len(data), 0o100644 << 16)
+        self.file.write(compressed)
+
+    def copy_raw(self, name, source, info, chunk_size=1024 * 1024):
+        # source - открытый на чтение исходный архив, info - его запись (ZipInfo или MemberInfo)
+        source.seek(info.header_offset)
+        header = source.read(LOCAL.size)
+        sig, _, flags, method, dos_time, dos_date, _, _, _, name_len, extra_len = LOCAL.unpack(header)
+        if sig != LOCAL_SIG:
+            raise zipfile.BadZipFile(f"Bad magic number for file header: {info.filename}")
+        self._write_header(name, flags, method, dos_time, dos_date, info.CRC,
+                           info.compress_size, info.file_size, 0o100644 << 16)
+        source.seek(info.header_offset + LOCAL.size + name_len + extra_len)
+        remaining = info.compress_size
+        while remaining:
+            chunk = source.read(min(chunk_size, remaining))
+            if not chunk:
+                raise zipfile.BadZipFile(f"Truncated member: {info.filename}")
+            self.file.write(chunk)
+            remaining -= len(chunk)
+
+    def close(self):
+        cd_offset = self.file.tell()
+        for (name_bytes, flags, method, dos_time, dos_date, crc,
+             compress_size, file_size, offset, external_attr) in self.entries:
+            # Поля, не помещающиеся в 32 бита, уходят в расширение zip64 (в порядке APPNOTE)
+            wide = [value for value in (file_size, compress_size, offset) if value >= 0xFFFFFFFF]
+            extra = struct.pack(f'<2H{len(wide)}Q', 0x0001, 8 * len(wide), *wide) if wide else b''
+            version = 45 if wide else 20
+            self.file.write(CENTRAL.pack(CENTRAL_SIG, (3 << 8) | version, version, flags, method, dos_time, dos_date,
+                                         crc, min(compress_size, 0xFFFFFFFF), min(file_size, 0xFFFFFFFF),
+                                         len(name_bytes), len(extra), 0, 0, 0, external_attr,
+                                         min(offset, 0xFFFFFFFF)))
+            self.file.write(name_bytes)
+            self.file.write(extra)
+        cd_size = self.file.tell() - cd_offset
+        count = len(self.entries)
+        if count >= 0xFFFF or cd_offset >= 0xFFFFFFFF or cd_size >= 0xFFFFFFFF:
+            eocd64_offset = self.file.tell()
+            self.file.write(EOCD64.pack(EOCD64_SIG, EOCD64.size - 12, 45, 45, 0, 0, count, count, cd_size, cd_offset))
+            self.file.write(EOCD64_LOCATOR.pack(EOCD64_LOCATOR_SIG, 0, eocd64_offset, 1))
+        self.file.write(EOCD.pack(EOCD_SIG, 0, 0, min(count, 0xFFFF), min(count, 0xFFFF),
+                                  min(cd_size, 0xFFFFFFFF), min(cd_offset, 0xFFFFFFFF), 0))
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
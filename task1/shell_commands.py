@@ -0,0 +1,208 @@
+# Команды-плагины: модуль импортируется эмулятором только при первом вызове одной из них.
+# Обработчик получает (shell, opts, args, stdin) и возвращает строки вывода
+import io
+import os
+import re
+import fnmatch
+import zipfile
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
+
+# Меньше этого объема grep работает в текущем процессе: запуск пула дороже самого поиска
+PARALLEL_MIN_BYTES = 4 * 1024 * 1024
+# Минимальный объем одной задачи для рабочего процесса
+CHUNK_MIN_BYTES = 256 * 1024
+
+
+def cat(shell, opts, args, stdin):
+    if not args:
+        if stdin is None:
+            raise shell.CommandError("Usage: cat <file>...", 'Error: Invalid arguments')
+        yield from stdin
+        return
+    for target in args:
+        yield from shell.read_lines(target)
+
+
+cat.command_spec = {'usage': 'cat <file>...', 'max_args': None}
+
+
+def wc(shell, opts, args, stdin):
+    if not any(opts.values()):
+        opts = dict.fromkeys(opts, True)
+
+    def counts(lines):
+        n_lines = n_words = n_chars = 0
+        for line in lines:
+            n_lines += 1
+            n_words += len(line.split())
+            n_chars += len(line) + 1
+        return n_lines, n_words, n_chars
+
+    def fmt(values, name):
+        selected = [value for value, key in zip(values, ('lines', 'words', 'chars')) if opts[key]]
+        return ' '.join(f"{value:7d}" for value in selected) + (f" {name}" if name else '')
+
+    if not args:
+        if stdin is None:
+            raise shell.CommandError("Usage: wc [-l] [-w] [-m] <file>...", 'Error: Invalid arguments')
+        yield fmt(counts(stdin), '')
+        return
+
+    total = [0, 0, 0]
+    for target in args:
+        values = counts(shell.read_lines(target))
+        total = [a + b for a, b in zip(total, values)]
+        yield fmt(values, target)
+    if len(args) > 1:
+        yield fmt(total, 'total')
+
+
+wc.command_spec = {
+    'usage': 'wc [-l] [-w] [-m] <file>...',
+    'flags': {'-l': 'lines', '-w': 'words', '-m': 'chars'},
+    'max_args': None,
+}
+
+
+def find(shell, opts, args, stdin):
+    pattern = args[0]
+    start = args[1] if len(args) > 1 else '.'
+    node = shell.lookup(shell.resolve_path(start))
+    if node is None or not node.is_dir:
+        raise shell.CommandError(f"No such directory: {start}", 'Error: No such directory')
+
+    # Шаблон без '/' сравнивается с именем, иначе - с путем от начального каталога
+    by_path = '/' in pattern
+    prefix = '' if start == '.' else start.rstrip('/') + '/'
+    for path, child in shell.index.iter_entries(node):
+        shell.entries_scanned += 1
+        if fnmatch.fnmatchcase(path if by_path else child.name, pattern):
+            yield prefix + path
+
+
+find.command_spec = {'usage': 'find <pattern> [path]', 'min_args': 1, 'max_args': 2}
+
+
+def grep_lines(lines, search, name, opts, with_name=True):
+    # Поиск по строкам одного источника; name выводится с -l и, если with_name, перед строками
+    count = 0
+    for number, line in enumerate(lines, 1):
+        if search(line) is None:
+            continue
+        count += 1
+        if opts['files']:
+            yield name
+            return
+        if not opts['count']:
+            prefix = f"{name}:" if with_name else ''
+            yield f"{prefix}{number}:{line}" if opts['numbers'] else prefix + line
+    if opts['count'] and not opts['files']:
+        yield f"{name}:{count}" if with_name else str(count)
+
+
+def grep_stream(stream, search, name, opts, with_name=True):
+    text = io.TextIOWrapper(stream, encoding='utf-8', errors='replace')
+    return grep_lines((line.rstrip('\r\n') for line in text), search, name, opts, with_name)
+
+
+_worker_zip = None
+
+
+def _init_worker(path):
+    global _worker_zip
+    _worker_zip = zipfile.ZipFile(path)
+
+
+def _grep_chunk(tasks, pattern, flags, opts, with_names):
+    # Выполняется в рабочем процессе: у каждого процесса свой дескриптор архива
+    search = re.compile(pattern, flags).search
+    result = []
+    for name, member in tasks:
+        with _worker_zip.open(member) as file:
+            result.extend(grep_stream(file, search, name, opts, with_names))
+    return result
+
+
+_pools = {}
+
+
+def get_pool(path):
+    # Пул живет между вызовами; если архив изменился, рабочие процессы открывают его заново
+    stat = os.stat(path)
+    stamp = (stat.st_mtime_ns, stat.st_size)
+    stamped = _pools.get(path)
+    if stamped is not None and stamped[0] == stamp:
+        return stamped[1]
+    if stamped is not None:
+        stamped[1].shutdown(wait=False)
+    pool = ProcessPoolExecutor(initializer=_init_worker, initargs=(path,))
+    _pools[path] = (stamp, pool)
+    return pool
+
+
+def grep(shell, opts, args, stdin):
+    flags = re.IGNORECASE if opts['ignore_case'] else 0
+    try:
+        search = re.compile(args[0], flags).search
+    except re.error as e:
+        raise shell.CommandError(f"Invalid regex: {e}", 'Error: Invalid regex')
+
+    if len(args) == 1:
+        if stdin is None:
+            raise shell.CommandError("Usage: grep [-i] [-n] [-c] [-l] <regex> <path>...", 'Error: Invalid arguments')
+        # Строки предыдущей стадии конвейера просматриваются по мере поступления
+        yield from grep_lines(stdin, search, '(standard input)', opts, with_name=False)
+        return
+
+    # Список файлов берется из индекса в порядке архива
+    files = []
+    for target in args[1:]:
+        node = shell.lookup(shell.resolve_path(target))
+        if node is None:
+            raise shell.CommandError(f"No such file or directory: {target}", 'Error: No such file or directory')
+        if node.is_dir:
+            prefix = '' if target == '.' else target.rstrip('/') + '/'
+            for path, child in shell.index.iter_entries(node):
+                shell.entries_scanned += 1
+                if not child.is_dir:
+                    files.append((prefix + path, child))
+        else:
+            files.append((target, node))
+    with_names = len(args) > 2 or len(files) != 1 or files[0][0] != args[1]
+
+    total = sum(node.size for _, node in files)
+    # Файлы из слоя изменений сессии видны только в текущем процессе
+    if total < PARALLEL_MIN_BYTES or len(files) < 2 or any(node.data is not None for _, node in files):
+        for name, node in files:
+            with shell.open_file(node) as file:
+                yield from grep_stream(file, search, name, opts, with_names)
+        return
+
+    # Файлы делятся на задачи примерно равного объема; map возвращает результаты
+    # в порядке задач, то есть в порядке архива, по мере их готовности
+    workers = os.cpu_count() or 1
+    chunk_bytes = max(CHUNK_MIN_BYTES, total // (workers * 4))
+    chunks, chunk, chunk_size = [], [], 0
+    for name, node in files:
+        chunk.append((name, node.member))
+        chunk_size += node.size
+        if chunk_size >= chunk_bytes:
+            chunks.append((chunk, chunk_size))
+            chunk, chunk_size = [], 0
+    if chunk:
+        chunks.append((chunk, chunk_size))
+
+    pool = get_pool(shell.archive.path)
+    run = partial(_grep_chunk, pattern=args[0], flags=flags, opts=opts, with_names=with_names)
+    for (_, size), lines in zip(chunks, pool.map(run, [tasks for tasks, _ in chunks])):
+        shell.bytes_read += size
+        yield from lines
+
+
+grep.command_spec = {
+    'usage': 'grep [-i] [-n] [-c] [-l] <regex> <path>...',
+    'flags': {'-i': 'ignore_case', '-n': 'numbers', '-c': 'count', '-l': 'files'},
+    'min_args': 1,
+    'max_args': None,
+}
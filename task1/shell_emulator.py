@@ -1,50 +1,927 @@
 import os
+import sys
+import codecs
+import hashlib
+import posixpath
 import zipfile
 import csv
 import configparser
+import importlib
+import threading
+import io
+import queue
+import atexit
+import time
+import math
+import tempfile
+import struct
+from array import array
+from collections import OrderedDict, deque
+from contextlib import contextmanager
 from datetime import datetime
 import calendar
 
 
+def import_local(name):
+    # Модули лежат рядом с shell_emulator.py: работает и при запуске скриптом, и при импорте из пакета
+    if __package__:
+        return importlib.import_module(f'{__package__}.{name}')
+    return importlib.import_module(name)
+
+
+class FSNode:
+    __slots__ = ('name', 'is_dir', 'size', 'files', 'children', 'member', 'data')
+
+    def __init__(self, name, is_dir, size=0, member=None, data=None):
+        self.name = name
+        self.is_dir = is_dir
+        self.size = size  # Для каталога - суммарный размер поддерева
+        self.files = 0 if is_dir else 1  # Для каталога - число файлов в поддереве
+        self.children = {} if is_dir else None
+        self.member = member  # Имя записи в архиве (None для неявных каталогов)
+        self.data = data  # Содержимое из слоя изменений: bytes или путь к файлу на диске
+
+
+# Сохраненное дерево каталогов (<fs_zip>.tree): узлы в прямом порядке обхода столбцами
+# (конец поддерева, размер, число файлов, признак каталога), затем имена и имена записей через '\0'
+TREE_MAGIC = b'ZTRE\x01\x00'
+TREE_HEADER = struct.Struct('<6sQQL')
+TREE_COLUMNS = ('q', 'q', 'q', 'B')
+
+
+class LazyDirNode(FSNode):
+    # Каталог из сохраненного дерева: дочерние узлы создаются при первом обращении.
+    # tree сбрасывается после раскрытия, поэтому раскрытие выполняется один раз
+    __slots__ = ('tree', 'row', 'expanded')
+
+    def __init__(self, name, size, files, member, tree, row):
+        super().__init__(name, True, size, member)
+        self.files = files
+        self.row = row
+        self.tree = tree
+
+    @property
+    def children(self):
+        tree = self.tree
+        if tree is not None:
+            # Сеансы сервера работают в разных потоках: каталог раскрывается под блокировкой дерева
+            with tree.lock:
+                if self.tree is not None:
+                    self.expanded = tree.children(self.row)
+                    self.tree = None
+        return self.expanded
+
+    @children.setter
+    def children(self, value):
+        self.expanded = value
+
+
+class SavedTree:
+    def __init__(self, names, members, ends, sizes, files, dirs):
+        self.names = names
+        self.members = members
+        self.ends = ends
+        self.sizes = sizes
+        self.files = files
+        self.dirs = dirs
+        self.lock = threading.Lock()
+
+    def node(self, row):
+        member = self.members[row] or None
+        if self.dirs[row]:
+            return LazyDirNode(self.names[row], self.sizes[row], self.files[row], member, self, row)
+        return FSNode(self.names[row], False, self.sizes[row], member)
+
+    def children(self, row):
+        # Потомки идут сразу за строкой каталога; поддерево каждого пропускается по его концу
+        result = {}
+        child = row + 1
+        end = self.ends[row]
+        while child < end:
+            result[self.names[child]] = self.node(child)
+            child = self.ends[child]
+        return result
+
+
+class ArchiveIndex:
+    # Дерево каталогов архива, строится один раз при загрузке
+    def __init__(self, infolist):
+        self.root = FSNode('', True)
+        self.owned = set()  # Узлы, которые принадлежат этой копии и меняются на месте
+        for info in infolist:
+            self.add(info)
+        self.aggregate()
+
+    def add(self, info):
+        parts = [part for part in info.filename.split('/') if part]
+        if not parts:
+            return
+        node = self.root
+        for part in parts[:-1]:
+            child = node.children.get(part)
+            if child is None or not child.is_dir:
+                # Неявный каталог: в архиве есть только файлы внутри него
+                child = node.children[part] = FSNode(part, True)
+            node = child
+
+        name = parts[-1]
+        if info.is_dir():
+            child = node.children.get(name)
+            if child is None or not child.is_dir:
+                child = node.children[name] = FSNode(name, True)
+            child.member = info.filename
+        else:
+            child = node.children.get(name)
+            if child is None or not child.is_dir:
+                node.children[name] = FSNode(name, False, info.file_size, info.filename)
+
+    @classmethod
+    def load(cls, path, stamp):
+        # Дерево из файла, если он записан для этой версии архива (stamp - mtime и размер);
+        # узлы каталогов раскрываются лениво, поэтому загрузка не зависит от числа записей
+        try:
+            with open(path, 'rb') as file:
+                data = file.read()
+            magic, mtime_ns, size, count = TREE_HEADER.unpack_from(data, 0)
+            if magic != TREE_MAGIC or (mtime_ns, size) != tuple(stamp) or not count:
+                return None
+            pos = TREE_HEADER.size
+            columns = []
+            for code in TREE_COLUMNS:
+                column = array(code)
+                end = pos + column.itemsize * count
+                column.frombytes(data[pos:end])
+                if sys.byteorder != 'little':
+                    column.byteswap()
+                columns.append(column)
+                pos = end
+            strings = data[pos:].decode('utf-8').split('\0')
+            if len(strings) != 2 * count or len(columns[-1]) != count:
+                return None
+        except (OSError, struct.error, UnicodeDecodeError, ValueError):
+            return None
+        tree = SavedTree(strings[:count], strings[count:], *columns)
+        index = cls.__new__(cls)
+        index.root = tree.node(0)
+        index.owned = set()
+        return index
+
+    def save(self, path, stamp):
+        nodes = [self.root]
+        ends = [0]
+        stack = [(0, iter(self.root.children.values()))]
+        while stack:
+            row, children = stack[-1]
+            child = next(children, None)
+            if child is None:
+                ends[row] = len(nodes)
+                stack.pop()
+                continue
+            nodes.append(child)
+            ends.append(len(nodes))
+            if child.is_dir:
+                stack.append((len(nodes) - 1, iter(child.children.values())))
+        strings = [node.name for node in nodes] + [node.member or '' for node in nodes]
+        if any('\0' in string for string in strings):
+            return
+        columns = (ends, [node.size for node in nodes], [node.files for node in nodes],
+                   [node.is_dir for node in nodes])
+        parts = [TREE_HEADER.pack(TREE_MAGIC, stamp[0], stamp[1], len(nodes))]
+        for code, values in zip(TREE_COLUMNS, columns):
+            column = array(code, values)
+            if sys.byteorder != 'little':
+                column.byteswap()
+            parts.append(column.tobytes())
+        parts.append('\0'.join(strings).encode('utf-8'))
+        tmp_path = path + '.tmp'
+        try:
+            with open(tmp_path, 'wb') as file:
+                file.write(b''.join(parts))
+            os.replace(tmp_path, path)
+        except OSError:
+            pass
+
+    def lookup(self, path):
+        node = self.root
+        for part in path.split('/'):
+            if not part:
+                continue
+            if not node.is_dir:
+                return None
+            node = node.children.get(part)
+            if node is None:
+                return None
+        return node
+
+    def fork(self):
+        # Копия для записи (copy-on-write): узлы общие с исходным индексом,
+        # при изменении копируется только путь от корня до изменяемого каталога
+        index = ArchiveIndex.__new__(ArchiveIndex)
+        index.root = self.root
+        index.owned = set()
+        return index
+
+    def clone(self, node, name=None):
+        copy = FSNode(node.name if name is None else name, node.is_dir, node.size, node.member, node.data)
+        copy.files = node.files
+        if node.is_dir:
+            copy.children = dict(node.children)
+        self.owned.add(copy)
+        return copy
+
+    def copy(self, node, name):
+        # Поддерево становится достижимо по двум путям, поэтому больше ни один узел не меняется на месте
+        self.owned.clear()
+        return self.clone(node, name)
+
+    def writable_path(self, parts):
+        # Узлы от корня до каталога parts, каждый - собственный для этой копии
+        if self.root not in self.owned:
+            self.root = self.clone(self.root)
+        path = [self.root]
+        for part in parts:
+            child = path[-1].children.get(part)
+            if child is None or not child.is_dir:
+                raise KeyError('/'.join(parts))
+            if child not in self.owned:
+                child = path[-1].children[part] = self.clone(child)
+            path.append(child)
+        return path
+
+    def put(self, parts, node):
+        # Добавляет или заменяет узел; размеры предков меняются на разницу
+        path = self.writable_path(parts[:-1])
+        old = path[-1].children.get(parts[-1])
+        path[-1].children[parts[-1]] = node
+        self.adjust(path, node.size - (old.size if old else 0), node.files - (old.files if old else 0))
+
+    def remove(self, parts):
+        path = self.writable_path(parts[:-1])
+        old = path[-1].children.pop(parts[-1])
+        self.adjust(path, -old.size, -old.files)
+        return old
+
+    @staticmethod
+    def adjust(path, size, files):
+        for node in path:
+            node.size += size
+            node.files += files
+
+    @staticmethod
+    def walk(node):
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            yield node
+            if node.is_dir:
+                stack.extend(node.children.values())
+
+    def aggregate(self):
+        # Размеры каталогов считаются снизу вверх один раз на архив
+        for node in reversed(list(self.walk(self.root))):
+            if node.is_dir:
+                node.size = sum(child.size for child in node.children.values())
+                node.files = sum(child.files for child in node.children.values())
+
+    @staticmethod
+    def iter_entries(node, prefix=''):
+        # Все потомки каталога (путь, узел) в прямом порядке, как они идут в архиве
+        stack = [(prefix, iter(node.children.values()))]
+        while stack:
+            prefix, children = stack[-1]
+            child = next(children, None)
+            if child is None:
+                stack.pop()
+                continue
+            path = prefix + child.name
+            yield path, child
+            if child.is_dir:
+                stack.append((path + '/', iter(child.children.values())))
+
+    @staticmethod
+    def subdirs(node, depth, prefix=''):
+        # Подкаталоги до заданной глубины в порядке обхода
+        for child in node.children.values():
+            if child.is_dir:
+                yield prefix + child.name, child
+                if depth > 1:
+                    yield from ArchiveIndex.subdirs(child, depth - 1, prefix + child.name + '/')
+
+
+class CsvLogSink:
+    # Журнал держит файл открытым и пишет строки пачками.
+    # sync - запись и flush на каждую строку, batched - сброс по порогу в вызывающем потоке,
+    # async - сброс фоновым потоком
+    MODES = ('sync', 'batched', 'async')
+
+    def __init__(self, path, mode='sync', flush_rows=100, flush_interval=1.0):
+        if mode not in self.MODES:
+            raise ValueError(f"Unknown log mode: {mode}")
+        self.mode = mode
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        self.rows = []
+        self.lock = threading.Lock()
+        self.closed = False
+        self.last_flush = time.monotonic()
+
+        self.file = open(path, 'w', newline='')
+        self.writer = csv.writer(self.file)
+
+        self.thread = None
+        if mode == 'async':
+            self.wakeup = threading.Event()
+            self.thread = threading.Thread(target=self._run, name='log-writer', daemon=True)
+            self.thread.start()
+        atexit.register(self.close)
+
+    def write(self, row):
+        with self.lock:
+            if self.closed:
+                return
+            if self.mode == 'sync':
+                self.writer.writerow(row)
+                self.file.flush()
+                return
+            self.rows.append(row)
+            full = len(self.rows) >= self.flush_rows
+            if self.mode == 'batched' and (full or time.monotonic() - self.last_flush >= self.flush_interval):
+                self._flush()
+        if self.mode == 'async' and full:
+            self.wakeup.set()
+
+    def _flush(self):
+        if self.rows:
+            self.writer.writerows(self.rows)
+            self.rows.clear()
+        self.file.flush()
+        self.last_flush = time.monotonic()
+
+    def flush(self):
+        with self.lock:
+            if not self.closed:
+                self._flush()
+
+    def _run(self):
+        while not self.closed:
+            self.wakeup.wait(self.flush_interval)
+            self.wakeup.clear()
+            self.flush()
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        if self.thread is not None:
+            self.wakeup.set()
+            self.thread.join()
+        with self.lock:
+            self._flush()
+            self.file.close()
+        atexit.unregister(self.close)
+
+
+# Символы, на которых str.splitlines() разбивает строки
+LINE_BREAKS = '\n\r\x0b\x0c\x1c\x1d\x1e\x85\u2028\u2029'
+
+
+def iter_lines(stream, encoding='utf-8', chunk_size=64 * 1024):
+    # Построчное чтение с инкрементальным декодером: в памяти только текущий блок
+    decoder = codecs.getincrementaldecoder(encoding)()
+    tail = ''
+    while True:
+        chunk = stream.read(chunk_size)
+        buf = tail + decoder.decode(chunk, final=not chunk)
+        if not chunk:
+            yield from buf.splitlines()
+            return
+        lines = buf.splitlines()
+        tail = ''
+        if buf and buf[-1] == '\r':
+            # '\r' может оказаться первой половиной '\r\n' на границе блоков
+            tail = lines.pop() + '\r'
+        elif buf and buf[-1] not in LINE_BREAKS:
+            tail = lines.pop()
+        yield from lines
+
+
+def uniq_lines(lines, count=False, repeated=False, unique=False, global_=False, hashed=False):
+    def fmt(line, n):
+        return f"{n:7d} {line}" if count else line
+
+    def wanted(n):
+        return not (repeated and n < 2) and not (unique and n > 1)
+
+    if not global_:
+        # Классический uniq: сравниваются только соседние строки, память O(1)
+        prev, n = None, 0
+        for line in lines:
+            if n and line == prev:
+                n += 1
+                continue
+            if n and wanted(n):
+                yield fmt(prev, n)
+            prev, n = line, 1
+        if n and wanted(n):
+            yield fmt(prev, n)
+        return
+
+    def key(line):
+        if hashed:
+            # 8 байт дайджеста вместо полной строки
+            return hashlib.blake2b(line.encode('utf-8', 'surrogatepass'), digest_size=8).digest()
+        return line
+
+    if not count and not unique:
+        # Строка выводится сразу при первом (или, с -d, втором) появлении
+        seen = {}
+        target = 2 if repeated else 1
+        for line in lines:
+            k = key(line)
+            n = seen.get(k, 0) + 1
+            if n <= 2:
+                seen[k] = n
+            if n == target:
+                yield line
+        return
+
+    counts = {}
+    for line in lines:
+        counts[line] = counts.get(line, 0) + 1
+    for line, n in counts.items():
+        if wanted(n):
+            yield fmt(line, n)
+
+
+class MemberCache:
+    # LRU-кеш распакованных записей архива с ограничением по суммарному размеру
+    def __init__(self, budget):
+        self.budget = budget
+        self.used = 0
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def fits(self, size):
+        # Крупные записи читаются потоком, чтобы не вытеснять весь кеш
+        return size <= self.budget // 4
+
+    def get(self, key):
+        with self.lock:
+            data = self.entries.get(key)
+            if data is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return data
+
+    def put(self, key, data):
+        with self.lock:
+            if key in self.entries:
+                return
+            self.entries[key] = data
+            self.used += len(data)
+            while self.used > self.budget:
+                _, evicted = self.entries.popitem(last=False)
+                self.used -= len(evicted)
+                self.evictions += 1
+
+
+class Archive:
+    # Архив с индексом каталогов, пулом открытых дескрипторов и кешем содержимого.
+    # Только чтение, поэтому один экземпляр можно разделять между сессиями
+    BACKENDS = ('zipfile', 'mmap')
+
+    def __init__(self, path, backend='zipfile', pool_size=8, cache_bytes=0):
+        self.path = path
+        self.backend = backend
+        self.cache = MemberCache(cache_bytes) if cache_bytes > 0 else None
+        if backend == 'mmap':
+            # Дерево каталогов сохраняется в <fs_zip>.tree, список записей - в <fs_zip>.idx.
+            # При повторном запуске центральный каталог не разбирается, а записи из .idx
+            # загружаются только при первом открытии файла
+            mmap_zip = import_local('mmap_zip')
+            try:
+                self.mmap_zip = mmap_zip.MmapZipArchive(path)
+            except (OSError, zipfile.BadZipFile, ValueError):
+                raise FileNotFoundError(f"Invalid zip archive: {path}")
+            tree_path = path + '.tree'
+            self.index = ArchiveIndex.load(tree_path, self.mmap_zip.stamp)
+            if self.index is None:
+                self.index = ArchiveIndex(self.mmap_zip.infolist())
+                self.index.save(tree_path, self.mmap_zip.stamp)
+        else:
+            if not zipfile.is_zipfile(path):
+                raise FileNotFoundError(f"Invalid zip archive: {path}")
+            self.pool = queue.LifoQueue()
+            self.pool_size = pool_size
+            self.opened = 1
+            self.pool_lock = threading.Lock()
+            handle = zipfile.ZipFile(path, 'r')
+            self.index = ArchiveIndex(handle.infolist())
+            self.pool.put(handle)
+
+    @classmethod
+    def from_settings(cls, settings):
+        backend = settings.get('fs_backend', 'zipfile').strip()
+        if backend not in cls.BACKENDS:
+            raise ValueError(f"Invalid fs_backend '{backend}', expected 'zipfile' or 'mmap'")
+        cache_bytes = int(settings.getfloat('cache_mb', 32) * 1024 * 1024)
+        return cls(settings['fs_zip'], backend, cache_bytes=cache_bytes)
+
+    def acquire(self):
+        try:
+            return self.pool.get_nowait()
+        except queue.Empty:
+            pass
+        with self.pool_lock:
+            if self.opened < self.pool_size:
+                self.opened += 1
+                return zipfile.ZipFile(self.path, 'r')
+        return self.pool.get()
+
+    @contextmanager
+    def open(self, member, size=None):
+        data = self.cache.get(member) if self.cache is not None else None
+        if data is None and self.cache is not None and size is not None and self.cache.fits(size):
+            with self.open_member(member) as file:
+                data = file.read()
+            self.cache.put(member, data)
+        if data is not None:
+            yield io.BytesIO(data)
+            return
+        with self.open_member(member) as file:
+            yield file
+
+    def getinfo(self, member):
+        if self.backend == 'mmap':
+            return self.mmap_zip.getinfo(member)
+        handle = self.acquire()
+        try:
+            return handle.getinfo(member)
+        finally:
+            self.pool.put(handle)
+
+    @contextmanager
+    def open_member(self, member):
+        if self.backend == 'mmap':
+            # mmap читается из любого потока без блокировок
+            with self.mmap_zip.open(member) as file:
+                yield file
+            return
+        handle = self.acquire()
+        try:
+            with handle.open(member) as file:
+                yield file
+        finally:
+            self.pool.put(handle)
+
+    def close(self):
+        if self.backend == 'mmap':
+            self.mmap_zip.close()
+            return
+        while True:
+            try:
+                self.pool.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+class CommandError(Exception):
+    # Ошибка команды: текст выводится пользователю, result пишется в журнал
+    def __init__(self, message, result=None):
+        super().__init__(message)
+        self.result = result or f'Error: {message}'
+
+
+class Command:
+    # Описание команды: обработчик и спецификация аргументов.
+    # flags - булевы ключи ('-c' -> 'count'), options - ключи со значением ('-d' -> ('depth', int)),
+    # min_args/max_args - число позиционных аргументов (max_args=None - без ограничения)
+    def __init__(self, name, handler, usage=None, flags=None, options=None, min_args=0, max_args=0, pipe=True):
+        self.name = name
+        self.handler = handler
+        self.usage = usage or name
+        self.flags = flags or {}
+        self.options = options or {}
+        self.min_args = min_args
+        self.max_args = max_args
+        self.pipe = pipe
+
+    def usage_error(self):
+        return CommandError(f"Usage: {self.usage}", 'Error: Invalid arguments')
+
+    def parse(self, args):
+        opts = {dest: False for dest in self.flags.values()}
+        opts.update({dest: None for dest, _ in self.options.values()})
+        positional = []
+        args = iter(args)
+        for arg in args:
+            if arg in self.options:
+                dest, convert = self.options[arg]
+                try:
+                    opts[dest] = convert(next(args))
+                except (StopIteration, ValueError):
+                    raise self.usage_error()
+            elif arg in self.flags:
+                opts[self.flags[arg]] = True
+            elif arg[:1] == '-' and arg[1:2] not in ('', '-') and all('-' + flag in self.flags for flag in arg[1:]):
+                # Сгруппированные ключи: -cd == -c -d
+                for flag in arg[1:]:
+                    opts[self.flags['-' + flag]] = True
+            else:
+                positional.append(arg)
+        if len(positional) < self.min_args or (self.max_args is not None and len(positional) > self.max_args):
+            raise self.usage_error()
+        return opts, positional
+
+    def call(self, shell, args, stdin=None):
+        opts, positional = self.parse(args)
+        return self.handler(shell, opts, positional, stdin)
+
+
+# Реестр команд: имя -> Command, диспетчеризация - поиск в словаре
+COMMANDS = {}
+ALIASES = {}
+
+# Команды-плагины импортируются только при первом вызове
+LAZY_COMMANDS = {
+    'cat': 'shell_commands:cat',
+    'wc': 'shell_commands:wc',
+    'find': 'shell_commands:find',
+    'grep': 'shell_commands:grep',
+}
+ENTRY_POINT_GROUP = 'shell_emulator.commands'
+_entry_points = None
+
+
+def command(name, aliases=(), **spec):
+    def register(handler):
+        COMMANDS[name] = Command(name, handler, **spec)
+        for alias in aliases:
+            ALIASES[alias] = name
+        return handler
+    return register
+
+
+def find_entry_point(name):
+    global _entry_points
+    if _entry_points is None:
+        from importlib import metadata
+        eps = metadata.entry_points()
+        group = eps.select(group=ENTRY_POINT_GROUP) if hasattr(eps, 'select') else eps.get(ENTRY_POINT_GROUP, [])
+        _entry_points = {ep.name: ep for ep in group}
+    return _entry_points.get(name)
+
+
+def lookup_command(name, entry_points=True):
+    # entry_points=False - только встроенные команды и плагины shell_commands.py,
+    # без просмотра точек входа (он стоит десятки миллисекунд)
+    name = ALIASES.get(name, name)
+    spec = COMMANDS.get(name)
+    if spec is not None:
+        return spec
+
+    # Плагин: handler(shell, opts, args, stdin) -> строки вывода,
+    # необязательный атрибут command_spec задает спецификацию аргументов
+    if name in LAZY_COMMANDS:
+        module_name, attr = LAZY_COMMANDS[name].split(':')
+        handler = getattr(import_local(module_name), attr)
+    else:
+        entry_point = find_entry_point(name) if entry_points else None
+        if entry_point is None:
+            return None
+        handler = entry_point.load()
+    spec = COMMANDS[name] = Command(name, handler, **getattr(handler, 'command_spec', {}))
+    return spec
+
+
+class CountingReader:
+    # Обертка над потоком записи архива: считает прочитанные байты для журнала
+    def __init__(self, stream, shell):
+        self.stream = stream
+        self.shell = shell
+
+    def read(self, size=-1):
+        data = self.stream.read(size)
+        self.shell.bytes_read += len(data)
+        return data
+
+    def read1(self, size=-1):
+        data = self.stream.read1(size)
+        self.shell.bytes_read += len(data)
+        return data
+
+    def readinto(self, buffer):
+        n = self.stream.readinto(buffer)
+        self.shell.bytes_read += n or 0
+        return n
+
+    def readline(self, size=-1):
+        data = self.stream.readline(size)
+        self.shell.bytes_read += len(data)
+        return data
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+
+class OverlayFile:
+    # Приемник перенаправленного вывода: строки пишутся в память или во временный файл overlay_dir,
+    # по завершении команды содержимое передается в on_close(data, size)
+    def __init__(self, on_close, directory=None):
+        self.on_close = on_close
+        self.size = 0
+        if directory is None:
+            self.path = None
+            self.file = io.BytesIO()
+        else:
+            os.makedirs(directory, exist_ok=True)
+            fd, self.path = tempfile.mkstemp(dir=directory, suffix='.overlay')
+            self.file = os.fdopen(fd, 'wb')
+
+    def append(self, line):
+        data = f"{line}\n".encode('utf-8')
+        self.file.write(data)
+        self.size += len(data)
+
+    def close(self):
+        if self.path is None:
+            data = self.file.getvalue()
+        else:
+            self.file.close()
+            data = self.path
+        self.on_close(data, self.size)
+
+
+def split_command(command):
+    # Строка -> стадии конвейера (списки аргументов) и файл перенаправления (или None).
+    # Внутри кавычек ('...' или "...") пробелы, '|' и '>' - часть аргумента.
+    # '\' не экранирует: пути вида dir\file остаются как есть
+    stages = [[]]
+    redirect = None
+    words = stages[0]
+    word = None  # текущий аргумент; None - между аргументами
+    quote = None
+    for char in command:
+        if quote is not None:
+            if char == quote:
+                quote = None
+            else:
+                word += char
+        elif char in '\'"':
+            quote = char
+            word = word or ''
+        elif char.isspace() or char in '|>':
+            if word is not None:
+                words.append(word)
+                word = None
+            if char in '|>':
+                if redirect is not None:
+                    raise CommandError("Redirect must be at the end of the command", 'Error: Invalid redirect')
+                words = []
+                if char == '|':
+                    stages.append(words)
+                else:
+                    redirect = words
+        else:
+            word = (word or '') + char
+    if quote is not None:
+        raise CommandError("Unterminated quote", 'Error: Invalid arguments')
+    if word is not None:
+        words.append(word)
+    if redirect is not None and len(redirect) != 1:
+        raise CommandError("Usage: <command> > <file>", 'Error: Invalid redirect')
+    return stages, redirect[0] if redirect is not None else None
+
+
+def percentile(ordered, p):
+    # Перцентиль по методу ближайшего ранга; ordered отсортирован по возрастанию
+    rank = max(1, math.ceil(p / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def format_size(size):
+    for unit in ('bytes', 'KiB', 'MiB', 'GiB', 'TiB'):
+        if size < 1024 or unit == 'TiB':
+            return f"{size} {unit}" if unit == 'bytes' else f"{size:.1f} {unit}"
+        size /= 1024
+
+
+def read_settings(config_path):
+    if not os.path.exists(config_path):
+        raise FileNotFoundError(f"Configuration file not found: {config_path}")
+
+    config = configparser.ConfigParser()
+    config.read(config_path)
+
+    if 'Settings' not in config:
+        raise KeyError("Missing [Settings] section in the configuration file.")
+
+    required_keys = ['computer_name', 'fs_zip', 'log_file']
+    for key in required_keys:
+        if key not in config['Settings']:
+            raise KeyError(f"Missing key '{key}' in [Settings] section.")
+    return config['Settings']
+
+
 class ShellEmulator:
-    def __init__(self, config_path):
-        self.load_config(config_path)
+    # Доступен плагинам без импорта модуля эмулятора
+    CommandError = CommandError
+
+    # Сколько последних замеров хранить для перцентилей каждой команды
+    LATENCY_SAMPLES = 10000
+
+    def __init__(self, config_path, archive=None, session=None, profile=None):
+        self.session = session
+        self.output = None  # Поток вывода команд; None - текущий sys.stdout
+        self.load_config(config_path, archive)
         self.current_dir = 'virtual_fs/'  # Начальный путь в архиве
-        self.init_log()
+        self.overlay_files = []  # Временные файлы слоя изменений в overlay_dir
 
-    def load_config(self, config_path):
-        if not os.path.exists(config_path):
-            raise FileNotFoundError(f"Configuration file not found: {config_path}")
+        # Метрики текущей команды и история задержек по командам
+        self.command_start = None
+        self.bytes_read = 0
+        self.entries_scanned = 0
+        self.latencies = {}
 
-        config = configparser.ConfigParser()
-        config.read(config_path)
+        self.profile_path = None
+        self.profiler = None
+        if profile:
+            import cProfile
+            root, ext = os.path.splitext(profile)
+            self.profile_path = profile if session is None else f"{root}.{session}{ext}"
+            self.profiler = cProfile.Profile()
+        self.init_log()
 
-        if 'Settings' not in config:
-            raise KeyError("Missing [Settings] section in the configuration file.")
+    def load_config(self, config_path, archive=None):
+        settings = read_settings(config_path)
 
-        required_keys = ['computer_name', 'fs_zip', 'log_file']
-        for key in required_keys:
-            if key not in config['Settings']:
-                raise KeyError(f"Missing key '{key}' in [Settings] section.")
+        self.computer_name = settings['computer_name']
+        self.fs_zip = settings['fs_zip']
+        self.log_file = settings['log_file']
+        if self.session is not None:
+            # У каждой сессии сервера свой журнал: log.csv -> log.<session>.csv
+            root, ext = os.path.splitext(self.log_file)
+            self.log_file = f"{root}.{self.session}{ext}"
+        self.log_mode = settings.get('log_mode', 'sync').strip()
+        self.log_flush_rows = settings.getint('log_flush_rows', 100)
+        self.log_flush_interval = settings.getfloat('log_flush_interval', 1.0)
 
-        self.computer_name = config['Settings']['computer_name']
-        self.fs_zip = config['Settings']['fs_zip']
-        self.log_file = config['Settings']['log_file']
+        # Каталог для содержимого измененных файлов; без него изменения хранятся в памяти
+        self.overlay_dir = settings.get('overlay_dir', '').strip() or None
 
-        if not zipfile.is_zipfile(self.fs_zip):
-            raise FileNotFoundError(f"Invalid zip archive: {self.fs_zip}")
+        if self.log_mode not in CsvLogSink.MODES:
+            raise ValueError(f"Invalid log_mode '{self.log_mode}', expected one of: {', '.join(CsvLogSink.MODES)}")
 
-        self.zip = zipfile.ZipFile(self.fs_zip, 'r')
+        if archive is None:
+            self.archive = Archive.from_settings(settings)
+            self.owns_archive = True
+        else:
+            # Архив и индекс общие для всех сессий сервера
+            self.archive = archive
+            self.owns_archive = False
+        self.index = self.archive.index
 
     def init_log(self):
-        with open(self.log_file, 'w', newline='') as log:
-            writer = csv.writer(log)
-            writer.writerow(['Timestamp', 'Command', 'Result'])
+        self.log_sink = CsvLogSink(self.log_file, self.log_mode, self.log_flush_rows, self.log_flush_interval)
+        self.log_sink.write(['Timestamp', 'Command', 'Result', 'DurationNs', 'BytesRead', 'EntriesScanned'])
 
     def log(self, command, result):
-        with open(self.log_file, 'a', newline='') as log:
-            writer = csv.writer(log)
-            writer.writerow([datetime.now().isoformat(), command, result])
+        duration = ''
+        if self.command_start is not None:
+            duration = time.perf_counter_ns() - self.command_start
+            try:
+                stages = split_command(command)[0]
+            except CommandError:
+                stages = [command.split()]
+            name = ' | '.join(stage[0] for stage in stages if stage)
+            samples = self.latencies.get(name)
+            if samples is None:
+                samples = self.latencies[name] = deque(maxlen=self.LATENCY_SAMPLES)
+            samples.append(duration)
+            self.command_start = None
+        self.log_sink.write([datetime.now().isoformat(), command, result, duration, self.bytes_read, self.entries_scanned])
+
+    def close(self):
+        if self.profiler is not None:
+            self.profiler.dump_stats(self.profile_path)
+            self.profiler = None
+        self.log_sink.close()
+        for path in self.overlay_files:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        self.overlay_files = []
+        if self.owns_archive:
+            self.archive.close()
+
+    def write(self, line):
+        print(line, file=self.output)
 
     def run(self):
         while True:
@@ -52,141 +929,532 @@ class ShellEmulator:
             if command:
                 self.handle_command(command)
 
+    def run_script(self, stream):
+        # Пакетный режим: команды без приглашения, итог - в stderr
+        count = 0
+        start = time.perf_counter()
+        try:
+            for line in stream:
+                command = line.strip()
+                if command and not command.startswith('#'):
+                    count += 1
+                    self.handle_command(command)
+        finally:
+            elapsed = time.perf_counter() - start
+            rate = count / elapsed if elapsed else 0.0
+            print(f"Executed {count} commands in {elapsed:.3f} s ({rate:.1f} commands/sec)", file=sys.stderr)
+
     def handle_command(self, command):
-        parts = command.split()
-        cmd = parts[0]
-        args = parts[1:]
-
-        if cmd == 'exit':
-            self.log(command, 'Exit')
-            exit(0)
-        elif cmd == 'ls':
-            if len(parts)>1:
-                self.ls(args[0])
-            else:
-                self.ls(self.current_dir)
-        elif cmd == 'cd':
-            self.cd(args)
-        elif cmd == 'uniq':
-            self.uniq(args)
-        elif cmd == 'du':
-            self.du()
-        elif cmd == 'cal':
-            if len(parts)>2:
-                self.cal(int(args[0]), int(args[1]))
-            else:
-                self.cal()
-        else:
-            print(f"Unknown command: {cmd}")
+        self.command_start = time.perf_counter_ns()
+        self.bytes_read = 0
+        self.entries_scanned = 0
+        if self.profiler is None:
+            self.dispatch(command)
+            return
+        try:
+            self.profiler.runcall(self.dispatch, command)
+        except ValueError:
+            # Другой профилировщик уже активен (например, в соседней сессии сервера)
+            self.dispatch(command)
+
+    def dispatch(self, command):
+        try:
+            stages, target = split_command(command)
+        except CommandError as e:
+            self.write(e)
+            self.log(command, e.result)
+            return
+        sink = None
+        if target is not None:
+            # Перенаправление вывода в файл слоя изменений: команда > файл
+            try:
+                sink = self.redirect_sink(target)
+            except CommandError as e:
+                self.write(e)
+                self.log(command, e.result)
+                return
+
+        if len(stages) > 1:
+            self.pipeline(command, stages, sink)
+            return
+
+        parts = stages[0]
+        spec = lookup_command(parts[0]) if parts else None
+        if spec is None:
+            self.write(f"Unknown command: {parts[0] if parts else command}")
             self.log(command, 'Unknown command')
+            return
+        if sink is not None and not spec.pipe:
+            self.write(f"Cannot redirect output of: {parts[0]}")
+            self.log(command, 'Error: Invalid redirect')
+            return
+        self.run_command(command, spec, parts[1:], sink=sink)
 
-    def ls(self, args):
+    def run_command(self, label, spec, args, stdin=None, sink=None):
         try:
-            items = {name[len(args):].split('/')[0] for name in self.zip.namelist() if name.startswith(args.lstrip('/'))}
-            for item in sorted(items):
-                if item != '':
-                    print(item)
-            self.log('ls', 'Success')
+            lines = spec.call(self, args, stdin)
+        except CommandError as e:
+            self.write(e)
+            self.log(label, e.result)
+            return
         except Exception as e:
-            print(f"Error: {e}")
-            self.log('ls', f'Error: {e}')
+            self.write(f"Error: {e}")
+            self.log(label, f'Error: {e}')
+            return
+        self.emit(label, lines, sink)
 
-    def cd(self, args):
-        if not args:
-            print("Usage: cd <directory>")
+    def pipeline(self, label, stages, sink=None):
+        # Вывод каждой стадии передается следующей как генератор строк
+        lines = None
+        try:
+            for parts, spec in zip(stages, self.resolve_stages(stages)):
+                lines = spec.call(self, parts[1:], lines)
+        except CommandError as e:
+            self.write(e)
+            self.log(label, e.result)
+            return
+        except Exception as e:
+            self.write(f"Error: {e}")
+            self.log(label, f'Error: {e}')
             return
+        self.emit(label, lines, sink)
 
-        target = args[0]
-        if target == "..":
-            # Переход в родительский каталог
-            if self.current_dir != "/":
-                self.current_dir = os.path.dirname(self.current_dir.rstrip('/')) + '/'
-            self.log(f'cd {target}', 'Success')
+    @staticmethod
+    def resolve_stages(stages):
+        # Команды всех стадий находятся до запуска первой. Точки входа просматриваются только
+        # для имен, которых нет среди известных команд, и только когда остальные стадии допустимы
+        def invalid(parts):
+            return CommandError(f"Cannot be used in a pipeline: {' '.join(parts)}", 'Error: Invalid pipeline')
+
+        specs = []
+        for parts in stages:
+            if not parts:
+                raise invalid(parts)
+            spec = lookup_command(parts[0], entry_points=False)
+            if spec is not None and not spec.pipe:
+                raise invalid(parts)
+            specs.append(spec)
+        for index, parts in enumerate(stages):
+            if specs[index] is None:
+                spec = specs[index] = lookup_command(parts[0])
+                if spec is None:
+                    raise CommandError(f"Unknown command: {parts[0]}", 'Unknown command')
+                if not spec.pipe:
+                    raise invalid(parts)
+        return specs
+
+    def emit(self, label, lines, sink=None):
+        # Печатает вывод команды (или передает его в приемник) и пишет результат в журнал.
+        # sink - функция, создающая приемник: файл создается, только когда команда уже разобрана
+        result = 'Success'
+        output = None
+        try:
+            if sink is not None:
+                output = sink()
+            write = self.write if output is None else output.append
+            if lines is not None:
+                lines = iter(lines)
+                while True:
+                    try:
+                        line = next(lines)
+                    except StopIteration as stop:
+                        result = stop.value or 'Success'
+                        break
+                    write(line)
+        except CommandError as e:
+            self.write(e)
+            result = e.result
+        except Exception as e:
+            self.write(f"Error: {e}")
+            result = f'Error: {e}'
+        if output is not None:
+            output.close()
+        self.log(label, result)
+
+    def resolve_path(self, target):
+        # Путь относительно текущего каталога -> путь в архиве без крайних '/'
+        path = posixpath.normpath(posixpath.join('/' + self.current_dir.strip('/'), target.replace("\\", "/")))
+        return path.strip('/')
+
+    def lookup(self, path):
+        self.entries_scanned += path.count('/') + 1
+        return self.index.lookup(path)
+
+    def lookup_file(self, target):
+        node = self.lookup(self.resolve_path(target))
+        if node is None or node.is_dir:
+            raise CommandError(f"No such file: {target}", 'Error: No such file')
+        return node
+
+    @contextmanager
+    def open_file(self, node):
+        if node.data is not None:
+            # Файл из слоя изменений сессии
+            with (io.BytesIO(node.data) if isinstance(node.data, bytes) else open(node.data, 'rb')) as file:
+                yield file
             return
+        with self.archive.open(node.member, node.size) as file:
+            yield CountingReader(file, self)
 
-        # Новый путь
-        new_path = os.path.normpath(os.path.join(self.current_dir, target)).replace("\\","/").lstrip('/')
+    def read_lines(self, target):
+        yield from self.node_lines(self.lookup_file(target))
 
-        # Проверка наличия каталога
-        directories = {name.split('/')[0] for name in self.zip.namelist() if name.startswith(new_path + '/')}
-        if directories:
-            self.current_dir = new_path + '/'
-            self.log(f'cd {target}', 'Success')
-        else:
-            print(f"No such directory: {target}")
-            self.log(f'cd {target}', 'Error: No such directory')
+    def node_lines(self, node):
+        with self.open_file(node) as file:
+            yield from iter_lines(file)
+
+    # Слой изменений: при первой записи сессия получает свою копию индекса,
+    # общие с архивом узлы копируются только на пути к изменяемому каталогу
+    def overlay_parts(self, target):
+        path = self.resolve_path(target)
+        if not path:
+            raise CommandError("Cannot modify the root directory", 'Error: Invalid path')
+        parent = self.lookup(posixpath.dirname(path))
+        if parent is None or not parent.is_dir:
+            raise CommandError(f"No such directory: {posixpath.dirname(target) or target}", 'Error: No such directory')
+        return path.split('/')
+
+    def writable_index(self):
+        if self.index is self.archive.index:
+            self.index = self.index.fork()
+        return self.index
+
+    def put_file(self, parts, data, size):
+        if isinstance(data, str):
+            self.overlay_files.append(data)
+        self.writable_index().put(parts, FSNode(parts[-1], False, size, data=data))
+
+    def redirect_sink(self, target):
+        parts = self.overlay_parts(target)
+        node = self.lookup('/'.join(parts))
+        if node is not None and node.is_dir:
+            raise CommandError(f"Is a directory: {target}", 'Error: Is a directory')
+        return lambda: OverlayFile(lambda data, size: self.put_file(parts, data, size), self.overlay_dir)
+
+    # Методы для прямого вызова команд (используются в тестах)
+    def ls(self, args):
+        self.emit('ls', self.ls_lines(args))
+
+    def cd(self, args):
+        self.run_command(' '.join(['cd', *args]), lookup_command('cd'), args)
 
     def uniq(self, args):
+        self.run_command(' '.join(['uniq', *args]), lookup_command('uniq'), args)
+
+    def du(self, args=None):
+        self.run_command(' '.join(['du', *(args or [])]), lookup_command('du'), args or [])
+
+    def cal(self, year=None, month=None):
+        args = [] if year is None else [str(year), str(month)]
+        self.run_command('cal', lookup_command('cal'), args)
+
+    @command('exit', aliases=('quit',), max_args=None, pipe=False)
+    def cmd_exit(self, opts, args, stdin):
+        self.log('exit', 'Exit')
+        self.close()
+        exit(0)
+
+    @command('ls', usage='ls [path]', aliases=('dir',), max_args=1)
+    def cmd_ls(self, opts, args, stdin):
+        return self.ls_lines(self.resolve_path(args[0]) if args else self.current_dir)
+
+    def ls_lines(self, path):
+        node = self.lookup(path.strip('/'))
+        if node is None:
+            raise CommandError(f"No such file or directory: {path}", 'Error: No such file or directory')
+        if node.is_dir:
+            self.entries_scanned += len(node.children)
+            yield from sorted(node.children)
+        else:
+            yield node.name
+
+    @command('cd', usage='cd <directory>', min_args=1, max_args=1, pipe=False)
+    def cmd_cd(self, opts, args, stdin):
+        target = args[0]
+        new_path = self.resolve_path(target)
+
+        # Проверка наличия каталога по индексу
+        node = self.lookup(new_path)
+        if node is None or not node.is_dir:
+            raise CommandError(f"No such directory: {target}", 'Error: No such directory')
+        self.current_dir = new_path + '/' if new_path else '/'
+
+    @command('uniq', usage='uniq [-c] [-d] [-u] [-g [--hash]] <file>', max_args=1,
+             flags={'-c': 'count', '-d': 'repeated', '-u': 'unique', '-g': 'global_', '--hash': 'hashed'})
+    def cmd_uniq(self, opts, args, stdin):
+        if (not args and stdin is None) or (opts['hashed'] and not opts['global_']):
+            raise lookup_command('uniq').usage_error()
+        if opts['hashed'] and (opts['count'] or opts['unique']):
+            # Для -c и -u нужны сами строки, а --hash хранит только их дайджесты
+            flags = ' and '.join(flag for flag, dest in (('-c', 'count'), ('-u', 'unique')) if opts[dest])
+            raise CommandError(f"{flags} cannot be combined with --hash", 'Error: Invalid arguments')
+        if not args:
+            # Без имени файла uniq читает вывод предыдущей стадии конвейера
+            return uniq_lines(stdin, **opts)
+        # Проверка пути сразу, чтение файла - лениво
+        return uniq_lines(self.node_lines(self.lookup_file(args[0])), **opts)
+
+    @command('du', usage='du [-s] [-h] [-d N] [path]', max_args=1,
+             flags={'-s': 'summary', '-h': 'human'}, options={'-d': ('depth', int)})
+    def cmd_du(self, opts, args, stdin):
+        depth = 1 if opts['depth'] is None else opts['depth']
+        if depth < 0:
+            raise lookup_command('du').usage_error()
+
         if not args:
-            print("Usage: uniq <file>")
+            label = self.current_dir
+            node = self.lookup(self.current_dir.strip('/'))
+        else:
+            path = self.resolve_path(args[0])
+            label = path + '/' if path else '/'
+            node = self.lookup(path)
+        if node is None or not node.is_dir:
+            raise CommandError(f"No such directory: {args[0] if args else self.current_dir}", 'Error: No such directory')
+        return self.du_lines(node, label, opts['summary'], opts['human'], depth)
+
+    def du_lines(self, node, label, summary, human, depth):
+        fmt = format_size if human else (lambda size: f"{size} bytes")
+
+        # Все размеры берутся из заранее посчитанной таблицы
+        if summary:
+            yield f"Total size of {label}: {fmt(node.size)} ({node.files} files)"
             return
 
-        file_path = os.path.normpath(os.path.join(self.current_dir, args[0])).replace("\\","/").lstrip('/')
+        yield f"Total size of {label}: {fmt(node.size)}"
+
+        directory_sizes = list(ArchiveIndex.subdirs(node, depth)) if depth else []
+        if not directory_sizes:
+            yield "No subdirectories found."
+            return 'No subdirectories'
+        self.entries_scanned += len(directory_sizes)
+        for subdir, child in directory_sizes:
+            yield f"{subdir}: {fmt(child.size)}"
+
+    @command('cal', usage='cal [year month]', max_args=2)
+    def cmd_cal(self, opts, args, stdin):
+        now = datetime.now()
         try:
-            with self.zip.open(file_path) as file:
-                lines = file.read().decode().splitlines()
-                unique_lines = list(dict.fromkeys(lines))
-                for el in unique_lines:
-                    print(el)
-                self.log(f'uniq {args[0]}', 'Success')
-        except KeyError:
-            print(f"No such file: {args[0]}")
-            self.log(f'uniq {args[0]}', 'Error: No such file')
-        except Exception as e:
-            print(f"Error: {e}")
-            self.log(f'uniq {args[0]}', f'Error: {e}')
+            year, month = (int(args[0]), int(args[1])) if args else (now.year, now.month)
+        except (ValueError, IndexError):
+            raise lookup_command('cal').usage_error()
+        if not 1 <= month <= 12:
+            raise lookup_command('cal').usage_error()
+        return calendar.month(year, month).splitlines()
+
+    @command('stats')
+    def cmd_stats(self, opts, args, stdin):
+        cache = self.archive.cache
+        if cache is None:
+            yield "Cache: disabled"
+        else:
+            yield (f"Cache: {cache.hits} hits, {cache.misses} misses, {cache.evictions} evictions, "
+                   f"{len(cache.entries)} entries, {format_size(cache.used)} of {format_size(cache.budget)} used")
 
-    def du(self):
-        paths = self.zip.namelist()
-        directory_sizes = {}
+        # Перцентили по последним LATENCY_SAMPLES вызовам каждой команды
+        for name, samples in sorted(self.latencies.items()):
+            ordered = sorted(samples)
+            p50, p95, p99 = (percentile(ordered, p) / 1e6 for p in (50, 95, 99))
+            yield f"{name}: {len(ordered)} calls, p50 {p50:.3f} ms, p95 {p95:.3f} ms, p99 {p99:.3f} ms"
 
-        total_size = 0
+    @command('touch', usage='touch <file>...', min_args=1, max_args=None, pipe=False)
+    def cmd_touch(self, opts, args, stdin):
+        for target in args:
+            parts = self.overlay_parts(target)
+            # Времена изменения не хранятся, поэтому существующий файл не меняется
+            if self.lookup('/'.join(parts)) is None:
+                self.put_file(parts, b'', 0)
 
-        # Проходим по всем файлам в архиве
-        for path in paths:
-            # Пропускаем файлы, не находящиеся в текущей директории
-            if not path.startswith(self.current_dir.lstrip('/')):
+    @command('mkdir', usage='mkdir [-p] <directory>...', min_args=1, max_args=None, pipe=False,
+             flags={'-p': 'parents'})
+    def cmd_mkdir(self, opts, args, stdin):
+        for target in args:
+            path = self.resolve_path(target)
+            if opts['parents']:
+                parts = path.split('/') if path else []
+                for depth in range(1, len(parts) + 1):
+                    node = self.lookup('/'.join(parts[:depth]))
+                    if node is None:
+                        self.writable_index().put(parts[:depth], FSNode(parts[depth - 1], True))
+                    elif not node.is_dir:
+                        raise CommandError(f"Not a directory: {'/'.join(parts[:depth])}", 'Error: Not a directory')
                 continue
+            parts = self.overlay_parts(target)
+            if self.lookup(path) is not None:
+                raise CommandError(f"File exists: {target}", 'Error: File exists')
+            self.writable_index().put(parts, FSNode(parts[-1], True))
 
-            # Извлекаем имя подкаталога
-            parts = path[len(self.current_dir.lstrip('/')):].split('/')
-
-            if len(parts) > 1:  # это файл в подкаталоге
-                subdirectory = parts[0]
-                # Получаем размер файла
-                file_size = self.zip.getinfo(path).file_size
-
-                # Добавляем размер файла в общий размер
-                total_size += file_size
-                # Добавляем размер файла в соответствующий подкаталог
-                if (subdirectory not in directory_sizes) and not(path.endswith('.txt')):# Пропускаем .txt файлы
-                    directory_sizes[subdirectory] = 0
-                directory_sizes[subdirectory] += file_size
-            else:  # Это файл в текущем каталоге
-                # Получаем размер файла
-                file_size = self.zip.getinfo(path).file_size
-                total_size += file_size
-
-        print(f"Total size of {self.current_dir}: {total_size} bytes")
-
-        if directory_sizes:
-            for subdir, size in directory_sizes.items():
-                print(f"{subdir}: {size} bytes")
-            self.log("du", "Success")
-        else:
-            print("No subdirectories found.")
-            self.log("du", "No subdirectories")
+    @command('rm', usage='rm [-r] <path>...', min_args=1, max_args=None, pipe=False,
+             flags={'-r': 'recursive'})
+    def cmd_rm(self, opts, args, stdin):
+        for target in args:
+            parts = self.overlay_parts(target)
+            path = '/'.join(parts)
+            node = self.lookup(path)
+            if node is None:
+                raise CommandError(f"No such file or directory: {target}", 'Error: No such file or directory')
+            if node.is_dir and not opts['recursive']:
+                raise CommandError(f"Is a directory: {target}", 'Error: Is a directory')
+            self.writable_index().remove(parts)
+            if (self.current_dir.strip('/') + '/').startswith(path + '/'):
+                # Удален текущий каталог или его предок - переходим в родителя удаленного
+                parent = posixpath.dirname(path)
+                self.current_dir = parent + '/' if parent else '/'
 
-    def cal(self, year=datetime.now().year, month=datetime.now().month):
+    @command('cp', usage='cp [-r] <source> <destination>', min_args=2, max_args=2, pipe=False,
+             flags={'-r': 'recursive'})
+    def cmd_cp(self, opts, args, stdin):
+        source, target = args
+        node = self.lookup(self.resolve_path(source))
+        if node is None:
+            raise CommandError(f"No such file or directory: {source}", 'Error: No such file or directory')
+        if node.is_dir and not opts['recursive']:
+            raise CommandError(f"Is a directory: {source}", 'Error: Is a directory')
+        parts = self.overlay_parts(target)
+        existing = self.lookup('/'.join(parts))
+        if existing is not None and existing.is_dir:
+            parts.append(node.name)
+            existing = self.lookup('/'.join(parts))
+        if existing is not None and existing.is_dir != node.is_dir:
+            raise CommandError(f"Cannot overwrite: {target}", 'Error: Cannot overwrite')
+        destination = '/'.join(parts)
+        if node.is_dir and (destination + '/').startswith(self.resolve_path(source) + '/'):
+            raise CommandError(f"Cannot copy a directory into itself: {source}", 'Error: Invalid destination')
+        # Поддерево не копируется: узлы общие, пока одна из копий не изменится
+        index = self.writable_index()
+        index.put(parts, index.copy(node, parts[-1]))
+
+    @command('commit', usage='commit <output.zip>', min_args=1, max_args=1, pipe=False)
+    def cmd_commit(self, opts, args, stdin):
+        output = args[0]
+        if os.path.abspath(output) == os.path.abspath(self.archive.path):
+            raise CommandError("Cannot overwrite the open archive", 'Error: Invalid output')
+        count = self.write_archive(output)
+        return [f"Committed {count} entries to {output}"]
+
+    def write_archive(self, output):
+        # Неизмененные файлы копируются из архива в сжатом виде, новые - сжимаются.
+        # Каталог пишется отдельной записью, если он был в исходном архиве или пуст
+        mmap_zip = import_local('mmap_zip')
+        tmp_path = output + '.tmp'
+        count = 0
         try:
-            print(calendar.month(year, month))
-            self.log('cal', 'Success')
-        except Exception as e:
-            print(f"Error: {e}")
-            self.log('cal', f'Error: {e}')
+            with open(self.archive.path, 'rb') as source, mmap_zip.RawZipWriter(tmp_path) as writer:
+                for path, node in ArchiveIndex.iter_entries(self.index.root):
+                    self.entries_scanned += 1
+                    if node.is_dir:
+                        if node.member is None and node.children:
+                            continue
+                        writer.add_dir(path)
+                    elif node.data is None:
+                        writer.copy_raw(path, source, self.archive.getinfo(node.member))
+                        self.bytes_read += node.size
+                    else:
+                        with self.open_file(node) as file:
+                            writer.add_bytes(path, file.read())
+                    count += 1
+            os.replace(tmp_path, output)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return count
+
+
+class ShellServer:
+    # Асинхронный сервер: много сессий над одним индексом архива и пулом дескрипторов.
+    # У каждой сессии свои current_dir и журнал, команды выполняются в пуле потоков.
+    # asyncio импортируется только в режиме сервера
+    def __init__(self, config_path, profile=None):
+        self.config_path = config_path
+        self.profile = profile
+        settings = read_settings(config_path)
+        self.archive = Archive.from_settings(settings)
+        self.sessions = 0
+
+    @staticmethod
+    def execute(session, command):
+        session.output = io.StringIO()
+        try:
+            session.handle_command(command)
+        except SystemExit:
+            return session.output.getvalue(), True
+        return session.output.getvalue(), False
+
+    async def handle_client(self, reader, writer):
+        self.sessions += 1
+        session = ShellEmulator(self.config_path, archive=self.archive, session=self.sessions, profile=self.profile)
+        import asyncio
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                writer.write(f"{session.computer_name}:{session.current_dir}$ ".encode())
+                await writer.drain()
+                line = await reader.readline()
+                if not line:
+                    break
+                command = line.decode('utf-8', 'replace').strip()
+                if not command:
+                    continue
+                output, finished = await loop.run_in_executor(None, self.execute, session, command)
+                writer.write(output.encode())
+                if finished:
+                    await writer.drain()
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            session.close()
+            writer.close()
+
+    async def start(self, host=None, port=None, unix_path=None):
+        import asyncio
+        if unix_path:
+            return await asyncio.start_unix_server(self.handle_client, path=unix_path)
+        return await asyncio.start_server(self.handle_client, host, port)
+
+    async def serve(self, host=None, port=None, unix_path=None):
+        server = await self.start(host, port, unix_path)
+        async with server:
+            await server.serve_forever()
+
+    def close(self):
+        self.archive.close()
 
 
 if __name__ == "__main__":
-    config_path = input("Enter path to config file: ").strip()
-    emulator = ShellEmulator(config_path)
-    emulator.run()
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Shell emulator over a zip archive.')
+    parser.add_argument('config', nargs='?', help='Path to config file.')
+    parser.add_argument('--script', metavar='FILE', help="Run commands from FILE ('-' for stdin) without prompts.")
+    parser.add_argument('--serve', metavar='[HOST:]PORT', help='Serve sessions over TCP.')
+    parser.add_argument('--unix', metavar='PATH', help='Serve sessions over a Unix socket.')
+    parser.add_argument('--profile', metavar='FILE', help='Write cProfile stats of each session to FILE (FILE.<n> for server sessions).')
+    cli_args = parser.parse_args()
+
+    if cli_args.serve or cli_args.unix:
+        import asyncio
+        if not cli_args.config:
+            parser.error("config path is required in server mode")
+        server = ShellServer(cli_args.config, cli_args.profile)
+        host, _, port = (cli_args.serve or '').rpartition(':')
+        try:
+            asyncio.run(server.serve(host or '127.0.0.1', int(port) if port else None, cli_args.unix))
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.close()
+        sys.exit(0)
+
+    if cli_args.script == '-' and not cli_args.config:
+        parser.error("config path is required when reading commands from stdin")
+    config_path = cli_args.config or input("Enter path to config file: ").strip()
+    emulator = ShellEmulator(config_path, profile=cli_args.profile)
+    if cli_args.script is None:
+        emulator.run()
+    elif cli_args.script == '-':
+        emulator.run_script(sys.stdin)
+    else:
+        with open(cli_args.script, encoding='utf-8') as script:
+            emulator.run_script(script)
+    emulator.close()
@@ -1,10 +1,14 @@
 import io
 import sys
+import asyncio
 import unittest
 import os
 import zipfile
 import configparser
+import threading
+import csv
 import config_tasks.task1.shell_emulator as vcl
+import config_tasks.task1.mmap_zip as mmap_zip
 
 
 class TestShellEmulator(unittest.TestCase):
@@ -47,6 +51,114 @@ class TestShellEmulator(unittest.TestCase):
         self.assertEqual(vc.fs_zip, 'virtual_fs_test.zip')
         self.assertEqual(vc.log_file, 'test_log.csv')
 
+    def test_log_batched(self):
+        self.setUp()
+        config = configparser.ConfigParser()
+        config.read('config_test.ini')
+        config['Settings']['log_mode'] = 'batched'
+        config['Settings']['log_flush_rows'] = '3'
+        config['Settings']['log_flush_interval'] = '60'
+        with open('config_batched_test.ini', 'w') as file:
+            config.write(file)
+        try:
+            vc = vcl.ShellEmulator('config_batched_test.ini')
+        finally:
+            os.remove('config_batched_test.ini')
+
+        sys.stdout = io.StringIO()
+        vc.cal(2005, 4)
+        sys.stdout = sys.__stdout__
+        with open('test_log.csv') as log:
+            self.assertEqual('', log.read())
+
+        sys.stdout = io.StringIO()
+        vc.cal(2005, 5)
+        sys.stdout = sys.__stdout__
+        with open('test_log.csv') as log:
+            rows = log.read().strip().split('\n')
+        self.assertEqual(3, len(rows))
+        self.assertEqual('Timestamp,Command,Result,DurationNs,BytesRead,EntriesScanned', rows[0])
+
+        vc.close()
+
+    def test_mmap_backend(self):
+        self.setUp()
+        config = configparser.ConfigParser()
+        config.read('config_test.ini')
+        config['Settings']['fs_backend'] = 'mmap'
+        with open('config_mmap_test.ini', 'w') as file:
+            config.write(file)
+        try:
+            for run in range(2):  # второй запуск читает дерево из virtual_fs_test.zip.tree
+                vc = vcl.ShellEmulator('config_mmap_test.ini')
+                vc.current_dir = 'test_directory/'
+                self.assertTrue(os.path.exists('virtual_fs_test.zip.idx'))
+                self.assertTrue(os.path.exists('virtual_fs_test.zip.tree'))
+                self.assertEqual(run == 1, isinstance(vc.index.root, vcl.LazyDirNode))
+                if run == 1:
+                    # Каталог, запрошенный из нескольких потоков сразу, раскрывается один раз
+                    root = vc.index.root
+                    self.assertIsNotNone(root.tree)
+                    barrier = threading.Barrier(8)
+                    seen = []
+
+                    def expand():
+                        barrier.wait()
+                        seen.append(root.children)
+
+                    threads = [threading.Thread(target=expand) for _ in range(8)]
+                    for thread in threads:
+                        thread.start()
+                    for thread in threads:
+                        thread.join()
+                    self.assertIsNone(root.tree)
+                    self.assertTrue(all(children is root.children for children in seen))
+
+                captured_output = io.StringIO()
+                sys.stdout = captured_output
+                vc.ls(vc.current_dir)
+                vc.uniq(['subdir1/file3.txt'])
+                sys.stdout = sys.__stdout__
+                vc.close()
+
+                output = captured_output.getvalue().strip().split('\n')
+                self.assertEqual(['file1.txt', 'file2.txt', 'subdir1', 'subdir2', 'Test file 3 content'], output)
+        finally:
+            os.remove('config_mmap_test.ini')
+            os.remove('virtual_fs_test.zip.idx')
+            os.remove('virtual_fs_test.zip.tree')
+
+    def test_mmap_member_reader(self):
+        # Мелкие чтения сжимаемой записи: распаковка по частям, а не всего остатка на каждый вызов
+        data = b''.join(b'line %d\n' % (i % 50) for i in range(200000))
+        with zipfile.ZipFile('mmap_reader_test.zip', 'w', zipfile.ZIP_DEFLATED) as archive:
+            archive.writestr('big.txt', data)
+            archive.writestr('stored.txt', b'stored', compress_type=zipfile.ZIP_STORED)
+        archive = mmap_zip.MmapZipArchive('mmap_reader_test.zip', sidecar=False)
+        try:
+            for name, expected in (('big.txt', data), ('stored.txt', b'stored')):
+                with archive.open(name) as file:
+                    raw = file.raw
+                    chunks = []
+                    while True:
+                        chunk = raw.read(1000)
+                        if not chunk:
+                            break
+                        self.assertLessEqual(len(chunk), 1000)
+                        chunks.append(chunk)
+                    self.assertEqual(expected, b''.join(chunks))
+                    self.assertLessEqual(len(raw.tail) + len(raw.pending), 64 * 1024)
+
+            info = archive.getinfo('big.txt')
+            info.CRC ^= 1
+            with self.assertRaises(zipfile.BadZipFile):
+                with archive.open(info) as file:
+                    while file.read(4096):
+                        pass
+        finally:
+            archive.close()
+            os.remove('mmap_reader_test.zip')
+
     # LS
     def test_ls_command(self):
         self.setUp()
@@ -90,6 +202,19 @@ class TestShellEmulator(unittest.TestCase):
         expected_output = ['']
         self.assertEqual(output, expected_output)
 
+    def test_ls_relative_path(self):
+        self.setUp()
+        vc = vcl.ShellEmulator('config_test.ini')
+        vc.current_dir = 'test_directory/'
+
+        captured_output = io.StringIO()
+        sys.stdout = captured_output
+        vc.handle_command('ls subdir1')
+        sys.stdout = sys.__stdout__
+
+        output = captured_output.getvalue().strip().split('\n')
+        self.assertEqual(['file3.txt'], output)
+
 # CD
     def test_cd_to_subdirectory(self):
         self.setUp()
@@ -105,6 +230,16 @@ class TestShellEmulator(unittest.TestCase):
         vc.cd(['..'])
         self.assertEqual(vc.current_dir, 'test_directory/')
 
+    def test_cd_implicit_directory(self):
+        with zipfile.ZipFile('virtual_fs_test.zip', 'w') as zf:
+            zf.writestr('implicit/nested/file.txt', 'content')
+        vc = vcl.ShellEmulator('config_test.ini')
+        vc.current_dir = '/'
+        vc.cd(['implicit/nested'])
+        self.assertEqual(vc.current_dir, 'implicit/nested/')
+        vc.cd(['../..'])
+        self.assertEqual(vc.current_dir, '/')
+
     def test_cd_error(self):
         self.setUp()
         vc = vcl.ShellEmulator('config_test.ini')
@@ -159,6 +294,34 @@ class TestShellEmulator(unittest.TestCase):
         output = captured_output.getvalue().strip().split('\n')
         self.assertEqual(['Total size of test_directory/subdir2/: 0 bytes', 'No subdirectories found.'], output)
 
+    def test_du_summary(self):
+        self.setUp()
+        vc = vcl.ShellEmulator('config_test.ini')
+        vc.current_dir = 'test_directory/'
+
+        captured_output = io.StringIO()
+        sys.stdout = captured_output
+        vc.du(['-s'])
+        sys.stdout = sys.__stdout__
+
+        output = captured_output.getvalue().strip().split('\n')
+        self.assertEqual(['Total size of test_directory/: 67 bytes (3 files)'], output)
+
+    def test_du_depth(self):
+        with zipfile.ZipFile('virtual_fs_test.zip', 'w') as zf:
+            zf.writestr('root/a/b/file.txt', 'x' * 2048)
+            zf.writestr('root/a/file.txt', 'x' * 10)
+        vc = vcl.ShellEmulator('config_test.ini')
+        vc.current_dir = '/'
+
+        captured_output = io.StringIO()
+        sys.stdout = captured_output
+        vc.du(['-d', '2', '-h', 'root'])
+        sys.stdout = sys.__stdout__
+
+        output = captured_output.getvalue().strip().split('\n')
+        self.assertEqual(['Total size of root/: 2.0 KiB', 'a: 2.0 KiB', 'a/b: 2.0 KiB'], output)
+
     #UNIQ
     def test_uniq_singlefile(self):
         self.setUp()
@@ -199,6 +362,352 @@ class TestShellEmulator(unittest.TestCase):
         output = captured_output.getvalue().strip().split('\n')
         self.assertEqual(['Test file 3 content'], output)
 
+    def test_uniq_flags(self):
+        with zipfile.ZipFile('virtual_fs_test.zip', 'w') as zf:
+            zf.writestr('dir/lines.txt', 'a\na\nb\na\nc\r\nc\n')
+        vc = vcl.ShellEmulator('config_test.ini')
+        vc.current_dir = 'dir/'
+
+        outputs = {}
+        for flags in ([], ['-c'], ['-d'], ['-u'], ['-g'], ['-g', '--hash']):
+            captured_output = io.StringIO()
+            sys.stdout = captured_output
+            vc.uniq(flags + ['lines.txt'])
+            sys.stdout = sys.__stdout__
+            outputs[' '.join(flags)] = captured_output.getvalue().split('\n')[:-1]
+
+        self.assertEqual(['a', 'b', 'a', 'c'], outputs[''])
+        self.assertEqual(['      2 a', '      1 b', '      1 a', '      2 c'], outputs['-c'])
+        self.assertEqual(['a', 'c'], outputs['-d'])
+        self.assertEqual(['b', 'a'], outputs['-u'])
+        self.assertEqual(['a', 'b', 'c'], outputs['-g'])
+        self.assertEqual(['a', 'b', 'c'], outputs['-g --hash'])
+
+        # Несовместимые с --hash ключи отвергаются до открытия файла
+        captured_output = io.StringIO()
+        sys.stdout = captured_output
+        vc.uniq(['-c', '-g', '--hash', 'missing.txt'])
+        vc.uniq(['-g', '--hash', '-u', 'missing.txt'])
+        vc.uniq(['-c', '-u', '-g', '--hash', 'lines.txt'])
+        sys.stdout = sys.__stdout__
+        self.assertEqual(['-c cannot be combined with --hash', '-u cannot be combined with --hash',
+                          '-c and -u cannot be combined with --hash'],
+                         captured_output.getvalue().strip().split('\n'))
+
+    # PIPELINES
+    def test_pipeline_ls_uniq(self):
+        self.setUp()
+        vc = vcl.ShellEmulator('config_test.ini')
+        vc.current_dir = 'test_directory/'
+
+        captured_output = io.StringIO()
+        sys.stdout = captured_output
+        vc.handle_command('uniq file2.txt | uniq -c')
+        sys.stdout = sys.__stdout__
+
+        output = captured_output.getvalue().strip().split('\n')
+        self.assertEqual(['1 Test'], [line.strip() for line in output])
+
+    def test_pipeline_errors(self):
+        self.setUp()
+        vc = vcl.ShellEmulator('config_test.ini')
+        vc.current_dir = 'test_directory/'
+        vcl._entry_points = None
+
+        captured_output = io.StringIO()
+        sys.stdout = captured_output
+        # Команда, меняющая состояние, отвергается без просмотра точек входа для остальных стадий
+        vc.handle_command('cd subdir1 | nosuch')
+        entry_points_scanned = vcl._entry_points is not None
+        vc.handle_command('ls | nosuch')
+        vc.handle_command('ls | cd subdir1')
+        sys.stdout = sys.__stdout__
+
+        self.assertFalse(entry_points_scanned)
+        self.assertEqual(['Cannot be used in a pipeline: cd subdir1', 'Unknown command: nosuch',
+                          'Cannot be used in a pipeline: cd subdir1'],
+                         captured_output.getvalue().strip().split('\n'))
+        self.assertEqual('test_directory/', vc.current_dir)
+
+    def test_run_script(self):
+        self.setUp()
+        vc = vcl.ShellEmulator('config_test.ini')
+        vc.current_dir = 'test_directory/'
+
+        captured_output = io.StringIO()
+        captured_errors = io.StringIO()
+        sys.stdout, sys.stderr = captured_output, captured_errors
+        vc.run_script(io.StringIO('cd subdir1\n# comment\n\nls\n'))
+        sys.stdout, sys.stderr = sys.__stdout__, sys.__stderr__
+
+        self.assertEqual(['file3.txt'], captured_output.getvalue().strip().split('\n'))
+        self.assertIn('Executed 2 commands', captured_errors.getvalue())
+
+    # SERVER
+    def test_server_sessions(self):
+        self.setUp()
+        server = vcl.ShellServer('config_test.ini')
+
+        async def command(connection, line):
+            reader, writer = connection
+            writer.write((line + '\n').encode())
+            return (await reader.readuntil(b'$ ')).decode()
+
+        async def scenario():
+            tcp = await server.start('127.0.0.1', 0)
+            port = tcp.sockets[0].getsockname()[1]
+            first = await asyncio.open_connection('127.0.0.1', port)
+            second = await asyncio.open_connection('127.0.0.1', port)
+            await first[0].readuntil(b'$ ')
+            await second[0].readuntil(b'$ ')
+
+            await command(first, 'cd /test_directory/subdir1')
+            first_ls = await command(first, 'ls')
+            second_ls = await command(second, 'ls /test_directory')
+            first[1].write(b'exit\n')
+            self.assertEqual(b'', await first[0].read())
+            second[1].close()
+            tcp.close()
+            await tcp.wait_closed()
+            return first_ls, second_ls
+
+        try:
+            first_ls, second_ls = asyncio.run(scenario())
+        finally:
+            server.close()
+            for session in (1, 2):
+                if os.path.exists(f'test_log.{session}.csv'):
+                    os.remove(f'test_log.{session}.csv')
+
+        self.assertEqual('file3.txt\ntest_user:test_directory/subdir1/$ ', first_ls)
+        self.assertEqual('file1.txt\nfile2.txt\nsubdir1\nsubdir2\ntest_user:virtual_fs/$ ', second_ls)
+
+    # STATS
+    def test_stats_cache_counters(self):
+        self.setUp()
+        vc = vcl.ShellEmulator('config_test.ini')
+        vc.current_dir = 'test_directory/'
+
+        captured_output = io.StringIO()
+        sys.stdout = captured_output
+        vc.uniq(['file2.txt'])
+        vc.uniq(['file2.txt'])
+        vc.handle_command('stats')
+        sys.stdout = sys.__stdout__
+
+        output = captured_output.getvalue().strip().split('\n')
+        self.assertEqual(['Test', 'Test'], output[:2])
+        self.assertTrue(output[2].startswith('Cache: 1 hits, 1 misses, 0 evictions, 1 entries, 9 bytes'))
+
+    def test_stats_latency(self):
+        self.setUp()
+        vc = vcl.ShellEmulator('config_test.ini')
+        vc.current_dir = 'test_directory/'
+
+        captured_output = io.StringIO()
+        sys.stdout = captured_output
+        vc.handle_command('uniq file2.txt')
+        vc.handle_command('ls')
+        vc.handle_command('ls subdir1')
+        vc.handle_command('stats')
+        sys.stdout = sys.__stdout__
+        vc.close()
+
+        output = captured_output.getvalue().strip().split('\n')
+        self.assertRegex(output[-2], r'^ls: 2 calls, p50 [\d.]+ ms, p95 [\d.]+ ms, p99 [\d.]+ ms$')
+        self.assertRegex(output[-1], r'^uniq: 1 calls, ')
+
+        with open('test_log.csv') as log:
+            rows = list(csv.reader(log))
+        self.assertEqual(['Timestamp', 'Command', 'Result', 'DurationNs', 'BytesRead', 'EntriesScanned'], rows[0])
+        self.assertEqual(['uniq file2.txt', 'Success', '9', '2'], rows[1][1:3] + rows[1][4:])
+        self.assertGreater(int(rows[1][3]), 0)
+
+    def test_member_cache_eviction(self):
+        cache = vcl.MemberCache(10)
+        cache.put('a', b'12345')
+        cache.put('b', b'12345')
+        self.assertEqual(b'12345', cache.get('a'))
+        cache.put('c', b'123')
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual((1, 1, 1), (cache.hits, cache.misses, cache.evictions))
+        self.assertEqual(['a', 'c'], list(cache.entries))
+
+    # REGISTRY
+    def test_alias_and_usage(self):
+        self.setUp()
+        vc = vcl.ShellEmulator('config_test.ini')
+        vc.current_dir = 'test_directory/'
+
+        captured_output = io.StringIO()
+        sys.stdout = captured_output
+        vc.handle_command('dir subdir1')
+        vc.handle_command('du -d')
+        sys.stdout = sys.__stdout__
+
+        output = captured_output.getvalue().strip().split('\n')
+        self.assertEqual(['file3.txt', 'Usage: du [-s] [-h] [-d N] [path]'], output)
+
+    def test_plugin_commands(self):
+        self.setUp()
+        vc = vcl.ShellEmulator('config_test.ini')
+        vc.current_dir = 'test_directory/'
+
+        captured_output = io.StringIO()
+        sys.stdout = captured_output
+        vc.handle_command('cat file2.txt')
+        vc.handle_command('wc -l file2.txt subdir1/file3.txt')
+        sys.stdout = sys.__stdout__
+
+        output = captured_output.getvalue().strip().split('\n')
+        self.assertEqual(['Test', 'Test', '2 file2.txt', '2 subdir1/file3.txt', '4 total'],
+                         [line.strip() for line in output])
+
+    # FIND / GREP
+    def test_find(self):
+        self.setUp()
+        vc = vcl.ShellEmulator('config_test.ini')
+        vc.current_dir = 'test_directory/'
+
+        captured_output = io.StringIO()
+        sys.stdout = captured_output
+        vc.handle_command('find *3.txt')
+        vc.handle_command('find subdir* /test_directory')
+        sys.stdout = sys.__stdout__
+
+        output = captured_output.getvalue().strip().split('\n')
+        self.assertEqual(['subdir1/file3.txt', '/test_directory/subdir1', '/test_directory/subdir2'], output)
+
+    def test_grep(self):
+        self.setUp()
+        vc = vcl.ShellEmulator('config_test.ini')
+        vc.current_dir = 'test_directory/'
+        commands = vcl.import_local('shell_commands')
+
+        # Второй проход - через пул процессов
+        outputs = []
+        default_min_bytes = commands.PARALLEL_MIN_BYTES
+        try:
+            for parallel_min_bytes in (default_min_bytes, 0):
+                commands.PARALLEL_MIN_BYTES = parallel_min_bytes
+                captured_output = io.StringIO()
+                sys.stdout = captured_output
+                vc.handle_command('grep -n content .')
+                vc.handle_command('grep -c -i TEST file2.txt')
+                vc.handle_command('grep -l Test file2.txt')
+                # Кавычки: '|' и пробел - часть регулярного выражения, а не конвейер
+                vc.handle_command('grep -l "file 1|file 3" .')
+                vc.handle_command('cat file2.txt | grep -n Test')
+                vc.handle_command('cat file2.txt | grep -l Test')
+                sys.stdout = sys.__stdout__
+                outputs.append(captured_output.getvalue().strip().split('\n'))
+        finally:
+            sys.stdout = sys.__stdout__
+            commands.PARALLEL_MIN_BYTES = default_min_bytes
+
+        expected = ['file1.txt:1:Test file 1 content',
+                    'subdir1/file3.txt:1:Test file 3 content',
+                    'subdir1/file3.txt:2:Test file 3 content',
+                    '2',
+                    'file2.txt',
+                    'file1.txt',
+                    'subdir1/file3.txt',
+                    '1:Test',
+                    '2:Test',
+                    '(standard input)']
+        self.assertEqual([expected, expected], outputs)
+
+    # OVERLAY
+    def test_overlay_commands(self):
+        self.setUp()
+        vc = vcl.ShellEmulator('config_test.ini')
+        vc.current_dir = 'test_directory/'
+        other = vcl.ShellEmulator('config_test.ini', archive=vc.archive)
+        other.current_dir = 'test_directory/'
+
+        captured_output = io.StringIO()
+        sys.stdout = captured_output
+        vc.handle_command('mkdir -p new/deep')
+        vc.handle_command('touch new/empty.txt')
+        vc.handle_command('cat file2.txt > new/deep/copy.txt')
+        vc.handle_command('cp -r subdir1 new')
+        vc.handle_command('rm file1.txt')
+        vc.handle_command('rm subdir2')
+        vc.handle_command('ls')
+        vc.handle_command('find * new')
+        vc.handle_command('cat new/deep/copy.txt')
+        vc.handle_command('du -s')
+        other.handle_command('ls')
+        sys.stdout = sys.__stdout__
+        other.close()
+
+        output = captured_output.getvalue().strip().split('\n')
+        self.assertEqual(['Is a directory: subdir2',
+                          'file2.txt', 'new', 'subdir1', 'subdir2',
+                          'new/deep', 'new/deep/copy.txt', 'new/empty.txt', 'new/subdir1', 'new/subdir1/file3.txt',
+                          'Test', 'Test',
+                          'Total size of test_directory/: 97 bytes (5 files)',
+                          'file1.txt', 'file2.txt', 'subdir1', 'subdir2'], output)
+
+        # Исходный архив и индекс не изменились
+        self.assertEqual(19, vc.archive.index.lookup('test_directory/file1.txt').size)
+        self.assertIsNone(vc.archive.index.lookup('test_directory/new'))
+
+    def test_overlay_commit(self):
+        self.setUp()
+        vc = vcl.ShellEmulator('config_test.ini')
+        vc.current_dir = 'test_directory/'
+
+        captured_output = io.StringIO()
+        sys.stdout = captured_output
+        vc.handle_command('mkdir empty')
+        vc.handle_command('ls > listing.txt')
+        vc.handle_command('rm -r subdir1')
+        vc.handle_command('commit virtual_fs_test.zip')
+        vc.handle_command('commit committed_test.zip')
+        sys.stdout = sys.__stdout__
+
+        try:
+            output = captured_output.getvalue().strip().split('\n')
+            self.assertEqual(['Cannot overwrite the open archive', 'Committed 5 entries to committed_test.zip'], output)
+            with zipfile.ZipFile('committed_test.zip') as zf:
+                self.assertIsNone(zf.testzip())
+                self.assertEqual(['test_directory/file1.txt', 'test_directory/file2.txt', 'test_directory/subdir2/',
+                                  'test_directory/empty/', 'test_directory/listing.txt'],
+                                 [name for name in zf.namelist()])
+                self.assertEqual(b'Test file 1 content', zf.read('test_directory/file1.txt'))
+                self.assertEqual(b'empty\nfile1.txt\nfile2.txt\nsubdir1\nsubdir2\n', zf.read('test_directory/listing.txt'))
+        finally:
+            os.remove('committed_test.zip')
+
+    def test_overlay_redirect_errors(self):
+        # Команда с ошибкой не оставляет временных файлов в overlay_dir
+        self.setUp()
+        config = configparser.ConfigParser()
+        config.read('config_test.ini')
+        config['Settings']['overlay_dir'] = 'overlay_test'
+        with open('config_overlay_test.ini', 'w') as file:
+            config.write(file)
+        try:
+            vc = vcl.ShellEmulator('config_overlay_test.ini')
+            vc.current_dir = 'test_directory/'
+            sys.stdout = io.StringIO()
+            vc.handle_command('uniq -x file2.txt > out.txt')
+            vc.handle_command('nosuch > out.txt')
+            vc.handle_command('ls | cd > out.txt')
+            vc.handle_command('cat file2.txt > copy.txt')
+            sys.stdout = sys.__stdout__
+            self.assertEqual(1, len(os.listdir('overlay_test')))
+            self.assertIsNone(vc.lookup(vc.resolve_path('out.txt')))
+            vc.close()
+            self.assertEqual([], os.listdir('overlay_test'))
+        finally:
+            sys.stdout = sys.__stdout__
+            os.remove('config_overlay_test.ini')
+            for name in os.listdir('overlay_test'):
+                os.remove(os.path.join('overlay_test', name))
+            os.rmdir('overlay_test')
+
     #CAL
     def test_cal_today(self):
         self.setUp()
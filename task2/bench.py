@@ -0,0 +1,221 @@
+import os
+import sys
+import io
+import json
+import time
+import random
+import struct
+import hashlib
+import zlib
+import tempfile
+import platform
+import subprocess
+import datetime
+
+import main
+import commit_table
+import graph_output
+
+try:
+    import resource
+except ImportError:  # Windows: пиковая память не измеряется
+    resource = None
+
+EMPTY_TREE = '4b825dc642cb6eb9a060e54bf8d69288fbee4904'
+OBJ_CODES = {'commit': 1, 'tree': 2, 'blob': 3, 'tag': 4}
+
+
+def git_object(obj_type, data):
+    raw = f'{obj_type} {len(data)}'.encode() + b'\x00' + data
+    return hashlib.sha1(raw).hexdigest(), raw
+
+
+def synthetic_commits(count, merge_rate, seed=0, start=1600000000):
+    # Линейная история с вероятностью merge_rate слияния со случайным более ранним коммитом
+    rng = random.Random(seed)
+    hashes = []
+    for i in range(count):
+        parents = hashes[-1:]
+        if len(hashes) > 2 and rng.random() < merge_rate:
+            parents.append(hashes[rng.randrange(len(hashes) - 2)])
+        lines = [f'tree {EMPTY_TREE}']
+        lines += [f'parent {parent}' for parent in parents]
+        lines.append(f'author Bench <bench@example.com> {start + i * 60} +0000')
+        lines.append(f'committer Bench <bench@example.com> {start + i * 60} +0000')
+        data = ('\n'.join(lines) + f'\n\nCommit {i}\n').encode()
+        commit_hash, _ = git_object('commit', data)
+        hashes.append(commit_hash)
+        yield commit_hash, 'commit', data
+
+
+def write_loose(objects_dir, objects):
+    for object_hash, obj_type, data in objects:
+        _, raw = git_object(obj_type, data)
+        directory = os.path.join(objects_dir, object_hash[:2])
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, object_hash[2:]), 'wb') as file:
+            file.write(zlib.compress(raw))
+
+
+def write_pack(objects_dir, objects):
+    # pack v2 без дельт и индекс .idx v2 к нему
+    objects = list(objects)
+    pack_dir = os.path.join(objects_dir, 'pack')
+    os.makedirs(pack_dir, exist_ok=True)
+    entries = []
+    pack = hashlib.sha1()
+    tmp_path = os.path.join(pack_dir, 'tmp_pack')
+    with open(tmp_path, 'wb') as file:
+        header = b'PACK' + struct.pack('>LL', 2, len(objects))
+        file.write(header)
+        pack.update(header)
+        offset = len(header)
+        for object_hash, obj_type, data in objects:
+            size = len(data)
+            byte = (OBJ_CODES[obj_type] << 4) | (size & 0x0F)
+            size >>= 4
+            encoded = bytearray()
+            while size:
+                encoded.append(byte | 0x80)
+                byte = size & 0x7F
+                size >>= 7
+            encoded.append(byte)
+            record = bytes(encoded) + zlib.compress(data)
+            file.write(record)
+            pack.update(record)
+            entries.append((bytes.fromhex(object_hash), zlib.crc32(record), offset))
+            offset += len(record)
+        checksum = pack.digest()
+        file.write(checksum)
+
+    entries.sort()
+    fanout = [0] * 256
+    for sha, _, _ in entries:
+        fanout[sha[0]] += 1
+    for i in range(1, 256):
+        fanout[i] += fanout[i - 1]
+    large = [offset for _, _, offset in entries if offset >= 0x80000000]
+    offsets = []
+    for _, _, offset in entries:
+        offsets.append(0x80000000 | large.index(offset) if offset >= 0x80000000 else offset)
+    index = b''.join([
+        b'\xfftOc', struct.pack('>L', 2), struct.pack('>256L', *fanout),
+        *(sha for sha, _, _ in entries),
+        struct.pack(f'>{len(entries)}L', *(crc for _, crc, _ in entries)),
+        struct.pack(f'>{len(entries)}L', *offsets),
+        struct.pack(f'>{len(large)}Q', *large),
+        checksum,
+    ])
+    name = f'pack-{checksum.hex()}'
+    with open(os.path.join(pack_dir, name + '.idx'), 'wb') as file:
+        file.write(index + hashlib.sha1(index).digest())
+    os.replace(tmp_path, os.path.join(pack_dir, name + '.pack'))
+
+
+def make_repo(path, commits=1000, merge_rate=0.1, storage='loose', seed=0):
+    # Синтетический репозиторий: пустое дерево и история из commits коммитов на ветке main
+    git_dir = os.path.join(path, '.git')
+    objects_dir = os.path.join(git_dir, 'objects')
+    os.makedirs(os.path.join(git_dir, 'refs', 'heads'), exist_ok=True)
+    os.makedirs(objects_dir, exist_ok=True)
+    with open(os.path.join(git_dir, 'HEAD'), 'w') as file:
+        file.write('ref: refs/heads/main\n')
+
+    objects = [(EMPTY_TREE, 'tree', b'')]
+    objects.extend(synthetic_commits(commits, merge_rate, seed))
+    if storage == 'packed':
+        write_pack(objects_dir, objects)
+    else:
+        write_loose(objects_dir, objects)
+    with open(os.path.join(git_dir, 'refs', 'heads', 'main'), 'w') as file:
+        file.write(objects[-1][0] + '\n')
+    return objects[-1][0]
+
+
+def peak_rss_kib():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS возвращает байты, Linux - КиБ
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+
+def run(repo_path, jobs=1):
+    phases = {}
+
+    def timed(name, func, *args):
+        start = time.perf_counter()
+        result = func(*args)
+        phases[name] = {'seconds': time.perf_counter() - start}
+        return result
+
+    roots = timed('refs', lambda: [main.resolve_head_commit(repo_path)])
+    if jobs > 1:
+        table = timed('traversal', lambda: commit_table.CommitTable.from_commits(
+            main.iter_commits_parallel(repo_path, roots, jobs)))
+    else:
+        table = timed('traversal', lambda: commit_table.CommitTable.from_commits(
+            main.iter_commits(repo_path, roots)))
+    count = len(table.select())
+
+    # Разбор отдельно от чтения: заголовки уже прочитанных объектов
+    raw = [main.read_git_object(repo_path, commit['id'])[1] for commit in table.commits()]
+    timed('parse', list, map(main.parse_commit_header, raw))
+    del raw
+
+    cutoff = datetime.datetime.now()
+    rows = timed('filter', table.select, cutoff)
+    timed('dot', graph_output.write_dot, io.StringIO(), table.commits(rows))
+
+    for phase in phases.values():
+        phase['objects_per_second'] = count / phase['seconds'] if phase['seconds'] else None
+    return {
+        'commits': count,
+        'jobs': jobs,
+        'phases': phases,
+        'peak_rss_kib': peak_rss_kib(),
+        'python': platform.python_version(),
+        'numpy': commit_table.np is not None,
+    }
+
+
+def run_isolated(repo_path, jobs=1):
+    # Замер в отдельном процессе: в пиковую память не попадает то, что уже занял вызывающий
+    # процесс (например, объекты, собранные make_repo)
+    command = [sys.executable, os.path.abspath(__file__), '--repo', repo_path, '--jobs', str(jobs)]
+    report = json.loads(subprocess.run(command, check=True, capture_output=True, text=True).stdout)
+    del report['repo']
+    return report
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Замеры скорости построения графа коммитов на синтетическом репозитории.')
+    parser.add_argument('--repo', type=str, help='Существующий репозиторий вместо синтетического.')
+    parser.add_argument('--commits', type=int, default=10000, help='Число коммитов синтетического репозитория.')
+    parser.add_argument('--merge-rate', type=float, default=0.1, help='Доля коммитов-слияний (0..1).')
+    parser.add_argument('--storage', choices=('loose', 'packed'), default='loose', help='Способ хранения объектов.')
+    parser.add_argument('--seed', type=int, default=0, help='Начальное значение генератора случайных чисел.')
+    parser.add_argument('--jobs', type=int, default=1, help='Число потоков обхода (как --jobs в main.py).')
+    parser.add_argument('--output', type=str, help='Файл для результатов в JSON (по умолчанию - в консоль).')
+
+    args = parser.parse_args()
+    if args.repo:
+        report = run(args.repo, args.jobs)
+        report['repo'] = args.repo
+    else:
+        with tempfile.TemporaryDirectory() as directory:
+            start = time.perf_counter()
+            make_repo(directory, args.commits, args.merge_rate, args.storage, args.seed)
+            generate_seconds = time.perf_counter() - start
+            report = run_isolated(directory, args.jobs)
+        report.update({'storage': args.storage, 'merge_rate': args.merge_rate, 'seed': args.seed,
+                       'generate_seconds': generate_seconds})
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(text + '\n')
+    else:
+        print(text)
@@ -0,0 +1,89 @@
+import os
+import sqlite3
+import datetime
+
+# Кеш разобранных коммитов лежит внутри репозитория, поэтому у каждого репозитория он свой
+CACHE_PATH = os.path.join('graph-tool', 'commits.sqlite')
+
+
+class CommitCache:
+    # hash -> (время коммита, родители). Коммиты неизменяемы, поэтому записи никогда не устаревают.
+    # Таблица читается целиком одним запросом при открытии, дальше поиск идет по словарю.
+    # tips - корни законченных обходов: вся история от них уже в кеше, и обход ниже них не спускается
+    def __init__(self, path, flush_rows=1000):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.connection = sqlite3.connect(path)
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS commits (id TEXT PRIMARY KEY, timestamp INTEGER, parents TEXT NOT NULL)')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS tips (id TEXT PRIMARY KEY)')
+        self.rows = {commit_hash: (timestamp, parents) for commit_hash, timestamp, parents
+                     in self.connection.execute('SELECT id, timestamp, parents FROM commits')}
+        self.tips = {commit_hash for (commit_hash,) in self.connection.execute('SELECT id FROM tips')}
+        self.pending = []
+        self.flush_rows = flush_rows
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def for_repo(cls, repo_path):
+        return cls(os.path.join(repo_path, '.git', CACHE_PATH))
+
+    @staticmethod
+    def commit(commit_hash, row):
+        timestamp, parents = row
+        return {
+            'id': commit_hash,
+            'date': datetime.datetime.fromtimestamp(timestamp) if timestamp is not None else None,
+            'parents': parents.split() if parents else []
+        }
+
+    def get(self, commit_hash):
+        row = self.rows.get(commit_hash)
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return self.commit(commit_hash, row)
+
+    def ancestry(self, tip, visited):
+        # История от tip, еще не вошедшая в visited, в порядке обхода в глубину (как iter_commits).
+        # Коммиты без даты не выдаются, но их родители обходятся
+        stack = [tip]
+        while stack:
+            commit_hash = stack.pop()
+            if commit_hash in visited:
+                continue
+            visited.add(commit_hash)
+            row = self.rows[commit_hash]
+            self.hits += 1
+            if row[0] is not None:
+                yield self.commit(commit_hash, row)
+            if row[1]:
+                stack.extend(reversed(row[1].split()))
+
+    def put(self, commit):
+        timestamp = int(commit['date'].timestamp()) if commit['date'] else None
+        row = (timestamp, ' '.join(commit['parents']))
+        self.rows[commit['id']] = row
+        self.pending.append((commit['id'], *row))
+        if len(self.pending) >= self.flush_rows:
+            self.flush()
+
+    def add_tips(self, roots, visited):
+        # Обход от roots закончен и все его коммиты в кеше. Прежние корни, до которых он дошел,
+        # больше не нужны: их история входит в историю новых
+        self.flush()
+        self.tips = (self.tips - visited) | set(roots)
+        with self.connection:
+            self.connection.execute('DELETE FROM tips')
+            self.connection.executemany('INSERT INTO tips VALUES (?)', [(tip,) for tip in self.tips])
+
+    def flush(self):
+        if self.pending:
+            with self.connection:
+                self.connection.executemany('INSERT OR IGNORE INTO commits VALUES (?, ?, ?)', self.pending)
+            self.pending = []
+
+    def close(self):
+        self.flush()
+        self.connection.close()
@@ -0,0 +1,248 @@
+import os
+import mmap
+import struct
+import hashlib
+import datetime
+
+# Формат файла commit-graph (Documentation/gitformat-commit-graph.txt)
+GRAPH_MAGIC = b'CGPH'
+CHUNK_OIDF = b'OIDF'
+CHUNK_OIDL = b'OIDL'
+CHUNK_CDAT = b'CDAT'
+CHUNK_EDGE = b'EDGE'
+HASH_SIZE = 20
+CDAT_SIZE = HASH_SIZE + 16
+PARENT_NONE = 0x70000000
+PARENT_EXTRA = 0x80000000
+
+HEADER = struct.Struct('>4s4B')
+CHUNK = struct.Struct('>4sQ')
+CDAT = struct.Struct('>LLLL')
+
+# Собственная копия в формате commit-graph; git этот файл не читает
+LOCAL_GRAPH = os.path.join('graph-tool', 'commit-graph')
+
+
+class CommitGraphFile:
+    # Один файл commit-graph; позиции коммитов в цепочке сдвинуты на base_count
+    def __init__(self, path, base_count=0):
+        with open(path, 'rb') as file:
+            self.map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, hash_version, chunk_count, _ = HEADER.unpack_from(self.map, 0)
+        if magic != GRAPH_MAGIC or version != 1 or hash_version != 1:
+            self.map.close()
+            raise ValueError(f"Unsupported commit-graph file: {path}")
+        chunks = {}
+        for i in range(chunk_count + 1):
+            chunk_id, offset = CHUNK.unpack_from(self.map, HEADER.size + i * CHUNK.size)
+            chunks[chunk_id] = offset
+        if not all(chunk_id in chunks for chunk_id in (CHUNK_OIDF, CHUNK_OIDL, CHUNK_CDAT)):
+            self.map.close()
+            raise ValueError(f"Missing required chunks in commit-graph file: {path}")
+        self.fanout = struct.unpack_from('>256L', self.map, chunks[CHUNK_OIDF])
+        self.count = self.fanout[255]
+        self.oids = chunks[CHUNK_OIDL]
+        self.cdat = chunks[CHUNK_CDAT]
+        self.edge = chunks.get(CHUNK_EDGE)
+        self.base_count = base_count
+
+    def find(self, sha):
+        lo = self.fanout[sha[0] - 1] if sha[0] else 0
+        hi = self.fanout[sha[0]]
+        while lo < hi:
+            mid = (lo + hi) // 2
+            current = self.map[self.oids + mid * HASH_SIZE:self.oids + (mid + 1) * HASH_SIZE]
+            if current < sha:
+                lo = mid + 1
+            elif current > sha:
+                hi = mid
+            else:
+                return self.base_count + mid
+        return None
+
+    def oid(self, position):
+        start = self.oids + (position - self.base_count) * HASH_SIZE
+        return self.map[start:start + HASH_SIZE]
+
+    def entry(self, position):
+        # (родители - глобальные позиции, время коммита)
+        parent1, parent2, generation, time_low = CDAT.unpack_from(
+            self.map, self.cdat + (position - self.base_count) * CDAT_SIZE + HASH_SIZE)
+        parents = []
+        if parent1 != PARENT_NONE:
+            parents.append(parent1)
+        if parent2 & PARENT_EXTRA:
+            # Родителей больше двух: остальные в списке EDGE, последний помечен старшим битом
+            index = parent2 & ~PARENT_EXTRA
+            while True:
+                value = struct.unpack_from('>L', self.map, self.edge + index * 4)[0]
+                parents.append(value & ~PARENT_EXTRA)
+                if value & PARENT_EXTRA:
+                    break
+                index += 1
+        elif parent2 != PARENT_NONE:
+            parents.append(parent2)
+        return parents, ((generation & 0x3) << 32) | time_low
+
+    def close(self):
+        self.map.close()
+
+
+class CommitGraph:
+    # Цепочка файлов commit-graph (один файл или split-цепочка от базового к новым)
+    def __init__(self, files, stamp=None):
+        self.files = files
+        self.stamp = stamp
+        self.positions = {}  # hex -> позиция для уже встреченных родителей
+
+    def locate(self, position):
+        for graph_file in reversed(self.files):
+            if position >= graph_file.base_count:
+                return graph_file
+        raise IndexError(position)
+
+    def find(self, commit_hash):
+        position = self.positions.pop(commit_hash, None)
+        if position is not None:
+            return position
+        try:
+            sha = bytes.fromhex(commit_hash)
+        except ValueError:
+            return None
+        if len(sha) != HASH_SIZE:
+            return None
+        for graph_file in self.files:
+            position = graph_file.find(sha)
+            if position is not None:
+                return position
+        return None
+
+    def commit(self, commit_hash):
+        # Коммит в том же виде, что и read_commit, но без чтения и распаковки объекта
+        position = self.find(commit_hash)
+        if position is None:
+            return None
+        parent_positions, timestamp = self.locate(position).entry(position)
+        parents = []
+        for parent in parent_positions:
+            parent_hash = self.locate(parent).oid(parent).hex()
+            self.positions[parent_hash] = parent
+            parents.append(parent_hash)
+        return {
+            'id': commit_hash,
+            'date': datetime.datetime.fromtimestamp(timestamp),
+            'parents': parents
+        }
+
+    def close(self):
+        for graph_file in self.files:
+            graph_file.close()
+
+
+def graph_paths(repo_path):
+    # Файлы git (один файл или split-цепочка) либо собственная копия инструмента
+    info_dir = os.path.join(repo_path, '.git', 'objects', 'info')
+    chain_path = os.path.join(info_dir, 'commit-graphs', 'commit-graph-chain')
+    if os.path.exists(chain_path):
+        with open(chain_path, 'r') as file:
+            hashes = [line.strip() for line in file if line.strip()]
+        return chain_path, [os.path.join(info_dir, 'commit-graphs', f'graph-{h}.graph') for h in hashes]
+    for path in (os.path.join(info_dir, 'commit-graph'), os.path.join(repo_path, '.git', LOCAL_GRAPH)):
+        if os.path.exists(path):
+            return path, [path]
+    return None, []
+
+
+_graphs = {}
+
+
+def load_commit_graph(repo_path):
+    # Граф открывается один раз на репозиторий и открывается заново, если файл изменился
+    path, paths = graph_paths(repo_path)
+    stamp = os.stat(path).st_mtime_ns if path else None
+    graph = _graphs.get(repo_path)
+    if graph is not None and graph.stamp == stamp:
+        return graph
+    if graph is not None:
+        graph.close()
+        del _graphs[repo_path]
+    if not paths:
+        return None
+    files = []
+    try:
+        for graph_path in paths:
+            files.append(CommitGraphFile(graph_path, sum(f.count for f in files)))
+    except (OSError, ValueError, struct.error):
+        for graph_file in files:
+            graph_file.close()
+        return None
+    graph = _graphs[repo_path] = CommitGraph(files, stamp)
+    return graph
+
+
+def write_commit_graph(path, commits):
+    # Пишет файл в формате commit-graph v1 по списку коммитов (id, date, parents).
+    # Все родители должны входить в список. Деревья инструменту не нужны и записываются нулями
+    ordered = sorted(commits, key=lambda commit: commit['id'])
+    position = {commit['id']: i for i, commit in enumerate(ordered)}
+    by_id = {commit['id']: commit for commit in ordered}
+    if any(parent not in position for commit in ordered for parent in commit['parents']):
+        raise ValueError("Commit list is not closed under parents")
+
+    # Номер поколения: 1 + максимум по родителям, считается без рекурсии
+    generation = {}
+    for commit in ordered:
+        stack = [commit['id']]
+        while stack:
+            current = stack[-1]
+            if current in generation:
+                stack.pop()
+                continue
+            pending = [parent for parent in by_id[current]['parents'] if parent not in generation]
+            if pending:
+                stack.extend(pending)
+                continue
+            generation[current] = 1 + max((generation[p] for p in by_id[current]['parents']), default=0)
+            stack.pop()
+
+    fanout = [0] * 256
+    for commit in ordered:
+        fanout[int(commit['id'][:2], 16)] += 1
+    for i in range(1, 256):
+        fanout[i] += fanout[i - 1]
+
+    oids = b''.join(bytes.fromhex(commit['id']) for commit in ordered)
+    cdat = bytearray()
+    edges = []
+    for commit in ordered:
+        parents = [position[parent] for parent in commit['parents']]
+        parent1 = parents[0] if parents else PARENT_NONE
+        if len(parents) > 2:
+            parent2 = PARENT_EXTRA | len(edges)
+            edges.extend(parents[1:-1])
+            edges.append(parents[-1] | PARENT_EXTRA)
+        else:
+            parent2 = parents[1] if len(parents) == 2 else PARENT_NONE
+        timestamp = max(0, int(commit['date'].timestamp())) & 0x3FFFFFFFF
+        gen = min(generation[commit['id']], 0x3FFFFFFF)
+        cdat += bytes(HASH_SIZE)
+        cdat += CDAT.pack(parent1, parent2, (gen << 2) | (timestamp >> 32), timestamp & 0xFFFFFFFF)
+
+    chunks = [(CHUNK_OIDF, struct.pack('>256L', *fanout)), (CHUNK_OIDL, oids), (CHUNK_CDAT, bytes(cdat))]
+    if edges:
+        chunks.append((CHUNK_EDGE, struct.pack(f'>{len(edges)}L', *edges)))
+
+    offset = HEADER.size + (len(chunks) + 1) * CHUNK.size
+    table = []
+    for chunk_id, data in chunks:
+        table.append(CHUNK.pack(chunk_id, offset))
+        offset += len(data)
+    table.append(CHUNK.pack(b'\0\0\0\0', offset))
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + '.tmp'
+    content = b''.join([HEADER.pack(GRAPH_MAGIC, 1, 1, len(chunks), 0), *table, *(data for _, data in chunks)])
+    with open(tmp_path, 'wb') as file:
+        file.write(content)
+        file.write(hashlib.sha1(content).digest())
+    os.replace(tmp_path, path)
@@ -0,0 +1,102 @@
+import datetime
+from array import array
+
+try:
+    import numpy as np
+except ImportError:  # NumPy необязателен: без него фильтр и сортировка идут на чистом Python
+    np = None
+
+HASH_SIZE = 20
+# Время строки-заглушки: родитель, сам коммит которого не прочитан (например, отсечен по --since)
+MISSING = -(1 << 63)
+
+
+class CommitTable:
+    # Колоночное хранение коммитов: hash по 20 байт в одном bytearray, время коммита в array('q'),
+    # родители - в формате CSR: родители строки i - targets[offsets[i]:offsets[i + 1]].
+    # Строка выдается при первом упоминании коммита (родитель - раньше, чем до него дойдет обход),
+    # поэтому порядок обхода хранится отдельно в positions: по нему упорядочены коммиты с равным временем.
+    # Около 60 байт на коммит вместо словаря, строки hash, datetime и списка родителей
+    def __init__(self):
+        self.oids = bytearray()
+        self.timestamps = array('q')
+        self.positions = array('q')
+        self.offsets = array('q', [0])
+        self.targets = array('q')
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    @classmethod
+    def from_commits(cls, commits):
+        # commits - итератор словарей (id, date, parents); словари не сохраняются
+        table = cls()
+        rows = {}  # hex -> строка, нужен только на время построения
+        children = array('q')
+        parents = array('q')
+
+        def row(commit_hash):
+            index = rows.get(commit_hash)
+            if index is None:
+                index = rows[commit_hash] = len(table.timestamps)
+                table.oids += bytes.fromhex(commit_hash)
+                table.timestamps.append(MISSING)
+                table.positions.append(MISSING)
+            return index
+
+        for position, commit in enumerate(commits):
+            index = row(commit['id'])
+            table.timestamps[index] = int(commit['date'].timestamp())
+            table.positions[index] = position
+            for parent_hash in commit['parents']:
+                children.append(index)
+                parents.append(row(parent_hash))
+        table.build_edges(children, parents)
+        return table
+
+    def build_edges(self, children, parents):
+        # Ребра в порядке появления раскладываются по строкам сортировкой подсчетом
+        counts = array('q', bytes(8 * (len(self.timestamps) + 1)))
+        for child in children:
+            counts[child + 1] += 1
+        for i in range(1, len(counts)):
+            counts[i] += counts[i - 1]
+        self.offsets = array('q', counts)
+        self.targets = array('q', bytes(8 * len(parents)))
+        fill = counts  # позиции для записи, сдвигаются по мере заполнения
+        for child, parent in zip(children, parents):
+            self.targets[fill[child]] = parent
+            fill[child] += 1
+
+    def oid(self, index):
+        return self.oids[index * HASH_SIZE:(index + 1) * HASH_SIZE].hex()
+
+    def parents(self, index):
+        return self.targets[self.offsets[index]:self.offsets[index + 1]]
+
+    def select(self, cutoff=None):
+        # Строки прочитанных коммитов не новее cutoff (datetime), отсортированные по дате,
+        # а при равном времени - в порядке обхода
+        limit = int(cutoff.timestamp()) if cutoff is not None else (1 << 63) - 1
+        if np is not None:
+            timestamps = np.frombuffer(self.timestamps, dtype=np.int64)
+            rows = np.flatnonzero((timestamps != MISSING) & (timestamps <= limit))
+            positions = np.frombuffer(self.positions, dtype=np.int64)
+            return rows[np.lexsort((positions[rows], timestamps[rows]))].tolist()
+        timestamps = self.timestamps
+        rows = [i for i, timestamp in enumerate(timestamps) if timestamp != MISSING and timestamp <= limit]
+        rows.sort(key=self.positions.__getitem__)
+        rows.sort(key=timestamps.__getitem__)
+        return rows
+
+    def commits(self, rows=None):
+        # Словари создаются лениво, по одному на строку, для вывода и сокращения графа
+        if rows is None:
+            rows = [i for i, timestamp in enumerate(self.timestamps) if timestamp != MISSING]
+            rows.sort(key=self.positions.__getitem__)
+        for index in rows:
+            yield {
+                'id': self.oid(index),
+                'date': datetime.datetime.fromtimestamp(self.timestamps[index]),
+                'parents': [self.oid(parent) for parent in self.parents(index)]
+            }
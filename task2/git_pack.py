@@ -0,0 +1,301 @@
+import os
+import mmap
+import glob
+import struct
+import zlib
+import threading
+from collections import OrderedDict
+
+# Формат pack-файлов и индексов версии 2 (Documentation/gitformat-pack.txt)
+IDX_MAGIC = b'\xfftOc'
+PACK_MAGIC = b'PACK'
+OBJ_TYPES = {1: 'commit', 2: 'tree', 3: 'blob', 4: 'tag'}
+OFS_DELTA = 6
+REF_DELTA = 7
+
+
+class PackIndex:
+    # Индекс .idx v2: таблица fanout сужает бинарный поиск до объектов с тем же первым байтом
+    def __init__(self, path):
+        with open(path, 'rb') as file:
+            self.map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.map[:4] != IDX_MAGIC or struct.unpack_from('>L', self.map, 4)[0] != 2:
+            self.map.close()
+            raise ValueError(f"Unsupported pack index: {path}")
+        self.fanout = struct.unpack_from('>256L', self.map, 8)
+        self.count = self.fanout[255]
+        self.names_offset = 8 + 256 * 4
+        self.offsets_offset = self.names_offset + self.count * 24  # имена (20) + CRC32 (4)
+        self.large_offset = self.offsets_offset + self.count * 4
+
+    def find(self, sha):
+        # sha - 20 байт; возвращает смещение объекта в pack-файле или None
+        lo = self.fanout[sha[0] - 1] if sha[0] else 0
+        hi = self.fanout[sha[0]]
+        names = self.names_offset
+        while lo < hi:
+            mid = (lo + hi) // 2
+            current = self.map[names + mid * 20:names + mid * 20 + 20]
+            if current < sha:
+                lo = mid + 1
+            elif current > sha:
+                hi = mid
+            else:
+                return self.offset(mid)
+        return None
+
+    def offset(self, position):
+        offset = struct.unpack_from('>L', self.map, self.offsets_offset + position * 4)[0]
+        if offset & 0x80000000:
+            # Смещения больше 2 ГиБ хранятся в отдельной 64-битной таблице
+            offset = struct.unpack_from('>Q', self.map, self.large_offset + (offset & 0x7FFFFFFF) * 8)[0]
+        return offset
+
+    def close(self):
+        self.map.close()
+
+
+def apply_delta(base, delta):
+    def varint(pos):
+        value = shift = 0
+        while True:
+            byte = delta[pos]
+            pos += 1
+            value |= (byte & 0x7F) << shift
+            shift += 7
+            if not byte & 0x80:
+                return value, pos
+
+    base_size, pos = varint(0)
+    result_size, pos = varint(pos)
+    if base_size != len(base):
+        raise ValueError("Delta base size mismatch")
+    result = bytearray()
+    end = len(delta)
+    while pos < end:
+        opcode = delta[pos]
+        pos += 1
+        if opcode & 0x80:
+            # Копирование куска базы: смещение и длина заданы выборочными байтами
+            offset = size = 0
+            for i in range(4):
+                if opcode & (1 << i):
+                    offset |= delta[pos] << (8 * i)
+                    pos += 1
+            for i in range(3):
+                if opcode & (0x10 << i):
+                    size |= delta[pos] << (8 * i)
+                    pos += 1
+            result += base[offset:offset + (size or 0x10000)]
+        elif opcode:
+            # Вставка opcode байт из самой дельты
+            result += delta[pos:pos + opcode]
+            pos += opcode
+        else:
+            raise ValueError("Invalid delta opcode")
+    if len(result) != result_size:
+        raise ValueError("Delta result size mismatch")
+    return bytes(result)
+
+
+class Pack:
+    # pack-файл отображается в память; восстановленные базы дельт хранятся в LRU-кеше по смещению
+    def __init__(self, pack_path, index, store, cache_bytes=32 * 1024 * 1024):
+        with open(pack_path, 'rb') as file:
+            self.map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.map[:4] != PACK_MAGIC:
+            self.map.close()
+            raise ValueError(f"Not a pack file: {pack_path}")
+        self.path = pack_path
+        self.index = index
+        self.store = store
+        self.cache = OrderedDict()
+        self.cache_bytes = cache_bytes
+        self.cache_used = 0
+        self.lock = threading.Lock()  # Кеш баз общий для потоков; чтение mmap блокировок не требует
+
+    def header(self, offset):
+        byte = self.map[offset]
+        obj_type = (byte >> 4) & 7
+        size = byte & 0x0F
+        shift = 4
+        offset += 1
+        while byte & 0x80:
+            byte = self.map[offset]
+            offset += 1
+            size |= (byte & 0x7F) << shift
+            shift += 7
+        return obj_type, size, offset
+
+    def inflate(self, offset, size):
+        # Сжатые данные читаются кусками: длина потока заранее неизвестна
+        decompressor = zlib.decompressobj()
+        parts = []
+        chunk = max(4096, size + 64)
+        while not decompressor.eof:
+            data = self.map[offset:offset + chunk]
+            if not data:
+                raise ValueError("Truncated pack object")
+            offset += len(data)
+            parts.append(decompressor.decompress(data))
+            chunk *= 2
+        return b''.join(parts)
+
+    def cached(self, offset):
+        with self.lock:
+            entry = self.cache.get(offset)
+            if entry is not None:
+                self.cache.move_to_end(offset)
+            return entry
+
+    def remember(self, offset, entry):
+        size = len(entry[1])
+        with self.lock:
+            if offset in self.cache or size > self.cache_bytes // 4:
+                return
+            self.cache[offset] = entry
+            self.cache_used += size
+            while self.cache_used > self.cache_bytes:
+                _, (_, evicted) = self.cache.popitem(last=False)
+                self.cache_used -= len(evicted)
+
+    def read(self, offset):
+        # Цепочка дельт разворачивается без рекурсии: сначала спуск до полного объекта
+        # (или закешированной базы), затем дельты применяются в обратном порядке
+        chain = []
+        base_offset = offset  # Где лежит база цепочки; None - вне этого pack-файла
+        while True:
+            entry = self.cached(offset)
+            if entry is not None:
+                base_offset = None
+                break
+            obj_type, size, data_offset = self.header(offset)
+            if obj_type == OFS_DELTA:
+                byte = self.map[data_offset]
+                data_offset += 1
+                distance = byte & 0x7F
+                while byte & 0x80:
+                    byte = self.map[data_offset]
+                    data_offset += 1
+                    distance = ((distance + 1) << 7) | (byte & 0x7F)
+                chain.append((offset, data_offset, size))
+                offset -= distance
+            elif obj_type == REF_DELTA:
+                base_sha = self.map[data_offset:data_offset + 20]
+                chain.append((offset, data_offset + 20, size))
+                offset = self.index.find(base_sha)
+                if offset is None:
+                    # База в другом pack-файле или среди loose-объектов
+                    entry = self.store.read_raw(base_sha)
+                    if entry[0] is None:
+                        raise ValueError(f"Missing delta base {base_sha.hex()}")
+                    base_offset = None
+                    break
+            elif obj_type in OBJ_TYPES:
+                entry = (OBJ_TYPES[obj_type], self.inflate(data_offset, size))
+                base_offset = offset
+                break
+            else:
+                raise ValueError(f"Invalid object type {obj_type} at offset {offset}")
+
+        # В кеш попадают только базы: сам запрошенный объект обычно нужен один раз
+        obj_type, data = entry
+        if chain and base_offset is not None:
+            self.remember(base_offset, entry)
+        for position, (delta_offset, data_offset, size) in enumerate(reversed(chain), 1):
+            data = apply_delta(data, self.inflate(data_offset, size))
+            if position < len(chain):
+                self.remember(delta_offset, (obj_type, data))
+        return obj_type, data
+
+    def close(self):
+        self.map.close()
+        self.index.close()
+
+
+class PackStore:
+    # Все pack-файлы репозитория. Список файлов читается заново, когда объекта не нашлось,
+    # а каталог pack изменился (git gc, fetch)
+    def __init__(self, objects_dir):
+        self.objects_dir = objects_dir
+        self.pack_dir = os.path.join(objects_dir, 'pack')
+        self.packs = []
+        self.stamp = None
+        self.lock = threading.Lock()
+
+    def refresh(self):
+        try:
+            stamp = os.stat(self.pack_dir).st_mtime_ns
+        except FileNotFoundError:
+            stamp = None
+        if stamp == self.stamp:
+            return
+        with self.lock:
+            if stamp == self.stamp:
+                return
+            # Оставшиеся на месте pack-файлы переиспользуются вместе с кешем баз. Исчезнувшие
+            # не закрываются: их могут читать другие потоки (--jobs), mmap освободится,
+            # когда последний из них отпустит ссылку на прежний список
+            opened = {pack.path: pack for pack in self.packs}
+            packs = []
+            for idx_path in sorted(glob.glob(os.path.join(self.pack_dir, 'pack-*.idx'))):
+                pack_path = idx_path[:-4] + '.pack'
+                if pack_path in opened:
+                    packs.append(opened[pack_path])
+                elif os.path.exists(pack_path):
+                    packs.append(Pack(pack_path, PackIndex(idx_path), self))
+            self.packs = packs
+            self.stamp = stamp
+
+    def read_raw(self, sha):
+        entry = self.find(self.packs, sha)
+        if entry is not None:
+            return entry
+        # База REF_DELTA может лежать и среди loose-объектов
+        path = os.path.join(self.objects_dir, sha.hex()[:2], sha.hex()[2:])
+        try:
+            with open(path, 'rb') as file:
+                header, data = zlib.decompress(file.read()).split(b'\x00', 1)
+            return header.split(b' ')[0].decode('utf-8'), data
+        except FileNotFoundError:
+            return None, None
+
+    def read(self, object_hash):
+        try:
+            sha = bytes.fromhex(object_hash)
+        except ValueError:
+            return None, None
+        if len(sha) != 20:
+            return None, None
+        packs = self.packs
+        entry = self.find(packs, sha)
+        if entry is None:
+            self.refresh()
+            if self.packs is not packs:
+                entry = self.find(self.packs, sha)
+        return entry or (None, None)
+
+    @staticmethod
+    def find(packs, sha):
+        for pack in packs:
+            offset = pack.index.find(sha)
+            if offset is not None:
+                return pack.read(offset)
+        return None
+
+    def close(self):
+        for pack in self.packs:
+            pack.close()
+        self.packs = []
+
+
+_stores = {}
+
+
+def read_packed_object(repo_path, object_hash):
+    # Хранилище открывается один раз на репозиторий и переиспользуется между вызовами
+    objects_dir = os.path.join(repo_path, '.git', 'objects')
+    store = _stores.get(objects_dir)
+    if store is None:
+        store = _stores.setdefault(objects_dir, PackStore(objects_dir))
+    return store.read(object_hash)
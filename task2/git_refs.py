@@ -0,0 +1,82 @@
+import os
+
+# Группы ссылок, которые можно выбрать корнями графа
+REF_KINDS = {
+    'heads': 'refs/heads/',
+    'tags': 'refs/tags/',
+    'remotes': 'refs/remotes/',
+}
+
+
+def read_packed_refs(git_dir):
+    # packed-refs разбирается за один проход: имя -> hash и имя -> hash коммита для
+    # аннотированных тегов (строка '^<hash>' после тега)
+    refs = {}
+    peeled = {}
+    try:
+        with open(os.path.join(git_dir, 'packed-refs'), 'r') as file:
+            last = None
+            for line in file:
+                line = line.strip()
+                if not line or line.startswith('#'):
+                    continue
+                if line.startswith('^'):
+                    if last is not None:
+                        peeled[last] = line[1:]
+                    continue
+                object_hash, name = line.split(' ', 1)
+                refs[name] = object_hash
+                last = name
+    except FileNotFoundError:
+        pass
+    return refs, peeled
+
+
+class RefDatabase:
+    # Все ссылки репозитория: packed-refs читается один раз, loose-ссылки в refs/ его перекрывают
+    def __init__(self, repo_path):
+        self.git_dir = os.path.join(repo_path, '.git')
+        self.refs, self.peeled = read_packed_refs(self.git_dir)
+        refs_dir = os.path.join(self.git_dir, 'refs')
+        for directory, _, files in os.walk(refs_dir):
+            for name in files:
+                path = os.path.join(directory, name)
+                ref_name = os.path.relpath(path, self.git_dir).replace(os.sep, '/')
+                try:
+                    with open(path, 'r') as file:
+                        value = file.readline().strip()
+                except OSError:
+                    continue
+                if value:
+                    self.refs[ref_name] = value
+                    # Loose-ссылка новее упакованной, ее peeled-значение устарело
+                    self.peeled.pop(ref_name, None)
+
+    def resolve(self, name, depth=10):
+        # Символические ссылки ('ref: refs/heads/main') разворачиваются до hash
+        for _ in range(depth):
+            if name == 'HEAD':
+                try:
+                    with open(os.path.join(self.git_dir, 'HEAD'), 'r') as file:
+                        value = file.readline().strip()
+                except FileNotFoundError:
+                    return None
+            else:
+                value = self.refs.get(name)
+            if value is None:
+                return None
+            if not value.startswith('ref:'):
+                return value
+            name = value.split(None, 1)[1]
+        return None
+
+    def select(self, kinds):
+        # Имена и hash ссылок выбранных групп в порядке имен
+        prefixes = tuple(REF_KINDS[kind] for kind in kinds)
+        result = []
+        for name in sorted(self.refs):
+            if name.startswith(prefixes):
+                object_hash = self.resolve(name)
+                if object_hash is not None:
+                    result.append((name, object_hash))
+        return result
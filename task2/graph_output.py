@@ -0,0 +1,64 @@
+import json
+from xml.sax.saxutils import quoteattr
+
+# Потоковая запись графа: строки пишутся в файл по мере перебора коммитов,
+# без построения объекта graphviz.Digraph и общей строки с исходником
+
+
+def write_dot(file, commits):
+    file.write('// Dependency Graph\ndigraph {\n\trankdir=BT\n')
+    count = 0
+    for commit in commits:
+        commit_id = commit['id']
+        file.write(f'\t"{commit_id}" [label="{commit_id}"]\n')
+        for parent, skipped in zip(commit['parents'], commit.get('skipped') or [0] * len(commit['parents'])):
+            # После сокращения графа на ребре подписано число пропущенных коммитов
+            label = f' [label="{skipped}"]' if skipped else ''
+            file.write(f'\t"{parent}" -> "{commit_id}"{label}\n')
+        count += 1
+    file.write('}\n')
+    return count
+
+
+def write_jsonl(file, commits):
+    count = 0
+    for commit in commits:
+        date = commit['date'].isoformat() if commit['date'] else None
+        record = {'id': commit['id'], 'date': date, 'parents': commit['parents']}
+        if 'skipped' in commit:
+            record['skipped'] = commit['skipped']
+        file.write(json.dumps(record) + '\n')
+        count += 1
+    return count
+
+
+def write_graphml(file, commits):
+    # Ребра пишутся после всех узлов и только к записанным родителям:
+    # родитель мог не попасть в выборку (например, отсечен по --since)
+    file.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+               '<graphml xmlns="http://graphml.graphdrawing.org/xmlns">\n'
+               '  <key id="date" for="node" attr.name="date" attr.type="string"/>\n'
+               '  <key id="skipped" for="edge" attr.name="skipped" attr.type="int"/>\n'
+               '  <graph id="commits" edgedefault="directed">\n')
+    written = set()
+    edges = []
+    for commit in commits:
+        commit_id = commit['id']
+        date = commit['date'].isoformat() if commit['date'] else ''
+        file.write(f'    <node id={quoteattr(commit_id)}><data key="date">{date}</data></node>\n')
+        written.add(commit_id)
+        skipped = commit.get('skipped') or [0] * len(commit['parents'])
+        edges.extend((parent, commit_id, count) for parent, count in zip(commit['parents'], skipped))
+    for parent, child, skipped in edges:
+        if parent in written:
+            data = f'<data key="skipped">{skipped}</data>' if skipped else ''
+            file.write(f'    <edge source={quoteattr(parent)} target={quoteattr(child)}>{data}</edge>\n')
+    file.write('  </graph>\n</graphml>\n')
+    return len(written)
+
+
+WRITERS = {
+    'dot': write_dot,
+    'jsonl': write_jsonl,
+    'graphml': write_graphml,
+}
@@ -0,0 +1,90 @@
+# Сокращение графа перед выводом. Каждая функция получает список коммитов (id, date, parents)
+# и возвращает новый список, исходные словари не меняются. Пропущенные промежуточные коммиты
+# записываются в 'skipped' - список той же длины, что и parents
+
+
+def index_commits(commits):
+    by_id = {commit['id']: commit for commit in commits}
+    children = dict.fromkeys(by_id, 0)
+    for commit in commits:
+        for parent in commit['parents']:
+            if parent in children:
+                children[parent] += 1
+    return by_id, children
+
+
+def contract(commits, keep):
+    # Оставляет коммиты из keep; ребро идет к ближайшему оставленному предку
+    # через цепочку удаленных коммитов, у каждого из которых не больше одного родителя
+    by_id, _ = index_commits(commits)
+    result = []
+    for commit in commits:
+        if commit['id'] not in keep:
+            continue
+        parents, skipped = [], []
+        for index, parent in enumerate(commit['parents']):
+            count = commit['skipped'][index] if 'skipped' in commit else 0
+            while parent in by_id and parent not in keep:
+                removed = by_id[parent]
+                count += 1 + (removed['skipped'][0] if removed.get('skipped') else 0)
+                parent = removed['parents'][0] if removed['parents'] else None
+            if parent is not None:
+                parents.append(parent)
+                skipped.append(count)
+        result.append({**commit, 'parents': parents, 'skipped': skipped})
+    return result
+
+
+def collapse_chains(commits):
+    # Линейные участки (один родитель и один потомок) сворачиваются в одно ребро с числом коммитов
+    _, children = index_commits(commits)
+    keep = {commit['id'] for commit in commits if len(commit['parents']) != 1 or children[commit['id']] != 1}
+    return contract(commits, keep)
+
+
+def branch_points(commits):
+    # Остаются только слияния (несколько родителей) и развилки (несколько потомков)
+    _, children = index_commits(commits)
+    keep = {commit['id'] for commit in commits if len(commit['parents']) > 1 or children[commit['id']] > 1}
+    return contract(commits, keep)
+
+
+def transitive_reduction(commits):
+    # Удаляет родителя слияния, если он достижим через другого родителя (например, слияние
+    # с --no-ff ветки, уже содержащей основную). Поиск ограничен выборкой (окном дат)
+    # и не спускается к коммитам старше искомого: предки не бывают новее потомков
+    by_id, _ = index_commits(commits)
+
+    def reachable(start, target):
+        target_date = by_id[target]['date']
+        stack = [start]
+        seen = {start}
+        while stack:
+            current = stack.pop()
+            if current == target:
+                return True
+            for parent in by_id[current]['parents']:
+                if parent in by_id and parent not in seen and by_id[parent]['date'] >= target_date:
+                    seen.add(parent)
+                    stack.append(parent)
+        return False
+
+    result = []
+    for commit in commits:
+        parents = commit['parents']
+        if len(parents) > 1:
+            kept = [parent for parent in parents
+                    if parent not in by_id
+                    or not any(other in by_id and reachable(other, parent) for other in parents if other != parent)]
+            if len(kept) != len(parents):
+                commit = {**commit, 'parents': kept}
+                if 'skipped' in commit:
+                    commit['skipped'] = [commit['skipped'][parents.index(parent)] for parent in kept]
+        result.append(commit)
+    return result
+
+
+COLLAPSE_MODES = {
+    'chains': collapse_chains,
+    'branches': branch_points,
+}
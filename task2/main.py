@@ -1,8 +1,21 @@
 import os
+import sys
 import zlib
+import heapq
 import datetime
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+import graphviz
 from graphviz import Digraph
 
+import git_pack
+import commit_graph
+import commit_cache
+import git_refs
+import graph_output
+import graph_reduce
+import commit_table
+
 
 def read_git_object(repo_path, object_hash):
     object_path = os.path.join(repo_path, '.git', 'objects', object_hash[:2], object_hash[2:])
@@ -14,49 +27,210 @@ def read_git_object(repo_path, object_hash):
             obj_type = header.split(b' ')[0].decode('utf-8')
             return obj_type, data
     except FileNotFoundError:
-        return None, None
+        # Объекта нет среди loose - ищем в pack-файлах
+        return git_pack.read_packed_object(repo_path, object_hash)
 
 
-def parse_commit(repo_path, commit_hash, commits, visited=None):
-    if visited is None:
-        visited = set()
+def parse_commit_header(data):
+    # Разбор заголовка коммита на уровне байтов: до первой пустой строки, сообщение
+    # не декодируется (и может быть в любой кодировке). Возвращает (родители, время коммита)
+    parents = []
+    timestamp = None
+    end = data.find(b'\n\n')
+    if end < 0:
+        end = len(data)
+    pos = 0
+    while pos < end:
+        line_end = data.find(b'\n', pos, end)
+        if line_end < 0:
+            line_end = end
+        if data.startswith(b'parent ', pos):
+            parents.append(data[pos + 7:line_end].decode('ascii'))
+        elif data.startswith(b'committer ', pos):
+            # committer Имя <почта> 1700000000 +0000: время - предпоследнее поле
+            tz_start = data.rfind(b' ', pos, line_end)
+            timestamp = int(data[data.rfind(b' ', pos, tz_start) + 1:tz_start])
+        pos = line_end + 1
+    return parents, timestamp
 
-    if commit_hash in visited:
-        return
 
-    visited.add(commit_hash)
+def read_commit(repo_path, commit_hash, graph=None, cache=None):
+    if graph is not None:
+        # Родители и дата из файла commit-graph, без распаковки объекта
+        commit = graph.commit(commit_hash)
+        if commit is not None:
+            return commit
+    if cache is not None:
+        commit = cache.get(commit_hash)
+        if commit is not None:
+            return commit
 
     obj_type, commit_data = read_git_object(repo_path, commit_hash)
     if obj_type != 'commit':
+        return None
+
+    parents, timestamp = parse_commit_header(commit_data)
+    date = datetime.datetime.fromtimestamp(timestamp) if timestamp is not None else None
+
+    commit = {
+        'id': commit_hash,
+        'date': date,
+        'parents': parents
+    }
+    if cache is not None:
+        cache.put(commit)
+    return commit
+
+
+def iter_commits(repo_path, roots, visited=None, order='topo', since=None, cache=None):
+    # Обход истории без рекурсии. topo - в глубину, коммит раньше своих родителей (как прежний
+    # рекурсивный обход), date - от новых к старым через кучу по дате коммита.
+    # since - нижняя граница даты: более старые коммиты и их предки не читаются.
+    # cache - CommitCache: разобранные ранее коммиты берутся из него, новые добавляются.
+    # Законченный обход без since и commit-graph запоминает корни в кеше (все его коммиты там есть)
+    if visited is None:
+        visited = set()
+    graph = commit_graph.load_commit_graph(repo_path)
+    complete = cache is not None and since is None and graph is None and not visited
+
+    if order == 'date':
+        heap = []
+        sequence = 0
+
+        def push(commit_hash):
+            nonlocal sequence, complete
+            if commit_hash in visited:
+                return
+            visited.add(commit_hash)
+            commit = read_commit(repo_path, commit_hash, graph, cache)
+            if commit is not None:
+                key = -commit['date'].timestamp() if commit['date'] else 0
+                heapq.heappush(heap, (key, sequence, commit))
+                sequence += 1
+            else:
+                complete = False
+
+        for root in roots:
+            push(root)
+        while heap:
+            _, _, commit = heapq.heappop(heap)
+            if since is not None and commit['date'] and commit['date'] < since:
+                # Все оставшиеся в куче коммиты еще старше
+                break
+            if commit['date']:
+                yield commit
+            for parent_hash in commit['parents']:
+                push(parent_hash)
+        if complete:
+            cache.add_tips(roots, visited)
         return
 
-    lines = commit_data.decode('utf-8').splitlines()
-    parents = []
-    date = None
+    # Ниже корня прежнего законченного обхода история берется из кеша целиком, без read_commit
+    tips = cache.tips if cache is not None and since is None else ()
+    stack = list(reversed(roots))
+    while stack:
+        commit_hash = stack.pop()
+        if commit_hash in visited:
+            continue
+        if commit_hash in tips:
+            yield from cache.ancestry(commit_hash, visited)
+            continue
+        visited.add(commit_hash)
+        commit = read_commit(repo_path, commit_hash, graph, cache)
+        if commit is None:
+            complete = False
+            continue
+        if since is not None and commit['date'] and commit['date'] < since:
+            continue
+        if commit['date']:
+            yield commit
+        # Родители кладутся в обратном порядке, чтобы первый родитель обрабатывался первым
+        stack.extend(reversed(commit['parents']))
+    if complete:
+        cache.add_tips(roots, visited)
+
 
-    for line in lines:
-        if line.startswith('parent '):
-            parents.append(line.split(' ')[1])
-        elif line.startswith('committer '):
-            timestamp = int(line.split()[-2])
-            date = datetime.datetime.fromtimestamp(timestamp)
+def iter_commits_parallel(repo_path, roots, jobs, visited=None, since=None, cache=None):
+    # Обход в ширину по слоям: объекты всех коммитов слоя читаются и распаковываются
+    # в пуле потоков (zlib отпускает GIL), затем из их родителей собирается следующий слой.
+    # commit-graph и кеш опрашиваются в текущем потоке, в пул уходят только чтения объектов
+    if visited is None:
+        visited = set()
+    graph = commit_graph.load_commit_graph(repo_path)
+    complete = cache is not None and since is None and graph is None and not visited
+    frontier = [commit_hash for commit_hash in dict.fromkeys(roots) if commit_hash not in visited]
+    visited.update(frontier)
+
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        while frontier:
+            layer = {}
+            for commit_hash in frontier:
+                commit = graph.commit(commit_hash) if graph is not None else None
+                if commit is None and cache is not None:
+                    commit = cache.get(commit_hash)
+                layer[commit_hash] = commit
+            missing = [commit_hash for commit_hash, commit in layer.items() if commit is None]
+            for commit_hash, commit in zip(missing, pool.map(partial(read_commit, repo_path), missing)):
+                layer[commit_hash] = commit
+                if commit is not None and cache is not None:
+                    cache.put(commit)
+
+            frontier = []
+            for commit in layer.values():
+                if commit is None:
+                    complete = False
+                    continue
+                if since is not None and commit['date'] and commit['date'] < since:
+                    continue
+                if commit['date']:
+                    yield commit
+                for parent_hash in commit['parents']:
+                    if parent_hash not in visited:
+                        visited.add(parent_hash)
+                        frontier.append(parent_hash)
+    if complete:
+        cache.add_tips(roots, visited)
+
+
+def parse_commit(repo_path, commit_hash, commits, visited=None):
+    commits.extend(iter_commits(repo_path, [commit_hash], visited))
+
+
+def iter_all_commits(repo_path, order='topo', since=None, cache=None, jobs=1, ref_kinds=()):
+    # Корни графа: HEAD и ссылки выбранных групп; общий visited - один обход на все ветки
+    roots = [resolve_head_commit(repo_path)]
+    if ref_kinds:
+        roots.extend(resolve_roots(repo_path, ref_kinds))
+    roots = list(dict.fromkeys(roots))
+    if jobs > 1:
+        # Параллельный обход идет по слоям, порядок order к нему не относится
+        return iter_commits_parallel(repo_path, roots, jobs, since=since, cache=cache)
+    return iter_commits(repo_path, roots, order=order, since=since, cache=cache)
 
-    if date:
-        commits.append({
-            'id': commit_hash,
-            'date': date,
-            'parents': parents
-        })
 
-    for parent_hash in parents:
-        parse_commit(repo_path, parent_hash, commits, visited)
+def read_all_commits(repo_path, order='topo', since=None, cache=None, jobs=1, ref_kinds=()):
+    return list(iter_all_commits(repo_path, order, since, cache, jobs, ref_kinds))
 
 
-def read_all_commits(repo_path):
-    head_commit = resolve_head_commit(repo_path)
-    commits = []
-    parse_commit(repo_path, head_commit, commits)
-    return commits
+def peel_tag(repo_path, object_hash):
+    # Аннотированный тег -> объект, на который он указывает (теги могут быть вложенными)
+    for _ in range(10):
+        obj_type, data = read_git_object(repo_path, object_hash)
+        if obj_type != 'tag':
+            return object_hash
+        object_hash = data.split(b'\n', 1)[0].split(b' ')[1].decode('ascii')
+    return object_hash
+
+
+def resolve_roots(repo_path, ref_kinds):
+    refs = git_refs.RefDatabase(repo_path)
+    roots = []
+    for name, object_hash in refs.select(ref_kinds):
+        if name.startswith(git_refs.REF_KINDS['tags']):
+            # Для упакованных тегов hash коммита уже есть в packed-refs
+            object_hash = refs.peeled.get(name) or peel_tag(repo_path, object_hash)
+        roots.append(object_hash)
+    return roots
 
 
 def resolve_head_commit(repo_path):
@@ -64,9 +238,17 @@ def resolve_head_commit(repo_path):
     with open(head_path, 'r') as file:
         ref = file.readline().strip()
         if ref.startswith('ref:'):
-            ref_path = os.path.join(repo_path, '.git', *ref.split()[1].split('/'))
-            with open(ref_path, 'r') as ref_file:
-                return ref_file.readline().strip()
+            ref_name = ref.split()[1]
+            ref_path = os.path.join(repo_path, '.git', *ref_name.split('/'))
+            try:
+                with open(ref_path, 'r') as ref_file:
+                    return ref_file.readline().strip()
+            except FileNotFoundError:
+                # После git gc / git pack-refs ветка остается только в packed-refs
+                refs, _ = git_refs.read_packed_refs(os.path.join(repo_path, '.git'))
+                if ref_name in refs:
+                    return refs[ref_name]
+                raise
         return ref
 
 
@@ -86,21 +268,66 @@ def build_dependency_graph(commits):
     return dot
 
 
-def main(repo_path, output_path, cutoff_date_str):
+def write_local_commit_graph(repo_path, commits):
+    path = os.path.join(repo_path, '.git', commit_graph.LOCAL_GRAPH)
+    commit_graph.write_commit_graph(path, commits)
+    return path
+
+
+def main(repo_path, output_path, cutoff_date_str, order='topo', since_str=None, write_graph=False, use_cache=False,
+         jobs=1, ref_kinds=(), output_format='dot', print_source=True, render=True, collapse=None, transitive=False):
     cutoff_date = datetime.datetime.strptime(cutoff_date_str, '%d.%m.%Y')
-    commits = read_all_commits(repo_path)
-    filtered_commits = filter_commits_by_date(commits, cutoff_date)
-    filtered_commits.sort(key=lambda x: x['date'])
-    graph = build_dependency_graph(filtered_commits)
+    since = datetime.datetime.strptime(since_str, '%d.%m.%Y') if since_str else None
+    has_graph = commit_graph.load_commit_graph(repo_path) is not None
+    cache = commit_cache.CommitCache.for_repo(repo_path) if use_cache else None
+    try:
+        # Коммиты сразу складываются в колоночную таблицу, словари не накапливаются
+        table = commit_table.CommitTable.from_commits(iter_all_commits(repo_path, order, since, cache, jobs, ref_kinds))
+    finally:
+        if cache is not None:
+            cache.close()
+    if cache is not None:
+        print(f'Кеш коммитов: {cache.hits} найдено, {cache.misses} прочитано из репозитория')
+    if not has_graph:
+        if write_graph and since is None:
+            try:
+                path = write_local_commit_graph(repo_path, table.commits())
+                print(f'Файл commit-graph сохранен в {path}, следующие запуски не будут распаковывать коммиты')
+            except (OSError, ValueError) as e:
+                print(f'Не удалось сохранить commit-graph: {e}')
+        elif not write_graph:
+            print('Файл commit-graph не найден; для ускорения повторных запусков используйте --write-commit-graph')
+    # Фильтр по дате и сортировка - над колонкой времени (векторно, если есть NumPy)
+    rows = table.select(cutoff_date)
+    filtered_commits = None
+    if transitive or collapse:
+        # Сокращение графа: сначала лишние ребра слияний, затем сворачивание цепочек
+        filtered_commits = list(table.commits(rows))
+        if transitive:
+            filtered_commits = graph_reduce.transitive_reduction(filtered_commits)
+        if collapse:
+            reduced = graph_reduce.COLLAPSE_MODES[collapse](filtered_commits)
+            print(f'Граф сокращен: {len(filtered_commits)} -> {len(reduced)} коммитов')
+            filtered_commits = reduced
+    write = graph_output.WRITERS[output_format]
+
+    def commits():
+        # Без сокращения словари создаются заново при каждой записи и сразу отбрасываются
+        return table.commits(rows) if filtered_commits is None else filtered_commits
 
-    print("Сгенерированный код Graphviz:")
-    print(graph.source)
+    if print_source:
+        print("Сгенерированный код Graphviz:" if output_format == 'dot' else "Сгенерированный граф:")
+        write(sys.stdout, commits())
 
-    with open(output_path, 'w') as file:
-        file.write(graph.source)
-    graph.render('output', format='png', cleanup=True)
+    with open(output_path, 'w', encoding='utf-8') as file:
+        write(file, commits())
 
-    print(f'Граф зависимостей успешно сохранен в файле {output_path} и output.png')
+    # PNG строится из уже записанного файла; для больших графов это самый долгий шаг
+    if render and output_format == 'dot':
+        graphviz.render('dot', 'png', output_path, outfile='output.png')
+        print(f'Граф зависимостей успешно сохранен в файле {output_path} и output.png')
+    else:
+        print(f'Граф зависимостей успешно сохранен в файле {output_path}')
 
 
 if __name__ == '__main__':
@@ -110,6 +337,32 @@ if __name__ == '__main__':
     parser.add_argument('--repo', type=str, required=True, help='Путь к анализируемому репозиторию.')
     parser.add_argument('--output', type=str, required=True, help='Путь к файлу для сохранения графа (без расширения).')
     parser.add_argument('--date', type=str, required=True, help='Дата в формате dd.mm.yyyy.')
+    parser.add_argument('--since', type=str, help='Нижняя граница даты (dd.mm.yyyy): более старые коммиты не читаются.')
+    parser.add_argument('--order', choices=('topo', 'date'), default='topo',
+                        help='Порядок обхода: topo - в глубину, date - от новых коммитов к старым.')
+    parser.add_argument('--write-commit-graph', action='store_true',
+                        help='Если в репозитории нет commit-graph, сохранить собственную копию в .git/graph-tool.')
+    parser.add_argument('--cache', action='store_true',
+                        help='Хранить разобранные коммиты в .git/graph-tool/commits.sqlite и читать только новые.')
+
+    parser.add_argument('--jobs', type=int, default=1,
+                        help='Число потоков для чтения и распаковки объектов (обход по слоям).')
+
+    parser.add_argument('--format', choices=tuple(graph_output.WRITERS), default='dot',
+                        help='Формат файла графа: dot (Graphviz), jsonl (JSON по строке на коммит) или graphml.')
+    parser.add_argument('--no-print', action='store_true', help='Не выводить граф в консоль.')
+    parser.add_argument('--no-render', action='store_true', help='Не строить изображение output.png.')
+    parser.add_argument('--collapse', choices=tuple(graph_reduce.COLLAPSE_MODES),
+                        help='chains - свернуть линейные цепочки в ребра с числом коммитов, '
+                             'branches - оставить только слияния и развилки.')
+    parser.add_argument('--transitive-reduction', action='store_true',
+                        help='Убрать ребра слияний к родителям, достижимым через другого родителя.')
+    parser.add_argument('--refs', nargs='+', choices=('heads', 'tags', 'remotes', 'all'), default=[],
+                        help='Кроме HEAD, строить граф от всех веток (heads), тегов (tags) и/или удаленных веток (remotes).')
 
     args = parser.parse_args()
-    main(args.repo, args.output, args.date)
+    if args.jobs < 1:
+        parser.error('--jobs должен быть не меньше 1')
+    ref_kinds = tuple(git_refs.REF_KINDS) if 'all' in args.refs else tuple(dict.fromkeys(args.refs))
+    main(args.repo, args.output, args.date, args.order, args.since, args.write_commit_graph, args.cache, args.jobs,
+         ref_kinds, args.format, not args.no_print, not args.no_render, args.collapse, args.transitive_reduction)
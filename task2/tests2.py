@@ -1,7 +1,15 @@
+import io
+import os
+import shutil
+import subprocess
+import tempfile
+import json
+import xml.etree.ElementTree as ET
 import unittest
 from unittest.mock import patch, mock_open
 
 from main import *
+import bench
 
 
 class TestGitDependencyGraph(unittest.TestCase):
@@ -47,6 +55,85 @@ class TestGitDependencyGraph(unittest.TestCase):
         self.assertEqual(commits[1]['date'], datetime.datetime.fromtimestamp(1600000000))
         self.assertEqual(commits[1]['parents'], [])
 
+    @patch('main.read_git_object')
+    def test_iter_commits(self, mock_read_git_object):
+        # Линейная история глубже предела рекурсии и слияние для обхода по дате
+        objects = {f'{n:040x}': ('commit', f'parent {n - 1:040x}\ncommitter A <a@example.com> {n} +0000\n\n'.encode())
+                   for n in range(1, 5000)}
+        objects[f'{0:040x}'] = ('commit', b'committer A <a@example.com> 0 +0000\n\n')
+        mock_read_git_object.side_effect = lambda repo, commit_hash: objects.get(commit_hash, (None, None))
+
+        commits = list(iter_commits(self.repo_path, [f'{4999:040x}']))
+        self.assertEqual(5000, len(commits))
+        self.assertEqual(f'{0:040x}', commits[-1]['id'])
+
+        since = datetime.datetime.fromtimestamp(4990)
+        commits = list(iter_commits(self.repo_path, [f'{4999:040x}'], order='date', since=since))
+        self.assertEqual([f'{n:040x}' for n in range(4999, 4989, -1)], [commit['id'] for commit in commits])
+
+        objects.update({
+            'merge': ('commit', b'parent a\nparent b\ncommitter A <a@example.com> 40 +0000\n\n'),
+            'a': ('commit', b'parent base\ncommitter A <a@example.com> 10 +0000\n\n'),
+            'b': ('commit', b'parent base\ncommitter A <a@example.com> 30 +0000\n\n'),
+            'base': ('commit', b'committer A <a@example.com> 5 +0000\n\n'),
+        })
+        self.assertEqual(['merge', 'a', 'base', 'b'], [c['id'] for c in iter_commits(self.repo_path, ['merge'])])
+        self.assertEqual(['merge', 'b', 'a', 'base'],
+                         [c['id'] for c in iter_commits(self.repo_path, ['merge'], order='date')])
+        self.assertEqual(['merge', 'a', 'b', 'base'],
+                         [c['id'] for c in iter_commits_parallel(self.repo_path, ['merge'], jobs=4)])
+        self.assertEqual(5000, len(list(iter_commits_parallel(self.repo_path, [f'{4999:040x}'], jobs=4))))
+
+    @patch('main.read_git_object')
+    def test_commit_cache(self, mock_read_git_object):
+        objects = {
+            'c2': ('commit', b'parent c1\ncommitter A <a@example.com> 1700000000 +0000\n\nSecond'),
+            'c1': ('commit', b'committer A <a@example.com> 1600000000 +0000\n\nFirst'),
+        }
+        mock_read_git_object.side_effect = lambda repo, commit_hash: objects.get(commit_hash, (None, None))
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'commits.sqlite')
+            cache = commit_cache.CommitCache(path)
+            expected = list(iter_commits(self.repo_path, ['c2'], cache=cache))
+            cache.close()
+            self.assertEqual(2, mock_read_git_object.call_count)
+
+            # Повторный запуск читает из репозитория только новый коммит
+            objects['c3'] = ('commit', b'parent c2\ncommitter A <a@example.com> 1800000000 +0000\n\nThird')
+            cache = commit_cache.CommitCache(path)
+            commits = list(iter_commits(self.repo_path, ['c3'], cache=cache))
+            cache.close()
+            self.assertEqual(3, mock_read_git_object.call_count)
+            self.assertEqual(expected, commits[1:])
+            self.assertEqual((2, 1), (cache.hits, cache.misses))
+
+            # Корень законченного обхода запомнен, прежний (c2) в его истории и больше не нужен
+            cache = commit_cache.CommitCache(path)
+            self.assertEqual({'c3'}, cache.tips)
+            self.assertEqual(commits, list(iter_commits(self.repo_path, ['c3'], cache=cache)))
+            # Обход с since не закончен до конца истории, корни не запоминаются
+            objects['c4'] = ('commit', b'parent c3\ncommitter A <a@example.com> 1900000000 +0000\n\nFourth')
+            list(iter_commits(self.repo_path, ['c4'], since=datetime.datetime(2030, 1, 1), cache=cache))
+            cache.close()
+            self.assertEqual(4, mock_read_git_object.call_count)
+            cache = commit_cache.CommitCache(path)
+            cache.close()
+            self.assertEqual({'c3'}, cache.tips)
+
+    def test_parse_commit_header(self):
+        # Подпись в заголовке, строки 'parent' и 'committer' в сообщении и сообщение не в UTF-8
+        data = (b'tree 4b825dc642cb6eb9a060e54bf8d69288fbee4904\n'
+                b'parent 1111111111111111111111111111111111111111\n'
+                b'parent 2222222222222222222222222222222222222222\n'
+                b'author A <a@example.com> 1600000000 +0300\n'
+                b'committer B Name <b@example.com> 1700000000 -0500\n'
+                b'gpgsig -----BEGIN PGP SIGNATURE-----\n parent 3333333333333333333333333333333333333333\n'
+                b' -----END PGP SIGNATURE-----\n'
+                b'\n'
+                b'\xcf\xf0\xe8\xe2\xe5\xf2\nparent 4444444444444444444444444444444444444444\ncommitter X <x> 1 +0000\n')
+        self.assertEqual((['1' * 40, '2' * 40], 1700000000), parse_commit_header(data))
+        self.assertEqual(([], None), parse_commit_header(b'tree 4b825dc642cb6eb9a060e54bf8d69288fbee4904\n'))
+
     def test_filter_commits_by_date(self):
         commits = [
             {'id': '123', 'date': datetime.datetime(2022, 12, 31)},
@@ -66,5 +153,217 @@ class TestGitDependencyGraph(unittest.TestCase):
         self.assertIn('rankdir=BT', graph.source)
 
 
+    def test_commit_table(self):
+        head, merged, base, pruned = ('%040x' % n for n in (4, 3, 2, 1))
+        commits = [
+            {'id': head, 'date': datetime.datetime(2023, 1, 3), 'parents': [base, merged]},
+            {'id': merged, 'date': datetime.datetime(2023, 1, 2), 'parents': [base]},
+            {'id': base, 'date': datetime.datetime(2022, 12, 31), 'parents': [pruned]},
+        ]
+        table = commit_table.CommitTable.from_commits(iter(commits))
+        # Родитель, которого нет среди прочитанных коммитов, хранится строкой-заглушкой
+        self.assertEqual(4, len(table))
+
+        self.assertEqual([commits[2], commits[1], commits[0]], list(table.commits(table.select())))
+        self.assertEqual([base], [commit['id'] for commit in table.commits(table.select(self.cutoff_date))])
+
+        # Равное время: порядок обхода, хотя строку второй родитель получил раньше, чем до него дошел обход
+        same = datetime.datetime(2023, 1, 1)
+        walk = [
+            {'id': head, 'date': same, 'parents': [base, merged]},
+            {'id': base, 'date': same, 'parents': [pruned]},
+            {'id': pruned, 'date': same, 'parents': []},
+            {'id': merged, 'date': same, 'parents': [pruned]},
+        ]
+        table = commit_table.CommitTable.from_commits(iter(walk))
+        self.assertEqual(walk, list(table.commits(table.select())))
+        self.assertEqual(walk, list(table.commits()))
+
+    def test_graph_output(self):
+        commits = [
+            {'id': '123', 'date': datetime.datetime(2022, 12, 31), 'parents': ['000']},
+            {'id': '456', 'date': datetime.datetime(2023, 1, 1), 'parents': ['123']}
+        ]
+        output = io.StringIO()
+        self.assertEqual(2, graph_output.write_dot(output, commits))
+        self.assertIn('rankdir=BT', output.getvalue())
+        self.assertIn('"123" -> "456"', output.getvalue())
+
+        output = io.StringIO()
+        graph_output.write_jsonl(output, commits)
+        lines = [json.loads(line) for line in output.getvalue().splitlines()]
+        self.assertEqual({'id': '456', 'date': '2023-01-01T00:00:00', 'parents': ['123']}, lines[1])
+
+        # В GraphML остается только ребро к родителю, который есть среди узлов
+        output = io.StringIO()
+        graph_output.write_graphml(output, commits)
+        ns = {'g': 'http://graphml.graphdrawing.org/xmlns'}
+        root = ET.fromstring(output.getvalue().encode())
+        self.assertEqual(['123', '456'], [node.get('id') for node in root.iterfind('.//g:node', ns)])
+        self.assertEqual([('123', '456')], [(edge.get('source'), edge.get('target'))
+                                            for edge in root.iterfind('.//g:edge', ns)])
+
+    def test_graph_reduce(self):
+        parents = {'r': [], 'a1': ['r'], 'a2': ['a1'], 'f': ['a2'], 'b1': ['f'], 'b2': ['b1'], 'c1': ['f'],
+                   'm': ['b2', 'c1'], 't': ['m'], 'n': ['m', 't']}
+        commits = [{'id': commit_id, 'date': datetime.datetime(2023, 1, 1 + i), 'parents': commit_parents}
+                   for i, (commit_id, commit_parents) in enumerate(parents.items())]
+
+        def edges(reduced):
+            return {commit['id']: list(zip(commit['parents'], commit.get('skipped', [0] * len(commit['parents']))))
+                    for commit in reduced}
+
+        self.assertEqual({'r': [], 'f': [('r', 2)], 'm': [('f', 2), ('f', 1)], 'n': [('m', 0), ('m', 1)]},
+                         edges(graph_reduce.collapse_chains(commits)))
+        self.assertEqual({'f': [], 'm': [('f', 2), ('f', 1)], 'n': [('m', 0), ('m', 1)]},
+                         edges(graph_reduce.branch_points(commits)))
+
+        # Родитель m у n достижим через t, ребро m -> n лишнее
+        reduced = graph_reduce.transitive_reduction(commits)
+        self.assertEqual(['t'], [parent for parent, _ in edges(reduced)['n']])
+        self.assertEqual({'r': [], 'f': [('r', 2)], 'm': [('f', 2), ('f', 1)], 'n': [('m', 1)]},
+                         edges(graph_reduce.collapse_chains(reduced)))
+        self.assertEqual(['m', 't'], parents['n'])
+
+    @unittest.skipUnless(shutil.which('git'), 'git не установлен')
+    def test_read_packed_object(self):
+        # Объекты в pack-файле: дельты по смещению (OFS_DELTA) и по имени базы (REF_DELTA)
+        for offsets in ('true', 'false'):
+            with tempfile.TemporaryDirectory() as repo:
+                git = ['git', '-C', repo, '-c', 'user.name=Test', '-c', 'user.email=test@example.com']
+                subprocess.run(git + ['init', '-q'], check=True)
+                for i in range(20):
+                    with open(os.path.join(repo, 'file.txt'), 'w') as file:
+                        file.write(''.join(f'line {n}\n' for n in range(200 + i)))
+                    subprocess.run(git + ['add', 'file.txt'], check=True)
+                    subprocess.run(git + ['commit', '-q', '-m', f'commit {i}'], check=True)
+                subprocess.run(git + ['-c', f'repack.useDeltaBaseOffset={offsets}', 'repack', '-adfq', '--depth=50'],
+                               check=True)
+
+                listing = subprocess.run(git + ['cat-file', '--batch-all-objects', '--batch-check'],
+                                         check=True, capture_output=True, text=True).stdout.split('\n')
+                for line in filter(None, listing):
+                    object_hash, obj_type, _ = line.split()
+                    expected = subprocess.run(git + ['cat-file', obj_type, object_hash],
+                                              check=True, capture_output=True).stdout
+                    self.assertEqual((obj_type, expected), read_git_object(repo, object_hash))
+                self.assertEqual((None, None), read_git_object(repo, '0' * 40))
+
+    def test_bench_repo(self):
+        # Синтетический репозиторий из bench.py одинаково читается из loose-объектов и из pack-файла
+        histories = []
+        for storage in ('loose', 'packed'):
+            with tempfile.TemporaryDirectory() as repo:
+                head = bench.make_repo(repo, 50, 0.3, storage, seed=1)
+                self.assertEqual(head, resolve_head_commit(repo))
+                histories.append(read_all_commits(repo))
+                # Замер в отдельном процессе дает тот же отчет
+                for report in (bench.run(repo), bench.run_isolated(repo)):
+                    self.assertEqual(50, report['commits'])
+                    self.assertEqual({'refs', 'traversal', 'parse', 'filter', 'dot'}, set(report['phases']))
+        self.assertEqual(histories[0], histories[1])
+        self.assertEqual(50, len(histories[0]))
+        self.assertTrue(any(len(commit['parents']) == 2 for commit in histories[0]))
+
+    def test_pack_store_refresh(self):
+        # Новый pack-файл находится при промахе; прежние не переоткрываются, а удаленный
+        # не закрывается под потоком, который еще его читает
+        with tempfile.TemporaryDirectory() as repo:
+            head = bench.make_repo(repo, 20, storage='packed')
+            objects_dir = os.path.join(repo, '.git', 'objects')
+            store = git_pack.PackStore(objects_dir)
+            expected = store.read(head)
+            self.assertEqual('commit', expected[0])
+            old = store.packs[0]
+
+            blob_hash, _ = bench.git_object('blob', b'new')
+            bench.write_pack(objects_dir, [(blob_hash, 'blob', b'new')])
+            self.assertEqual(('blob', b'new'), store.read(blob_hash))
+            self.assertEqual(2, len(store.packs))
+            self.assertIn(old, store.packs)
+
+            os.remove(old.path)
+            os.remove(old.path[:-5] + '.idx')
+            self.assertEqual((None, None), store.read('0' * 40))
+            self.assertEqual(1, len(store.packs))
+            self.assertEqual(expected, old.read(old.index.find(bytes.fromhex(head))))
+            store.close()
+
+    @unittest.skipUnless(shutil.which('git'), 'git не установлен')
+    def test_commit_graph(self):
+        with tempfile.TemporaryDirectory() as repo:
+            git = ['git', '-C', repo, '-c', 'user.name=Test', '-c', 'user.email=test@example.com']
+            subprocess.run(git + ['init', '-q', '-b', 'main'], check=True)
+            subprocess.run(git + ['commit', '-q', '--allow-empty', '-m', 'base'], check=True)
+            for branch in ('a', 'b', 'c'):
+                subprocess.run(git + ['checkout', '-q', '-b', branch, 'main'], check=True)
+                subprocess.run(git + ['commit', '-q', '--allow-empty', '-m', branch], check=True)
+            subprocess.run(git + ['checkout', '-q', 'main'], check=True)
+            # Слияние трех веток: у коммита четыре родителя, они попадают в список EDGE
+            subprocess.run(git + ['merge', '-q', '--no-ff', '-m', 'octopus', 'a', 'b', 'c'], check=True)
+            subprocess.run(git + ['commit', '-q', '--allow-empty', '-m', 'tip'], check=True)
+
+            expected = read_all_commits(repo)
+            self.assertEqual(6, len(expected))
+            self.assertIsNone(commit_graph.load_commit_graph(repo))
+
+            subprocess.run(git + ['commit-graph', 'write', '--reachable'], check=True)
+            with patch('main.read_git_object') as mock_read_git_object:
+                self.assertEqual(expected, read_all_commits(repo))
+                mock_read_git_object.assert_not_called()
+
+            # Цепочка из двух файлов: новый коммит попадает во второй слой
+            os.remove(os.path.join(repo, '.git', 'objects', 'info', 'commit-graph'))
+            subprocess.run(git + ['commit-graph', 'write', '--reachable', '--split'], check=True)
+            subprocess.run(git + ['commit', '-q', '--allow-empty', '-m', 'after'], check=True)
+            expected = read_all_commits(repo)
+            self.assertEqual(7, len(expected))
+            subprocess.run(git + ['commit-graph', 'write', '--reachable', '--split=no-merge'], check=True)
+            with open(os.path.join(repo, '.git', 'objects', 'info', 'commit-graphs', 'commit-graph-chain')) as file:
+                self.assertEqual(2, len(file.readlines()))
+            with patch('main.read_git_object') as mock_read_git_object:
+                self.assertEqual(expected, read_all_commits(repo))
+                mock_read_git_object.assert_not_called()
+
+            # Собственная копия, если у git файла нет
+            shutil.rmtree(os.path.join(repo, '.git', 'objects', 'info', 'commit-graphs'))
+            write_local_commit_graph(repo, expected)
+            with patch('main.read_git_object') as mock_read_git_object:
+                self.assertEqual(expected, read_all_commits(repo))
+                mock_read_git_object.assert_not_called()
+
+    @unittest.skipUnless(shutil.which('git'), 'git не установлен')
+    def test_refs(self):
+        with tempfile.TemporaryDirectory() as repo:
+            git = ['git', '-C', repo, '-c', 'user.name=Test', '-c', 'user.email=test@example.com']
+
+            def commit(message):
+                subprocess.run(git + ['commit', '-q', '--allow-empty', '-m', message], check=True)
+                return subprocess.run(git + ['rev-parse', 'HEAD'], check=True, capture_output=True,
+                                      text=True).stdout.strip()
+
+            subprocess.run(git + ['init', '-q', '-b', 'main'], check=True)
+            base = commit('base')
+            subprocess.run(git + ['checkout', '-q', '--detach'], check=True)
+            tagged = commit('tagged')
+            subprocess.run(git + ['tag', '-a', '-m', 'release', 'v1', tagged], check=True)
+            subprocess.run(git + ['checkout', '-q', '-b', 'side', base], check=True)
+            side = commit('side')
+            subprocess.run(git + ['checkout', '-q', 'main'], check=True)
+            subprocess.run(git + ['pack-refs', '--all'], check=True)
+            self.assertFalse(os.path.exists(os.path.join(repo, '.git', 'refs', 'heads', 'main')))
+            # Ветка, измененная после упаковки, снова лежит в refs/ и перекрывает packed-refs
+            head = commit('head')
+
+            self.assertEqual(head, resolve_head_commit(repo))
+            subprocess.run(git + ['pack-refs', '--all'], check=True)
+            self.assertEqual(head, resolve_head_commit(repo))
+
+            self.assertEqual([head, base], [c['id'] for c in read_all_commits(repo)])
+            self.assertEqual({head, base, side}, {c['id'] for c in read_all_commits(repo, ref_kinds=('heads',))})
+            commits = read_all_commits(repo, ref_kinds=tuple(git_refs.REF_KINDS))
+            self.assertEqual([head, base, side, tagged], [c['id'] for c in commits])
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -1,129 +1,243 @@
-import sys
+import os
 import json
+import struct
+import hashlib
+import argparse
+from itertools import starmap, islice
+
+import vm_memory
+
+# Форматы команд: код операции -> (имя, длина в байтах)
+OPCODES = {
+    11: ('LOAD_CONST', 8),
+    0: ('LOAD_FROM_MEM', 9),
+    15: ('STORE_TO_MEM', 10),
+    13: ('ROTR', 13),
+}
+
+# Команда читается без среза одним unpack_from: младшие 8 байт и остаток
+UNPACK_8 = struct.Struct('<Q').unpack_from
+UNPACK_9 = struct.Struct('<QB').unpack_from
+UNPACK_10 = struct.Struct('<QH').unpack_from
+UNPACK_13 = struct.Struct('<QIB').unpack_from
+
+# Кэш декодированной программы рядом с бинарным файлом: заголовок, текст ошибки, затем записи
+# (код операции, B, C, D) по 16 байт. Кэш действителен, пока совпадает sha1 бинарного файла
+CACHE_SUFFIX = '.decoded'
+CACHE_MAGIC = b'UVMD'
+CACHE_VERSION = 1
+CACHE_HEADER = struct.Struct('<4sH20sIH')
+CACHE_RECORD = struct.Struct('<B3xIII')
+
 
 def rotate_right(value, shift, bits=32):
     shift = shift % bits
     return ((value >> shift) | (value << (bits - shift))) & ((1 << bits) - 1)
 
-def main():
-    if len(sys.argv) < 6:
-        print("Usage: python interpreter.py <binary_file> <result_file> <mem_start> <mem_end> <mem_dump_json>")
-        sys.exit(1)
-
-    binary_file = sys.argv[1]
-    result_file = sys.argv[2]
-    mem_start = int(sys.argv[3])
-    mem_end = int(sys.argv[4])
-    mem_dump_json = sys.argv[5]
 
-    memory = {}  # простая модель памяти
+class DecodeError(Exception):
+    # Обрезанная или неизвестная команда; текст - сообщение интерпретатора
+    pass
 
-    with open(binary_file, 'rb') as f:
-        code = f.read()
 
+def iter_decoded(code, unpack_8=UNPACK_8, unpack_9=UNPACK_9, unpack_10=UNPACK_10, unpack_13=UNPACK_13):
+    # Разбор команд по одной в (A, B, C, D) - общий для decode и execute. Поля разбираются
+    # отдельной веткой на каждый формат с масками-константами: это самый горячий цикл холодного
+    # запуска. Ошибка останавливает разбор исключением DecodeError после всех целых команд перед ней
     pc = 0
     code_len = len(code)
+    try:
+        while pc < code_len:
+            A = code[pc] & 0xF
+            if A == 11:
+                # A=4 бита, B=21 бит, C=32 бита
+                (low,) = unpack_8(code, pc)
+                yield 11, (low >> 4) & 0x1FFFFF, (low >> 25) & 0xFFFFFFFF, 0
+                pc += 8
+            elif A == 0:
+                # A=4 бита, B=32 бита, C=32 бита
+                low, high = unpack_9(code, pc)
+                yield 0, (low >> 4) & 0xFFFFFFFF, (low >> 36) | (high & 0xF) << 28, 0
+                pc += 9
+            elif A == 15:
+                # A=4 бита, B=32 бита, C=32 бита, D=12 бит
+                low, high = unpack_10(code, pc)
+                yield 15, (low >> 4) & 0xFFFFFFFF, (low >> 36) | (high & 0xF) << 28, high >> 4
+                pc += 10
+            elif A == 13:
+                # A=4 бита, B=32 бита, C=32 бита, D=32 бита
+                low, middle, high = unpack_13(code, pc)
+                yield (13, (low >> 4) & 0xFFFFFFFF, (low >> 36) | (middle & 0xF) << 28,
+                       (middle >> 4) | (high & 0xF) << 28)
+                pc += 13
+            else:
+                raise DecodeError(f"Unknown opcode A={A} at PC={pc}")
+    except struct.error:
+        # Обрезанную команду обнаруживает unpack_from
+        raise DecodeError(f"Error: Truncated {OPCODES[A][0]}") from None
+
+
+def decode(code):
+    # Первая фаза: разбор всего бинарного файла в список (A, B, C, D).
+    # Ошибка (обрезанная или неизвестная команда) останавливает разбор, как и выполнение
+    instructions = []
+    try:
+        instructions.extend(iter_decoded(code))
+    except DecodeError as error:
+        return instructions, str(error)
+    return instructions, None
+
+
+def load_decoded(binary_file, use_cache=True):
+    # Декодированная программа берется из кэша, если он соответствует бинарному файлу,
+    # иначе декодируется и кэш перезаписывается
+    with open(binary_file, 'rb') as f:
+        code = f.read()
+    digest = hashlib.sha1(code).digest()
+    cache_file = binary_file + CACHE_SUFFIX
+
+    if use_cache:
+        try:
+            with open(cache_file, 'rb') as f:
+                data = f.read()
+            magic, version, cached_digest, count, error_len = CACHE_HEADER.unpack_from(data)
+            offset = CACHE_HEADER.size + error_len
+            if (magic, version, cached_digest) == (CACHE_MAGIC, CACHE_VERSION, digest) \
+                    and len(data) == offset + count * CACHE_RECORD.size:
+                error = data[CACHE_HEADER.size:offset].decode('utf-8') or None
+                return list(CACHE_RECORD.iter_unpack(data[offset:])), error
+        except (OSError, struct.error, UnicodeDecodeError):
+            pass
+
+    instructions, error = decode(code)
+    if use_cache:
+        encoded_error = (error or '').encode('utf-8')
+        data = bytearray(CACHE_HEADER.pack(CACHE_MAGIC, CACHE_VERSION, digest, len(instructions),
+                                           len(encoded_error)))
+        data += encoded_error
+        data += b''.join(starmap(CACHE_RECORD.pack, instructions))
+        try:
+            # Запись через временный файл, чтобы параллельный запуск не прочитал половину кэша
+            tmp_file = cache_file + '.tmp'
+            with open(tmp_file, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_file, cache_file)
+        except OSError:
+            pass  # каталог только для чтения: работаем без кэша
+    return instructions, error
+
+
+# Вторая фаза: выполнение декодированных команд через таблицу обработчиков,
+# без разбора байтов и цепочки сравнений кода операции
+
+def load_const(memory, B, C, D):
+    # Записываем B в память[C]
+    memory[C] = B
+
+
+def load_from_mem(memory, B, C, D):
+    # В memory[B] запишем значение memory[memory[C]]
+    memory[B] = memory[memory[C]]
+
+
+def store_to_mem(memory, B, C, D):
+    # memory[memory[C] + D] = memory[B]
+    memory[memory[C] + D] = memory[B]
+
+
+def rotr(memory, B, C, D):
+    # Операнды: valueC = memory[memory[C]], shift = memory[memory[B]]
+    # Результат: memory[memory[D]] = rotate_right(valueC, shift)
+    memory[memory[D]] = rotate_right(memory[memory[C]], memory[memory[B]], 32)
+
+
+HANDLERS = {
+    11: load_const,
+    0: load_from_mem,
+    15: store_to_mem,
+    13: rotr,
+}
+
+
+def run(instructions, memory, grow=False):
+    # grow: при выходе адреса за пределы DenseMemory память переносится в PagedMemory
+    # и команда выполняется заново - обработчик падает до записи, ничего не изменив
+    handlers = HANDLERS
+    index = 0
+    while True:
+        try:
+            for index, (A, B, C, D) in enumerate(islice(instructions, index, None), index):
+                handlers[A](memory, B, C, D)
+            return memory
+        except IndexError:
+            if not grow or not isinstance(memory, vm_memory.DenseMemory):
+                raise
+            memory = vm_memory.to_paged(memory)
+
+
+def execute(code, memory, grow=False):
+    # Запуск без кэша: разбор и выполнение в одном проходе, без списка команд - для однократного
+    # запуска это быстрее двух фаз. Команды берутся из iter_decoded, как в decode, и выполняются
+    # через таблицу обработчиков; grow - как в run. Возвращает (память, текст ошибки или None)
+    handlers = HANDLERS
+    instructions = iter_decoded(code)
+    while True:
+        try:
+            for A, B, C, D in instructions:
+                handlers[A](memory, B, C, D)
+            return memory, None
+        except DecodeError as error:
+            return memory, str(error)
+        except IndexError:
+            if not grow or not isinstance(memory, vm_memory.DenseMemory):
+                raise
+            # Разбор продолжается с той же позиции, упавшая команда выполняется заново
+            memory = vm_memory.to_paged(memory)
+            handlers[A](memory, B, C, D)
 
-    while pc < code_len:
-        # Читаем 1 байт, чтобы определить A (4 бита)
-        if pc >= code_len:
-            break
-        first_byte = code[pc]
-        A = first_byte & 0xF
-
-        if A == 11:
-            # LOAD_CONST (8 байт)
-            # A=11, B=21 бит, C=32 бита
-            # Уже считан первый байт, нужно считать всего 8 байт
-            if pc+8 > code_len:
-                print("Error: Truncated LOAD_CONST")
-                break
-            instr = int.from_bytes(code[pc:pc+8], 'little', signed=False)
-            pc += 8
-
-            # Парсим поля
-            A = instr & 0xF
-            B = (instr >> 4) & ((1 << 21)-1)
-            C = (instr >> 25) & ((1 << 32)-1)
-
-            # Записываем B в память[C]
-            memory[C] = B
-
-        elif A == 0:
-            # LOAD_FROM_MEM (9 байт)
-            if pc+9 > code_len:
-                print("Error: Truncated LOAD_FROM_MEM")
-                break
-            instr = int.from_bytes(code[pc:pc+9], 'little', signed=False)
-            pc += 9
-
-            A = instr & 0xF
-            B = (instr >> 4) & ((1 << 32)-1)
-            C = (instr >> 36) & ((1 << 32)-1)
-
-            # В memory[B] запишем значение memory[memory[C]]
-            addr_c = memory.get(C, 0)
-            val = memory.get(addr_c, 0)
-            memory[B] = val
-
-        elif A == 15:
-            # STORE_TO_MEM (10 байт)
-            if pc+10 > code_len:
-                print("Error: Truncated STORE_TO_MEM")
-                break
-            instr = int.from_bytes(code[pc:pc+10], 'little', signed=False)
-            pc += 10
-
-            A = instr & 0xF
-            B = (instr >> 4) & ((1 << 32)-1)
-            C = (instr >> 36) & ((1 << 32)-1)
-            D = (instr >> 68) & ((1 << 12)-1)
-
-            # memory[memory[C] + D] = memory[B]
-            base = memory.get(C, 0)
-            val = memory.get(B, 0)
-            memory[base + D] = val
-
-        elif A == 13:
-            # ROTR (13 байт)
-            if pc+13 > code_len:
-                print("Error: Truncated ROTR")
-                break
-            instr = int.from_bytes(code[pc:pc+13], 'little', signed=False)
-            pc += 13
-
-            A = instr & 0xF
-            B = (instr >> 4) & ((1 << 32)-1)
-            C = (instr >> 36) & ((1 << 32)-1)
-            D = (instr >> 68) & ((1 << 32)-1)
-
-            # Операнды: valueC = memory[memory[C]], shift = memory[memory[B]]
-            # Результат: memory[memory[D]] = rotate_right(valueC, shift)
-            addr_c = memory.get(C, 0)
-            addr_b = memory.get(B, 0)
-            addr_d = memory.get(D, 0)
-
-            value_c = memory.get(addr_c, 0)
-            shift = memory.get(addr_b, 0)
-            rotated = rotate_right(value_c, shift, 32)
-            memory[addr_d] = rotated
 
+def main():
+    parser = argparse.ArgumentParser(description='Интерпретатор УВМ.')
+    parser.add_argument('binary_file', help='Бинарный файл программы.')
+    parser.add_argument('result_file', help='JSON-файл для значений диапазона памяти.')
+    parser.add_argument('mem_start', type=int, help='Начальный адрес диапазона.')
+    parser.add_argument('mem_end', type=int, help='Конечный адрес диапазона.')
+    parser.add_argument('mem_dump_json', help='JSON-файл для дампа всей памяти.')
+    parser.add_argument('--cache', action='store_true',
+                        help='Хранить декодированную программу рядом с бинарным файлом для повторных запусков.')
+    parser.add_argument('--memory', choices=tuple(vm_memory.BACKENDS), default='dict',
+                        help='Модель памяти: словарь (по умолчанию), непрерывный массив с переходом '
+                             'на страницы по 4 КиБ (auto), только страницы или только массив.')
+    parser.add_argument('--memory-size', type=int, default=vm_memory.DEFAULT_DENSE_CELLS,
+                        help='Число ячеек непрерывного массива для auto и dense.')
+    args = parser.parse_args()
+
+    memory = vm_memory.create_memory(args.memory, args.memory_size)
+
+    grow = args.memory == 'auto'
+    try:
+        if args.cache:
+            instructions, error = load_decoded(args.binary_file)
+            memory = run(instructions, memory, grow)
         else:
-            print(f"Unknown opcode A={A} at PC={pc}")
-            break
-
-    # Выгружаем диапазон памяти [mem_start, mem_end] в result_file (json)
-    result = {}
-    for addr in range(mem_start, mem_end+1):
-        result[addr] = memory.get(addr, 0)
-
-    with open(result_file, 'w', encoding='utf-8') as f_out:
+            with open(args.binary_file, 'rb') as f:
+                memory, error = execute(f.read(), memory, grow)
+    except IndexError:
+        error = f"Error: Address out of range for dense memory of {args.memory_size} cells"
+    if error:
+        print(error)
+
+    # Выгружаем диапазон памяти [mem_start, mem_end] в result_file (json) одним срезом
+    values = memory.dump(args.mem_start, args.mem_end)
+    result = dict(zip(range(args.mem_start, args.mem_end + 1), values))
+
+    with open(args.result_file, 'w', encoding='utf-8') as f_out:
         json.dump(result, f_out, ensure_ascii=False, indent=2)
 
     # Также сохраним всю память в отдельный json (например, для отладки)
-    with open(mem_dump_json, 'w', encoding='utf-8') as f_dump:
-        mem_all = {str(k): v for k, v in memory.items()}
+    with open(args.mem_dump_json, 'w', encoding='utf-8') as f_dump:
+        mem_all = {str(k): v for k, v in memory.cells()}
         json.dump(mem_all, f_dump, ensure_ascii=False, indent=2)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
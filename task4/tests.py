@@ -1,6 +1,9 @@
 import unittest
 import subprocess
 import os
+import json
+
+import vm_memory
 
 class TestInstructionBytes(unittest.TestCase):
     def setUp(self):
@@ -71,5 +74,134 @@ class TestInstructionBytes(unittest.TestCase):
         self.assertEqual(actual, expected_bytes)
 
 
+class TestInterpreter(unittest.TestCase):
+    def setUp(self):
+        self.temp_asm = 'temp_interp.asm'
+        self.temp_bin = 'temp_interp.bin'
+        self.temp_log = 'temp_interp_log.json'
+        self.temp_result = 'temp_interp_result.json'
+        self.temp_dump = 'temp_interp_dump.json'
+
+    def tearDown(self):
+        for f in [self.temp_asm, self.temp_bin, self.temp_log, self.temp_result, self.temp_dump,
+                  self.temp_bin + '.decoded']:
+            if os.path.exists(f):
+                os.remove(f)
+
+    def run_program(self, asm_code, mem_start, mem_end, *extra):
+        with open(self.temp_asm, 'w', encoding='utf-8') as f:
+            f.write(asm_code)
+        subprocess.run(f"python assembler.py {self.temp_asm} {self.temp_bin} {self.temp_log}", shell=True,
+                       check=True, capture_output=True)
+        return self.run_binary(mem_start, mem_end, *extra)
+
+    def run_binary(self, mem_start, mem_end, *extra):
+        cmd = ['python', 'interpreter.py', self.temp_bin, self.temp_result, str(mem_start), str(mem_end),
+               self.temp_dump, *extra]
+        result = subprocess.run(cmd, capture_output=True, text=True)
+        self.assertEqual(result.returncode, 0, msg=result.stderr)
+        with open(self.temp_result, encoding='utf-8') as f:
+            return json.load(f), result.stdout
+
+    def test_rotr_program(self):
+        # Циклический сдвиг 1 на 4 бита вправо, затем копирование результата двумя способами адресации
+        asm_code = (
+            "LOAD_CONST 1, 100\n"     # значение
+            "LOAD_CONST 4, 101\n"     # сдвиг
+            "LOAD_CONST 100, 1\n"     # адрес значения
+            "LOAD_CONST 101, 2\n"     # адрес сдвига
+            "LOAD_CONST 10, 3\n"      # адрес результата
+            "ROTR 2, 1, 3\n"
+            "LOAD_CONST 10, 4\n"
+            "LOAD_FROM_MEM 11, 4\n"   # memory[11] = memory[memory[4]]
+            "STORE_TO_MEM 11, 4, 2\n"  # memory[memory[4] + 2] = memory[11]
+        )
+        expected = {'10': 0x10000000, '11': 0x10000000, '12': 0x10000000, '13': 0}
+        self.assertEqual((expected, ''), self.run_program(asm_code, 10, 13))
+        self.assertFalse(os.path.exists(self.temp_bin + '.decoded'))
+        # С --cache декодированная программа сохраняется, повторный запуск берет ее из кэша
+        self.assertEqual((expected, ''), self.run_binary(10, 13, '--cache'))
+        self.assertTrue(os.path.exists(self.temp_bin + '.decoded'))
+        self.assertEqual((expected, ''), self.run_binary(10, 13, '--cache'))
+
+    def test_decode_cache_invalidation(self):
+        self.assertEqual({'5': 7}, self.run_program("LOAD_CONST 7, 5\n", 5, 5, '--cache')[0])
+        # Бинарный файл изменился - устаревший кэш не используется
+        self.assertEqual({'5': 9}, self.run_program("LOAD_CONST 9, 5\n", 5, 5, '--cache')[0])
+
+    def test_truncated_program(self):
+        # Команды до обрезанной выполняются, затем выводится ошибка
+        with open(self.temp_asm, 'w', encoding='utf-8') as f:
+            f.write("LOAD_CONST 7, 5\nROTR 1, 2, 3\n")
+        subprocess.run(f"python assembler.py {self.temp_asm} {self.temp_bin} {self.temp_log}", shell=True,
+                       check=True, capture_output=True)
+        with open(self.temp_bin, 'rb') as f:
+            code = f.read()
+        with open(self.temp_bin, 'wb') as f:
+            f.write(code[:-1])
+        for _ in range(2):
+            self.assertEqual(({'5': 7}, 'Error: Truncated ROTR\n'), self.run_binary(5, 5, '--cache'))
+        self.assertEqual(({'5': 7}, 'Error: Truncated ROTR\n'), self.run_binary(5, 5))
+
+    def test_memory_backends(self):
+        # Адрес 4000000000 - за пределами плотной памяти: auto переходит на страницы, dense - ошибка
+        asm_code = (
+            "LOAD_CONST 5, 1023\n"
+            "LOAD_CONST 6, 1024\n"
+            "LOAD_CONST 1023, 7\n"
+            "LOAD_FROM_MEM 4000000000, 7\n"  # memory[4000000000] = memory[memory[7]]
+            "LOAD_CONST 8, 1025\n"
+        )
+        expected = {'1022': 0, '1023': 5, '1024': 6, '1025': 8}
+        for backend in ('auto', 'paged', 'dict'):
+            result, output = self.run_program(asm_code, 1022, 1025, '--memory', backend, '--memory-size', '2048')
+            self.assertEqual((expected, ''), (result, output), msg=backend)
+            with open(self.temp_dump, encoding='utf-8') as f:
+                self.assertEqual(5, json.load(f)['4000000000'], msg=backend)
+
+        result, output = self.run_binary(1022, 1025, '--memory', 'dense', '--memory-size', '2048')
+        self.assertEqual({'1022': 0, '1023': 5, '1024': 6, '1025': 0}, result)
+        self.assertIn('out of range', output)
+
+    def test_paged_memory_dump(self):
+        memory = vm_memory.PagedMemory()
+        memory[vm_memory.PAGE_CELLS - 1] = 1
+        memory[3 * vm_memory.PAGE_CELLS] = 2
+        self.assertEqual(2, len(memory.pages))
+        # Диапазон через границу страницы и через невыделенную страницу
+        values = memory.dump(vm_memory.PAGE_CELLS - 2, 3 * vm_memory.PAGE_CELLS + 1)
+        self.assertEqual([0, 1] + [0] * (2 * vm_memory.PAGE_CELLS) + [2, 0], values)
+        self.assertEqual([(vm_memory.PAGE_CELLS - 1, 1), (3 * vm_memory.PAGE_CELLS, 2)], list(memory.cells()))
+        # Явно записанный ноль попадает в дамп, как и в словаре
+        memory[5] = 0
+        self.assertEqual((5, 0), next(iter(memory.cells())))
+
+        dense = vm_memory.DenseMemory(4)
+        dense[3] = 9
+        dense[1] = 0
+        self.assertEqual([9, 0, 0], dense.dump(3, 5))
+        self.assertEqual([(1, 0), (3, 9)], list(dense.cells()))
+        paged = vm_memory.to_paged(dense)
+        self.assertEqual({0: [0, 0, 0, 9]}, {n: page[:4].tolist() for n, page in paged.pages.items()})
+        self.assertEqual([(1, 0), (3, 9)], list(paged.cells()))
+
+        # Отрицательные адреса - нули, а не ячейки с конца массива
+        dense[0] = 7
+        for memory in (dense, vm_memory.to_paged(dense), vm_memory.DictMemory({0: 7, 1: 0, 3: 9})):
+            self.assertEqual([0, 0, 7, 0], memory.dump(-2, 1))
+            self.assertEqual([0, 0], memory.dump(-3, -2))
+
+    def test_memory_dump_matches_backends(self):
+        # Полный дамп program.bin одинаков для всех моделей памяти и совпадает с memory_dump.json
+        with open('memory_dump.json', encoding='utf-8') as f:
+            expected = json.load(f)
+        for backend in vm_memory.BACKENDS:
+            result = subprocess.run(['python', 'interpreter.py', 'program.bin', self.temp_result, '1000', '1007',
+                                     self.temp_dump, '--memory', backend], capture_output=True, text=True)
+            self.assertEqual(0, result.returncode, msg=result.stderr)
+            with open(self.temp_dump, encoding='utf-8') as f:
+                self.assertEqual(expected, json.load(f), msg=backend)
+
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
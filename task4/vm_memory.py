@@ -0,0 +1,126 @@
+from array import array
+from itertools import compress
+
+# Модели памяти УВМ. Все поддерживают memory[addr] (непрочитанная ячейка равна 0),
+# memory[addr] = value, dump(start, end) - значения диапазона [start, end] списком
+# и cells() - пары (адрес, значение) записанных ячеек для полного дампа, включая записанные нули.
+# Ячейка 32-битная без знака
+
+PAGE_BITS = 10  # страница 4 КиБ = 1024 ячейки по 4 байта
+PAGE_CELLS = 1 << PAGE_BITS
+PAGE_MASK = PAGE_CELLS - 1
+DEFAULT_DENSE_CELLS = 1 << 16
+
+
+class DictMemory(dict):
+    # Прежняя модель: словарь только записанных ячеек
+    def __missing__(self, addr):
+        return 0
+
+    def dump(self, start, end):
+        return [self.get(addr, 0) for addr in range(start, end + 1)]
+
+    def cells(self):
+        return self.items()
+
+
+class DenseMemory(array):
+    # Непрерывный массив array('I') на адреса [0, size); обращение за его пределами - IndexError.
+    # Чтение идет напрямую в массив, запись еще отмечает ячейку в written
+    __slots__ = ('written',)
+
+    def __new__(cls, size=DEFAULT_DENSE_CELLS):
+        memory = super().__new__(cls, 'I', bytes(4 * size))
+        memory.written = bytearray(size)
+        return memory
+
+    def __setitem__(self, addr, value, setitem=array.__setitem__):
+        setitem(self, addr, value)
+        self.written[addr] = 1
+
+    def dump(self, start, end):
+        # Адреса вне [0, size) - нули; отрицательный start нельзя отдавать в срез как индекс с конца
+        count = max(end + 1 - start, 0)
+        lead = min(max(-start, 0), count)
+        values = self[max(start, 0):max(end + 1, 0)].tolist()
+        return [0] * lead + values + [0] * (count - lead - len(values))
+
+    def cells(self):
+        return zip(compress(range(len(self)), self.written), compress(self, self.written))
+
+
+class PagedMemory:
+    # Разреженная память из страниц array('I'), страница выделяется при первой записи.
+    # Подходит для всего 32-битного адресного пространства (и адресов чуть выше - memory[C] + D).
+    # written - флаги записанных ячеек той же страницы
+    __slots__ = ('pages', 'written')
+
+    def __init__(self):
+        self.pages = {}
+        self.written = {}
+
+    def __getitem__(self, addr):
+        page = self.pages.get(addr >> PAGE_BITS)
+        return page[addr & PAGE_MASK] if page is not None else 0
+
+    def __setitem__(self, addr, value):
+        number = addr >> PAGE_BITS
+        page = self.pages.get(number)
+        if page is None:
+            page = self.pages[number] = array('I', bytes(4 * PAGE_CELLS))
+            self.written[number] = bytearray(PAGE_CELLS)
+        page[addr & PAGE_MASK] = value
+        self.written[number][addr & PAGE_MASK] = 1
+
+    def dump(self, start, end):
+        # Срезы страниц, пересекающих диапазон; невыделенные страницы - нули
+        values = []
+        addr = start
+        while addr <= end:
+            offset = addr & PAGE_MASK
+            count = min(PAGE_CELLS - offset, end + 1 - addr)
+            page = self.pages.get(addr >> PAGE_BITS)
+            values.extend(page[offset:offset + count] if page is not None else [0] * count)
+            addr += count
+        return values
+
+    def cells(self):
+        # Отбор по флагам записи идет в compress, без цикла по всем ячейкам страницы
+        for number in sorted(self.pages):
+            base = number << PAGE_BITS
+            written = self.written[number]
+            yield from zip(compress(range(base, base + PAGE_CELLS), written),
+                           compress(self.pages[number], written))
+
+
+def to_paged(memory):
+    # Перенос плотной памяти в страничную: выделяются только страницы с записанными ячейками
+    paged = PagedMemory()
+    for start in range(0, len(memory), PAGE_CELLS):
+        flags = memory.written[start:start + PAGE_CELLS]
+        if any(flags):
+            chunk = memory[start:start + PAGE_CELLS]
+            page = array('I', bytes(4 * PAGE_CELLS))
+            page[:len(chunk)] = chunk
+            written = bytearray(PAGE_CELLS)
+            written[:len(flags)] = flags
+            paged.pages[start >> PAGE_BITS] = page
+            paged.written[start >> PAGE_BITS] = written
+    return paged
+
+
+# auto - плотная память, при первом обращении за ее пределы переносится в страничную.
+# По умолчанию - словарь: обращение к нему не вызывает Python-методов и быстрее массивов,
+# массивы выигрывают только в расходе памяти
+BACKENDS = {
+    'dict': DictMemory,
+    'auto': DenseMemory,
+    'paged': PagedMemory,
+    'dense': DenseMemory,
+}
+
+
+def create_memory(kind='dict', size=DEFAULT_DENSE_CELLS):
+    if kind in ('auto', 'dense'):
+        return DenseMemory(size)
+    return BACKENDS[kind]()